@@ -0,0 +1,95 @@
+"""Repeated overlapping /country-stats range queries with and without in-process aggregated stats cache.
+
+Each query covers 30 days and the next query is shifted by 3 days, so most of its dates were already queried.
+"""
+
+import asyncio
+import datetime
+import time
+
+from benchmark_utils import moto_server, print_table
+from types_aiobotocore_s3 import S3Client
+
+from city_details_proccesing import Stats
+from configuration import AGGREGATED_STATS_FILE_NAME
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_aggregated_stats_for_country_and_date,
+    get_s3_client,
+)
+from stats_cache import StatsCache
+
+COUNTRY_COUNT = 5
+DAY_COUNT = 90
+QUERY_DAYS = 30
+QUERY_SHIFT_DAYS = 3
+START_DATE = datetime.date(2024, 1, 1)
+
+
+async def populate(s3_client: S3Client, storage_state: StorageState) -> None:
+    for country_index in range(COUNTRY_COUNT):
+        country = f"country-{country_index}"
+        await create_bucket(s3_client, country, storage_state)
+        await asyncio.gather(
+            *(
+                s3_client.put_object(
+                    Bucket=country,
+                    Key=f"{START_DATE + datetime.timedelta(days)}/{AGGREGATED_STATS_FILE_NAME}",
+                    Body=b"",
+                    Metadata=Stats.create_stats_from_sums(
+                        1, 1, 0, 1
+                    ).create_s3_metadata_from_stats(),
+                )
+                for days in range(DAY_COUNT)
+            )
+        )
+
+
+async def run_queries(s3_client: S3Client, storage_state: StorageState) -> float:
+    start = time.perf_counter()
+    for first_day in range(0, DAY_COUNT - QUERY_DAYS + 1, QUERY_SHIFT_DAYS):
+        await asyncio.gather(
+            *(
+                get_aggregated_stats_for_country_and_date(
+                    f"country-{country_index}",
+                    str(START_DATE + datetime.timedelta(days)),
+                    s3_client,
+                    storage_state,
+                )
+                for country_index in range(COUNTRY_COUNT)
+                for days in range(first_day, first_day + QUERY_DAYS)
+            )
+        )
+    return time.perf_counter() - start
+
+
+async def measure() -> list[tuple[str, str, str, str]]:
+    rows = []
+    async with get_s3_client() as s3_client:
+        await populate(s3_client, StorageState())
+        for name, max_entries in (("disabled", 0), ("enabled", 100_000)):
+            cache = StatsCache(max_entries, ttl_s=3600)
+            duration_s = await run_queries(
+                s3_client, StorageState(aggregated_stats_cache=cache)
+            )
+            lookups = cache.hits + cache.misses
+            rows.append(
+                (
+                    name,
+                    f"{duration_s:.2f}",
+                    str(cache.misses),
+                    f"{cache.hits / lookups:.2f}",
+                )
+            )
+    return rows
+
+
+def main() -> None:
+    with moto_server():
+        rows = asyncio.run(measure())
+    print_table(("cache", "total s", "S3 lookups", "hit ratio"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Aggregation of one country and date from per-file head_object metadata and from single listing of city stats index.
+
+Files of the "head_object" country have no index entries, as files uploaded before the index existed.
+"""
+
+import asyncio
+import datetime
+import time
+from collections import Counter
+
+from benchmark_utils import moto_server, print_table
+from types_aiobotocore_s3 import S3Client
+
+from city_details_proccesing import Stats
+from s3_communication import (
+    StorageState,
+    city_stats_index_key,
+    create_aggregated_stats_for_country_and_date,
+    create_bucket,
+    get_s3_client,
+)
+
+CITY_COUNTS = (10, 100, 1000)
+DATE = str(datetime.date(2024, 1, 1))
+STATS = Stats.create_stats_from_sums(10, 100, 0, 50)
+
+
+async def populate(
+    country: str,
+    city_count: int,
+    indexed: bool,
+    s3_client: S3Client,
+    storage_state: StorageState,
+) -> None:
+    await create_bucket(s3_client, country, storage_state)
+    semaphore = asyncio.Semaphore(50)
+
+    async def put_city(city_index: int) -> None:
+        async with semaphore:
+            await s3_client.put_object(
+                Bucket=country,
+                Key=f"{DATE}/city-{city_index}",
+                Body=b"[]",
+                Metadata=STATS.create_s3_metadata_from_stats(),
+            )
+            if indexed:
+                await s3_client.put_object(
+                    Bucket=country,
+                    Key=city_stats_index_key(DATE, f"city-{city_index}", STATS),
+                    Body=b"",
+                )
+
+    await asyncio.gather(*(put_city(city_index) for city_index in range(city_count)))
+
+
+async def measure() -> list[tuple[str, str, str, str]]:
+    s3_calls: Counter[str] = Counter()
+
+    def count_call(event_name: str, **_kwargs: object) -> None:
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    rows = []
+    storage_state = StorageState()
+    async with get_s3_client() as s3_client:
+        for city_count in CITY_COUNTS:
+            for name, indexed in (("head_object", False), ("index listing", True)):
+                country = f"country-{city_count}-{'indexed' if indexed else 'legacy'}"
+                await populate(country, city_count, indexed, s3_client, storage_state)
+                s3_client.meta.events.register("before-call.s3", count_call)
+                s3_calls.clear()
+                start = time.perf_counter()
+                await create_aggregated_stats_for_country_and_date(
+                    country, DATE, s3_client, storage_state
+                )
+                duration_s = time.perf_counter() - start
+                s3_client.meta.events.unregister("before-call.s3", count_call)
+                rows.append(
+                    (
+                        str(city_count),
+                        name,
+                        f"{duration_s:.3f}",
+                        ", ".join(
+                            f"{call}={count}"
+                            for call, count in sorted(s3_calls.items())
+                        ),
+                    )
+                )
+    return rows
+
+
+def main() -> None:
+    with moto_server():
+        rows = asyncio.run(measure())
+    print_table(("cities", "stats source", "total s", "S3 calls"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Total wall time of 30 day backfill by one /process-range request and by 30 /process-request requests.
+
+Both run in the app server against stand-in ref server, which injects random per-city latency the same way as
+ref_server.py does. Each case backfills different month, so neither overwrites data of the other.
+"""
+
+import asyncio
+import datetime
+import time
+
+import aiohttp
+from benchmark_utils import (
+    APP_SERVER,
+    app_server,
+    moto_server,
+    print_table,
+    stand_in_ref_server,
+)
+
+CITY_COUNT = 50
+COUNTRY_COUNT = 5
+BUS_COUNT = 1_000
+MAX_LATENCY_S = 0.5
+DAYS = 30
+
+
+async def wait_for_job(session: aiohttp.ClientSession, job_id: str) -> dict:
+    while True:
+        async with session.get(f"{APP_SERVER}/jobs/{job_id}") as response:
+            job_status = await response.json()
+        if job_status["status"] not in ("queued", "running"):
+            return job_status
+        await asyncio.sleep(0.1)
+
+
+async def single_date_requests(start_date: datetime.date) -> int:
+    """Return number of failed dates."""
+    async with aiohttp.ClientSession() as session:
+
+        async def ingest_date(date: datetime.date) -> dict:
+            async with session.post(
+                f"{APP_SERVER}/process-request?date={date}"
+            ) as response:
+                job_id = (await response.json())["id"]
+            return await wait_for_job(session, job_id)
+
+        job_statuses = await asyncio.gather(
+            *(
+                ingest_date(start_date + datetime.timedelta(days))
+                for days in range(DAYS)
+            )
+        )
+    return sum(job_status["status"] != "finished" for job_status in job_statuses)
+
+
+async def range_request(start_date: datetime.date) -> int:
+    """Return number of failed dates."""
+    end_date = start_date + datetime.timedelta(DAYS - 1)
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+            f"{APP_SERVER}/process-range?from={start_date}&to={end_date}"
+        ) as response:
+            backfill_id = (await response.json())["id"]
+        backfill_status = await wait_for_job(session, backfill_id)
+    return backfill_status["dates_failed"]
+
+
+CASES = {
+    "30x /process-request": (single_date_requests, datetime.date(2024, 4, 1)),
+    "1x /process-range": (range_request, datetime.date(2024, 5, 1)),
+}
+
+
+def main() -> None:
+    rows = []
+    with moto_server(), stand_in_ref_server(
+        CITY_COUNT, COUNTRY_COUNT, BUS_COUNT, MAX_LATENCY_S
+    ):
+        for case_name, (ingest, start_date) in CASES.items():
+            with app_server():
+                start = time.perf_counter()
+                failed = asyncio.run(ingest(start_date))
+                duration_s = time.perf_counter() - start
+            rows.append(
+                (
+                    case_name,
+                    f"{duration_s:.2f}",
+                    f"{DAYS * CITY_COUNT / duration_s:.1f}",
+                    failed,
+                )
+            )
+    print_table(("case", "total s", "city days/s", "failed dates"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Shared helpers for benchmarks.
+
+Benchmarks are standalone scripts. Run them from the repo folder with src on the python path, for example:
+
+```shell
+PYTHONPATH=src poetry run python benchmarks/city_stats_parsing.py
+```
+"""
+
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Iterator
+
+import uvicorn
+from aiohttp import web
+
+from configuration import REFERENCE_SERVER_ADDRESS, REFERENCE_SERVER_PORT
+from mocked_moto import mock_boto
+
+BENCHMARK_DATE = datetime.date(2024, 2, 1)
+
+
+def generate_bus_details(rng: random.Random) -> dict[str, Any]:
+    """Single bus details in the same shape as ref_server.py serializes them."""
+    delay_s = rng.randint(0, 90) * 60
+    departure_time = datetime.datetime.combine(
+        BENCHMARK_DATE, datetime.time()
+    ) + datetime.timedelta(minutes=rng.randint(0, 720))
+    return {
+        "departure-time": departure_time.isoformat(),
+        "bus-type": f"BUS-{rng.randint(100, 113)}",
+        "passengers": rng.randint(5, 100),
+        "delay": f"PT{delay_s}S" if delay_s else "P0D",
+        "accident": rng.random() > 0.9,
+    }
+
+
+def iter_raw_city_data(
+    bus_count: int, chunk_size: int = 64 * 1024, seed: int = 0
+) -> Iterator[bytes]:
+    """Yield ref_server-shaped raw city data in chunks without ever holding the whole payload."""
+    rng = random.Random(seed)
+    pending = bytearray(b"[")
+    for index in range(bus_count):
+        if index:
+            pending += b","
+        pending += json.dumps(generate_bus_details(rng)).encode("utf-8")
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+    pending += b"]"
+    yield bytes(pending)
+
+
+def generate_raw_city_data(bus_count: int, seed: int = 0) -> bytes:
+    return b"".join(iter_raw_city_data(bus_count, seed=seed))
+
+
+def peak_rss_mib() -> float:
+    """Peak resident set size of current process in MiB (Linux reports KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_measured(
+    function: Callable[..., Any], args: tuple[Any, ...], queue: multiprocessing.Queue
+) -> None:
+    start = time.perf_counter()
+    function(*args)
+    queue.put((time.perf_counter() - start, peak_rss_mib()))
+
+
+def measure_in_fresh_process(
+    function: Callable[..., Any], *args: Any
+) -> tuple[float, float]:
+    """Run function in a fresh process so that its peak RSS is not polluted by other cases.
+
+    Returns wall time in seconds and peak RSS in MiB.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_measured, args=(function, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _run_returning(
+    function: Callable[..., Any], args: tuple[Any, ...], queue: multiprocessing.Queue
+) -> None:
+    queue.put(function(*args))
+
+
+def run_in_fresh_process(function: Callable[..., Any], *args: Any) -> Any:
+    """Run function in a fresh process and return its result. Function measures itself."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_returning, args=(function, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def print_table(header: tuple[str, ...], rows: list[tuple[Any, ...]]) -> None:
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def percentile(values: list[float], percent: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def _wait_for_server(url: str, timeout_s: float = 60) -> None:
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            urllib.request.urlopen(url)
+            return
+        except (urllib.error.URLError, ConnectionError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _run_stand_in_ref_server(
+    city_count: int, country_count: int, bus_count: int, max_latency_s: float
+) -> None:
+    raw_city_data = generate_raw_city_data(bus_count)
+    rng = random.Random(0)
+
+    async def get_cities(request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "id": city_id,
+                    "name": f"City {city_id}",
+                    "country": f"Country {city_id % country_count}",
+                }
+                for city_id in range(city_count)
+            ]
+        )
+
+    async def get_city_stats(request: web.Request) -> web.Response:
+        # Same kind of injected latency as in ref_server.py
+        await asyncio.sleep(rng.random() * max_latency_s)
+        return web.Response(body=raw_city_data, content_type="application/json")
+
+    app = web.Application()
+    app.add_routes(
+        [
+            web.get("/cities", get_cities),
+            web.get("/cities/{city_id}/stats", get_city_stats),
+        ]
+    )
+    web.run_app(
+        app, host=REFERENCE_SERVER_ADDRESS, port=REFERENCE_SERVER_PORT, print=None
+    )
+
+
+@contextlib.contextmanager
+def stand_in_ref_server(
+    city_count: int, country_count: int, bus_count: int, max_latency_s: float = 0
+) -> Iterator[None]:
+    """Run ref server replacement serving same pre-generated data for every city and date."""
+    server_process = multiprocessing.get_context("spawn").Process(
+        target=_run_stand_in_ref_server,
+        args=(city_count, country_count, bus_count, max_latency_s),
+    )
+    server_process.start()
+    _wait_for_server(
+        f"http://{REFERENCE_SERVER_ADDRESS}:{REFERENCE_SERVER_PORT}/cities"
+    )
+    try:
+        yield
+    finally:
+        server_process.kill()
+
+
+APP_SERVER = "http://127.0.0.1:8080"
+
+
+def _run_app_server() -> None:
+    uvicorn.run("app_server:app", host="127.0.0.1", port=8080, log_level="warning")
+
+
+@contextlib.contextmanager
+def app_server(**environment: str) -> Iterator[None]:
+    """Run app_server:app in uvicorn in separate process with given environment variables.
+
+    Spawned process imports configuration together with the benchmark module, before its target runs, so environment
+    variables are set already when the process is started.
+    """
+    server_process = multiprocessing.get_context("spawn").Process(
+        target=_run_app_server
+    )
+    previous_environment = os.environ.copy()
+    os.environ.update(environment)
+    try:
+        server_process.start()
+    finally:
+        os.environ.clear()
+        os.environ.update(previous_environment)
+    _wait_for_server(f"{APP_SERVER}/schema")
+    try:
+        yield
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+
+def _run_moto_server() -> None:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    with mock_boto():
+        while True:
+            time.sleep(1)
+
+
+@contextlib.contextmanager
+def moto_server() -> Iterator[None]:
+    """Run mocked S3 in separate process, so that it does not compete for GIL with measured code."""
+    server_process = multiprocessing.get_context("spawn").Process(
+        target=_run_moto_server
+    )
+    server_process.start()
+    time.sleep(1)
+    try:
+        yield
+    finally:
+        server_process.kill()
@@ -0,0 +1,94 @@
+"""Throughput of /city-analytics scan of stored raw city data with different numbers of stats executor workers.
+
+Raw data is stored gzip compressed, as by default. Throughput is measured in MB of decoded raw JSON per second.
+Workers parse and aggregate parts of objects while the event loop streams and decodes further objects, so throughput
+grows with workers until CPU cores, S3 or decoding on the event loop are saturated.
+"""
+
+import asyncio
+import datetime
+import os
+import sys
+import time
+
+from benchmark_utils import generate_raw_city_data, moto_server, print_table
+
+from city_details_proccesing import City
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_s3_client,
+    push_city_stats_to_s3,
+    scan_city_analytics,
+)
+from stats_executor import StatsExecutor, default_executor_kind
+
+CITY_COUNT = 8
+COUNTRY = "country-analytics-scan"
+BUS_COUNT = 100_000
+DATE = datetime.date(2024, 1, 1)
+WORKER_COUNTS = (1, 2, 4, 8)
+
+
+async def populate() -> int:
+    """Return decoded size of all stored raw data."""
+    raw_city_data = generate_raw_city_data(BUS_COUNT)
+    storage_state = StorageState()
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, COUNTRY, storage_state)
+        for city_index in range(CITY_COUNT):
+            await push_city_stats_to_s3(
+                City(f"city-{city_index}", COUNTRY, city_index),
+                DATE,
+                raw_city_data,
+                s3_client,
+                storage_state,
+            )
+    return CITY_COUNT * len(raw_city_data)
+
+
+async def scan(worker_count: int) -> float:
+    stats_executor = StatsExecutor(
+        default_executor_kind(), worker_count, max_pending=2 * worker_count
+    )
+    stats_executor.start()
+    storage_state = StorageState()
+    try:
+        async with get_s3_client() as s3_client:
+            start = time.perf_counter()
+            groups = await scan_city_analytics(
+                [COUNTRY],
+                [str(DATE)],
+                "bus-type",
+                s3_client,
+                storage_state,
+                stats_executor,
+            )
+            duration_s = time.perf_counter() - start
+    finally:
+        stats_executor.shutdown()
+    assert sum(group.bus_count for group in groups[COUNTRY].values()) == (
+        CITY_COUNT * BUS_COUNT
+    )
+    return duration_s
+
+
+def main(worker_counts: tuple[int, ...]) -> None:
+    rows = []
+    with moto_server():
+        raw_size = asyncio.run(populate())
+        for worker_count in worker_counts:
+            duration_s = asyncio.run(scan(worker_count))
+            rows.append(
+                (
+                    worker_count,
+                    f"{duration_s:.2f}",
+                    f"{raw_size / 1_000_000 / duration_s:.1f}",
+                )
+            )
+    print(f"{raw_size / 1_000_000:.0f} MB of raw data, {os.cpu_count()} CPUs")
+    print_table(("workers", "scan s", "MB/s"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or WORKER_COUNTS)
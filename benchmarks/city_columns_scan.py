@@ -0,0 +1,133 @@
+"""Bytes stored, bytes read and scan time of analytics queries over raw JSON and over columnar copy of city data.
+
+Columnar objects are read from memory through the same range reader interface that reads them from S3. Time range
+query is also run on data sorted by departure time, where row groups outside the range are skipped.
+"""
+
+import asyncio
+import datetime
+import json
+import time
+from collections import Counter
+from typing import Any, Callable
+
+from benchmark_utils import BENCHMARK_DATE, generate_raw_city_data, print_table
+
+from city_columns import ColumnFilters, encode_city_columns, read_city_columns
+from configuration import CITY_COLUMNS_ROW_GROUP_SIZE
+
+BUS_COUNT = 500_000
+MORNING_START = datetime.datetime.combine(
+    BENCHMARK_DATE, datetime.time(6), tzinfo=datetime.UTC
+)
+MORNING_END = MORNING_START + datetime.timedelta(hours=3)
+
+
+def passengers_by_bus_type(rows: dict[str, list[Any]]) -> Counter[str]:
+    passengers: Counter[str] = Counter()
+    for bus_type, bus_passengers in zip(rows["bus-type"], rows["passengers"]):
+        passengers[bus_type] += bus_passengers
+    return passengers
+
+
+def departures_by_minute(rows: dict[str, list[Any]]) -> Counter[int]:
+    return Counter(departure_s // 60 % 60 for departure_s in rows["departure-time"])
+
+
+QUERIES: list[tuple[str, list[str], ColumnFilters, Callable[[dict], Counter]]] = [
+    ("passengers by bus type", ["bus-type", "passengers"], {}, passengers_by_bus_type),
+    (
+        "morning departures by minute",
+        ["departure-time"],
+        {
+            "departure-time": (
+                int(MORNING_START.timestamp()),
+                int(MORNING_END.timestamp()),
+            )
+        },
+        departures_by_minute,
+    ),
+]
+
+
+def json_scan(
+    raw_city_data: bytes, columns: list[str], filters: ColumnFilters
+) -> dict[str, list[Any]]:
+    rows: dict[str, list[Any]] = {name: [] for name in columns}
+    for bus_details in json.loads(raw_city_data):
+        values = {
+            "departure-time": int(
+                datetime.datetime.fromisoformat(bus_details["departure-time"])
+                .replace(tzinfo=datetime.UTC)
+                .timestamp()
+            ),
+            "bus-type": bus_details["bus-type"],
+            "passengers": bus_details["passengers"],
+        }
+        if all(low <= values[name] <= high for name, (low, high) in filters.items()):  # type: ignore[operator]
+            for name in columns:
+                rows[name].append(values[name])
+    return rows
+
+
+async def columnar_scan(
+    body: bytes, columns: list[str], filters: ColumnFilters
+) -> tuple[dict[str, list[Any]], int]:
+    bytes_read = 0
+
+    async def read_range(start: int, end: int) -> bytes:
+        nonlocal bytes_read
+        bytes_read += end - start
+        return body[start:end]
+
+    rows = await read_city_columns(read_range, len(body), columns, filters)
+    return rows, bytes_read
+
+
+def main() -> None:
+    raw_city_data = generate_raw_city_data(BUS_COUNT)
+    city_data = json.loads(raw_city_data)
+    sorted_city_data = sorted(
+        city_data, key=lambda bus_details: bus_details["departure-time"]
+    )
+    layouts = {
+        "columnar": encode_city_columns(city_data, CITY_COLUMNS_ROW_GROUP_SIZE),
+        "columnar, sorted": encode_city_columns(
+            sorted_city_data, CITY_COLUMNS_ROW_GROUP_SIZE
+        ),
+    }
+    del city_data, sorted_city_data
+
+    rows = []
+    for query_name, columns, filters, aggregate in QUERIES:
+        start = time.perf_counter()
+        expected = aggregate(json_scan(raw_city_data, columns, filters))
+        rows.append(
+            (
+                query_name,
+                "json",
+                f"{len(raw_city_data) / 2**20:.1f}",
+                f"{len(raw_city_data) / 2**20:.1f}",
+                f"{time.perf_counter() - start:.2f}",
+            )
+        )
+        for layout, body in layouts.items():
+            start = time.perf_counter()
+            columnar_rows, bytes_read = asyncio.run(
+                columnar_scan(body, columns, filters)
+            )
+            assert aggregate(columnar_rows) == expected
+            rows.append(
+                (
+                    query_name,
+                    layout,
+                    f"{len(body) / 2**20:.1f}",
+                    f"{bytes_read / 2**20:.2f}",
+                    f"{time.perf_counter() - start:.2f}",
+                )
+            )
+    print_table(("query", "format", "stored MiB", "read MiB", "scan s"), rows)
+
+
+if __name__ == "__main__":
+    main()
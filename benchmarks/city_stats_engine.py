@@ -0,0 +1,68 @@
+"""Compare bus by bus stats computation with columnar batched CityStatsAccumulator.
+
+Both paths get already parsed ref server shaped data, so only the stats computation is measured.
+Results of both paths are checked to be identical.
+"""
+
+import json
+import sys
+import timeit
+from typing import Any
+
+import isodate  # type:ignore[import-untyped] # Stub files not published
+from benchmark_utils import generate_raw_city_data, print_table
+
+from city_details_proccesing import Stats, create_city_stats_from_city_data
+
+BUS_COUNTS = (1_000, 10_000, 100_000)
+REPEATS = 5
+
+
+def bus_by_bus_stats(city_data: list[dict[str, Any]]) -> Stats:
+    """Previous implementation of create_city_stats_from_city_data."""
+    total_delay_s = 0.0
+    total_passangers = 0
+    accident_count = 0
+    bus_count = len(city_data)
+    for bus_details in city_data:
+        total_delay_s += isodate.parse_duration(bus_details["delay"]).total_seconds()
+        total_passangers += bus_details["passengers"]
+        accident_count += bus_details["accident"]
+
+    return Stats.create_stats_from_sums(
+        bus_count=bus_count,
+        passenger_count=total_passangers,
+        accident_count=accident_count,
+        total_delay_s=total_delay_s,
+    )
+
+
+def main(bus_counts: tuple[int, ...]) -> None:
+    rows = []
+    for bus_count in bus_counts:
+        city_data = json.loads(generate_raw_city_data(bus_count))
+        assert bus_by_bus_stats(city_data) == create_city_stats_from_city_data(
+            city_data
+        )
+        timings = {}
+        for name, function in (
+            ("bus by bus", bus_by_bus_stats),
+            ("columnar", create_city_stats_from_city_data),
+        ):
+            timings[name] = min(
+                timeit.repeat(lambda: function(city_data), number=1, repeat=REPEATS)
+            )
+            rows.append(
+                (
+                    bus_count,
+                    name,
+                    f"{timings[name] * 1000:.2f}",
+                    f"{bus_count / timings[name]:,.0f}",
+                    f"{timings['bus by bus'] / timings[name]:.1f}x",
+                )
+            )
+    print_table(("buses", "engine", "ms", "buses/s", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or BUS_COUNTS)
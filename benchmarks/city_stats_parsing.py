@@ -0,0 +1,62 @@
+"""Compare full json.loads stats computation with incremental CityStatsParser.
+
+Reports peak RSS and throughput of computing single city stats from a ref server response
+that arrives in 64 KiB chunks. Each case runs in a fresh process.
+"""
+
+import json
+import sys
+
+from benchmark_utils import (
+    iter_raw_city_data,
+    measure_in_fresh_process,
+    print_table,
+)
+
+from city_details_proccesing import CityStatsParser, create_city_stats_from_city_data
+
+BUS_COUNTS = (1_000, 100_000, 1_000_000)
+
+
+def full_parse(bus_count: int) -> None:
+    """Previous path: read whole body, json.loads it and walk the list."""
+    raw_city_data = b"".join(iter_raw_city_data(bus_count))
+    create_city_stats_from_city_data(json.loads(raw_city_data))
+
+
+def streaming_parse(bus_count: int) -> None:
+    parser = CityStatsParser()
+    for chunk in iter_raw_city_data(bus_count):
+        parser.feed(chunk)
+    parser.finish()
+
+
+def data_generation_only(bus_count: int) -> None:
+    """Baseline cost of generating the payload, included in both paths."""
+    for _ in iter_raw_city_data(bus_count):
+        pass
+
+
+def main(bus_counts: tuple[int, ...]) -> None:
+    rows = []
+    for bus_count in bus_counts:
+        for name, function in (
+            ("generation only", data_generation_only),
+            ("full", full_parse),
+            ("streaming", streaming_parse),
+        ):
+            duration_s, peak_rss = measure_in_fresh_process(function, bus_count)
+            rows.append(
+                (
+                    bus_count,
+                    name,
+                    f"{peak_rss:.1f}",
+                    f"{duration_s:.3f}",
+                    f"{bus_count / duration_s:,.0f}",
+                )
+            )
+    print_table(("buses", "path", "peak RSS MiB", "total s", "buses/s"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or BUS_COUNTS)
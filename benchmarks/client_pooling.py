@@ -0,0 +1,96 @@
+"""Requests per second of /country-stats work with S3 client created per request and with one shared client.
+
+The measured work is the same as in /country-stats handler: list buckets and get aggregated stats of each country
+and date. Client creation includes credentials resolution, service model loading and new connections.
+"""
+
+import asyncio
+import datetime
+import sys
+import time
+
+from benchmark_utils import moto_server, print_table
+from types_aiobotocore_s3 import S3Client
+
+from city_details_proccesing import Stats
+from configuration import AGGREGATED_STATS_FILE_NAME
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_aggregated_stats_for_country_and_date,
+    get_s3_client,
+)
+
+COUNTRY_COUNT = 5
+DATES = [str(datetime.date(2024, 2, day)) for day in range(1, 8)]
+REQUEST_COUNT = 50
+CONCURRENCIES = (1, 10)
+
+
+async def country_stats(s3_client: S3Client, storage_state: StorageState) -> None:
+    countries = [
+        bucket["Name"] for bucket in (await s3_client.list_buckets())["Buckets"]
+    ]
+    await asyncio.gather(
+        *(
+            get_aggregated_stats_for_country_and_date(
+                country, date, s3_client, storage_state
+            )
+            for country in countries
+            for date in DATES
+        )
+    )
+
+
+async def per_request_client(_: S3Client, storage_state: StorageState) -> None:
+    async with get_s3_client() as s3_client:
+        await country_stats(s3_client, storage_state)
+
+
+async def populate(s3_client: S3Client, storage_state: StorageState) -> None:
+    for country_index in range(COUNTRY_COUNT):
+        country = f"country-{country_index}"
+        await create_bucket(s3_client, country, storage_state)
+        for date in DATES:
+            await s3_client.put_object(
+                Bucket=country,
+                Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}",
+                Body=b"",
+                Metadata=Stats.create_stats_from_sums(
+                    1, 1, 0, 1
+                ).create_s3_metadata_from_stats(),
+            )
+
+
+async def measure(concurrency: int) -> dict[str, float]:
+    requests_per_s = {}
+    storage_state = StorageState()
+    async with get_s3_client() as shared_s3_client:
+        await populate(shared_s3_client, storage_state)
+        for name, request in (
+            ("per request", per_request_client),
+            ("shared", country_stats),
+        ):
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited_request() -> None:
+                async with semaphore:
+                    await request(shared_s3_client, storage_state)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(limited_request() for _ in range(REQUEST_COUNT)))
+            requests_per_s[name] = REQUEST_COUNT / (time.perf_counter() - start)
+    return requests_per_s
+
+
+def main(concurrencies: tuple[int, ...]) -> None:
+    rows = []
+    with moto_server():
+        for concurrency in concurrencies:
+            for name, value in asyncio.run(measure(concurrency)).items():
+                rows.append((concurrency, name, f"{value:.1f}"))
+    print_table(("concurrency", "S3 client", "requests/s"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or CONCURRENCIES)
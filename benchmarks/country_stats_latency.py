@@ -0,0 +1,79 @@
+"""Latency of /country-stats while large /process-request ingestion runs in the same app.
+
+Compares stats computation inline on the event loop with stats computation in stats executor. App runs in uvicorn in
+separate process for each executor kind, as executor kind is read from STATS_EXECUTOR_KIND environment variable.
+Mocked S3 runs in its own process, but it is still slow under load, so absolute latencies are dominated by it. Compare
+tail latencies between executor kinds rather than absolute values.
+"""
+
+import asyncio
+import sys
+import time
+
+import aiohttp
+from benchmark_utils import (
+    APP_SERVER,
+    app_server,
+    moto_server,
+    percentile,
+    print_table,
+    stand_in_ref_server,
+)
+
+CITY_COUNT = 10
+COUNTRY_COUNT = 3
+BUS_COUNT = 200_000
+IDLE_QUERIES = 10
+EXECUTOR_KINDS = ("inline", "thread", "process")
+COUNTRY_STATS_URL = f"{APP_SERVER}/country-stats?from=2024-01-01&to2024-01-31"
+
+
+async def measure() -> tuple[float, float, list[float]]:
+    latencies_s = []
+    async with aiohttp.ClientSession() as session:
+        # Warm up buckets and aggregated stats.
+        await (await session.get(COUNTRY_STATS_URL)).read()
+        idle_start = time.perf_counter()
+        for _ in range(IDLE_QUERIES):
+            await (await session.get(COUNTRY_STATS_URL)).read()
+        idle_latency_s = (time.perf_counter() - idle_start) / IDLE_QUERIES
+
+        start = time.perf_counter()
+        job = await (
+            await session.post(f"{APP_SERVER}/process-request?date=2024-02-01")
+        ).json()
+        while job["status"] in ("queued", "running"):
+            request_start = time.perf_counter()
+            await (await session.get(COUNTRY_STATS_URL)).read()
+            latencies_s.append(time.perf_counter() - request_start)
+            await asyncio.sleep(0.01)
+            job = await (await session.get(f"{APP_SERVER}/jobs/{job['id']}")).json()
+        assert job["cities_failed"] == 0
+        return idle_latency_s, time.perf_counter() - start, latencies_s
+
+
+def main(executor_kinds: tuple[str, ...]) -> None:
+    rows = []
+    with moto_server(), stand_in_ref_server(CITY_COUNT, COUNTRY_COUNT, BUS_COUNT):
+        for kind in executor_kinds:
+            with app_server(STATS_EXECUTOR_KIND=kind):
+                idle_latency_s, ingestion_s, latencies_s = asyncio.run(measure())
+            rows.append(
+                (
+                    kind,
+                    f"{idle_latency_s * 1000:.1f}",
+                    f"{ingestion_s:.2f}",
+                    len(latencies_s),
+                    f"{percentile(latencies_s, 50) * 1000:.1f}",
+                    f"{percentile(latencies_s, 99) * 1000:.1f}",
+                    f"{max(latencies_s) * 1000:.1f}",
+                )
+            )
+    print_table(
+        ("executor", "idle ms", "ingestion s", "queries", "p50 ms", "p99 ms", "max ms"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main(tuple(sys.argv[1:]) or EXECUTOR_KINDS)
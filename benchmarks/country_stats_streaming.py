@@ -0,0 +1,163 @@
+"""Time to first byte, total time and peak RSS of five year long /country-stats query, full and streamed.
+
+The measured work is the same as in /country-stats and /country-stats/stream handlers. Full response gathers stats of
+all countries and dates and encodes them at once. Streamed response encodes NDJSON lines of each chunk as soon as it
+is read. Stats are read from yearly rollups. Cache is disabled and each case runs in a fresh process, so that peak RSS
+reflects only the measured response.
+"""
+
+import asyncio
+import datetime
+import time
+from typing import Any, AsyncIterator
+
+from benchmark_utils import (
+    moto_server,
+    peak_rss_mib,
+    print_table,
+    run_in_fresh_process,
+)
+from litestar.serialization import encode_json
+from types_aiobotocore_s3 import S3Client
+
+from city_details_proccesing import Stats
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_aggregated_stats_for_country_and_dates,
+    get_s3_client,
+    iter_aggregated_stats_for_countries_and_dates,
+)
+from stats_cache import StatsCache
+from stats_rollups import RollupDays, encode_rollup, yearly_rollup_key
+
+COUNTRY_COUNT = 50
+START_DATE = datetime.date(2019, 1, 1)
+END_DATE = datetime.date(2023, 12, 31)
+DATES = [
+    str(START_DATE + datetime.timedelta(days))
+    for days in range((END_DATE - START_DATE).days + 1)
+]
+COUNTRIES = [f"country-streaming-{index}" for index in range(COUNTRY_COUNT)]
+
+
+def yearly_rollup_days(year: int, stats: Stats) -> RollupDays:
+    rollup_days = RollupDays()
+    for date in DATES:
+        if date.startswith(str(year)):
+            rollup_days[date] = (stats, 0)
+    return rollup_days
+
+
+async def populate() -> None:
+    stats = Stats.create_stats_from_sums(100, 1000, 1, 6000)
+    storage_state = StorageState()
+    async with get_s3_client() as s3_client:
+        for country in COUNTRIES:
+            await create_bucket(s3_client, country, storage_state)
+            await asyncio.gather(
+                *(
+                    s3_client.put_object(
+                        Bucket=country,
+                        Key=yearly_rollup_key(str(year)),
+                        Body=encode_rollup(yearly_rollup_days(year, stats)),
+                    )
+                    for year in range(START_DATE.year, END_DATE.year + 1)
+                )
+            )
+
+
+async def full_response(
+    s3_client: S3Client, storage_state: StorageState
+) -> AsyncIterator[bytes]:
+    stats_by_country = await asyncio.gather(
+        *(
+            get_aggregated_stats_for_country_and_dates(
+                country, DATES, s3_client, storage_state
+            )
+            for country in COUNTRIES
+        )
+    )
+    results: dict[str, dict[str, dict[str, Any]]] = {}
+    for country, stats_by_date in zip(COUNTRIES, stats_by_country):
+        results[country] = {
+            date: stats_by_date[date].create_response_from_stats() for date in DATES
+        }
+    yield encode_json(results)
+
+
+async def streamed_response(
+    s3_client: S3Client, storage_state: StorageState
+) -> AsyncIterator[bytes]:
+    async for country, stats_by_date in iter_aggregated_stats_for_countries_and_dates(
+        COUNTRIES, DATES, s3_client, storage_state
+    ):
+        yield b"".join(
+            encode_json(
+                {
+                    "country": country,
+                    "date": date,
+                    "stats": stats.create_response_from_stats(),
+                }
+            )
+            + b"\n"
+            for date, stats in stats_by_date.items()
+        )
+
+
+async def no_response(
+    s3_client: S3Client, storage_state: StorageState
+) -> AsyncIterator[bytes]:
+    """Baseline of imports and S3 client."""
+    yield b""
+
+
+RESPONSES = {"none": no_response, "full": full_response, "streamed": streamed_response}
+
+
+async def read_response(response_name: str) -> tuple[float, float, int]:
+    storage_state = StorageState(aggregated_stats_cache=StatsCache(0, ttl_s=3600))
+    # Only rollups are stored, so registry is told that all dates have data.
+    storage_state.country_registry.update(
+        {country: set(DATES) for country in COUNTRIES}
+    )
+    first_byte_s = None
+    size = 0
+    async with get_s3_client() as s3_client:
+        start = time.perf_counter()
+        async for chunk in RESPONSES[response_name](s3_client, storage_state):
+            if first_byte_s is None:
+                first_byte_s = time.perf_counter() - start
+            size += len(chunk)
+        return first_byte_s or 0, time.perf_counter() - start, size
+
+
+def measure(response_name: str) -> tuple[float, float, int, float]:
+    """Return time to first byte, total time, response size and peak RSS in MiB."""
+    return *asyncio.run(read_response(response_name)), peak_rss_mib()
+
+
+def main() -> None:
+    rows = []
+    with moto_server():
+        asyncio.run(populate())
+        for response_name in RESPONSES:
+            first_byte_s, total_s, size, peak_rss = run_in_fresh_process(
+                measure, response_name
+            )
+            rows.append(
+                (
+                    response_name,
+                    f"{first_byte_s:.3f}",
+                    f"{total_s:.3f}",
+                    f"{size / 1024 / 1024:.1f}",
+                    f"{peak_rss:.1f}",
+                )
+            )
+    print_table(
+        ("response", "first byte s", "total s", "body MiB", "peak RSS MiB"), rows
+    )
+
+
+if __name__ == "__main__":
+    main()
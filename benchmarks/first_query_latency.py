@@ -0,0 +1,87 @@
+"""Latency of the first and second /country-stats query of a freshly ingested date, with and without publishing
+aggregated stats after ingestion.
+
+Each case ingests different date by /process-request in its own app server, waits for the job and then queries the
+date. Without publishing, the first query lists and aggregates cities of every country and writes aggregated stats and
+rollups. With publishing, ingestion does that and the first query is served from in-process cache. Ingestion time is
+reported too, as it includes the publishing.
+"""
+
+import asyncio
+import datetime
+import time
+
+import aiohttp
+from benchmark_utils import (
+    APP_SERVER,
+    app_server,
+    moto_server,
+    print_table,
+    stand_in_ref_server,
+)
+
+CITY_COUNT = 200
+COUNTRY_COUNT = 20
+BUS_COUNT = 100
+
+
+async def wait_for_job(session: aiohttp.ClientSession, job_id: str) -> dict:
+    while True:
+        async with session.get(f"{APP_SERVER}/jobs/{job_id}") as response:
+            job_status = await response.json()
+        if job_status["status"] not in ("queued", "running"):
+            return job_status
+        await asyncio.sleep(0.05)
+
+
+async def ingest_and_query(date: datetime.date) -> tuple[float, float, float]:
+    """Return ingestion time and latencies of the first and second query."""
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        async with session.post(
+            f"{APP_SERVER}/process-request?date={date}"
+        ) as response:
+            job_id = (await response.json())["id"]
+        job_status = await wait_for_job(session, job_id)
+        assert job_status["status"] == "finished"
+        ingestion_s = time.perf_counter() - start
+
+        latencies_s = []
+        for _ in range(2):
+            start = time.perf_counter()
+            async with session.get(
+                f"{APP_SERVER}/country-stats?from={date}&to{date}"
+            ) as response:
+                stats = await response.json()
+            latencies_s.append(time.perf_counter() - start)
+        assert sum(
+            country_stats[str(date)]["bus_count"] for country_stats in stats.values()
+        ) == (CITY_COUNT * BUS_COUNT)
+    return ingestion_s, latencies_s[0], latencies_s[1]
+
+
+CASES = {
+    "aggregate on first query": ("0", datetime.date(2024, 6, 1)),
+    "publish after ingestion": ("1", datetime.date(2024, 7, 1)),
+}
+
+
+def main() -> None:
+    rows = []
+    with moto_server(), stand_in_ref_server(CITY_COUNT, COUNTRY_COUNT, BUS_COUNT):
+        for case_name, (publish, date) in CASES.items():
+            with app_server(INGESTION_PUBLISH_AGGREGATED_STATS=publish):
+                ingestion_s, first_s, second_s = asyncio.run(ingest_and_query(date))
+            rows.append(
+                (
+                    case_name,
+                    f"{ingestion_s:.2f}",
+                    f"{first_s * 1000:.1f}",
+                    f"{second_s * 1000:.1f}",
+                )
+            )
+    print_table(("case", "ingestion s", "first query ms", "second query ms"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Ingestion throughput with different fetch concurrency limits.
+
+Stand-in ref server injects random per-city latency the same way as ref_server.py does, so throughput mostly depends
+on how many cities are fetched at once.
+"""
+
+import asyncio
+import datetime
+import sys
+import time
+
+from benchmark_utils import moto_server, print_table, stand_in_ref_server
+
+from city_details_proccesing import City
+from ingestion_scheduler import IngestionScheduler
+from ref_server_communication import (
+    create_ref_server_session,
+    get_cities,
+    iter_raw_city_stats_from_ref_server,
+)
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_s3_client,
+    stream_city_stats_to_s3,
+)
+
+CITY_COUNT = 100
+COUNTRY_COUNT = 5
+BUS_COUNT = 1_000
+MAX_LATENCY_S = 1.0
+FETCH_CONCURRENCIES = (1, 5, 20, 100)
+DATE = datetime.date(2024, 2, 1)
+
+
+async def measure(fetch_concurrency: int) -> tuple[float, int]:
+    scheduler = IngestionScheduler(
+        fetch_concurrency,
+        upload_concurrency=50,
+        max_attempts=3,
+        backoff_base_s=0.5,
+        backoff_max_s=10,
+    )
+    storage_state = StorageState()
+    async with get_s3_client() as s3_client, create_ref_server_session() as session:
+        cities = await get_cities(session)
+        await asyncio.gather(
+            *(
+                create_bucket(s3_client, country, storage_state)
+                for country in {c.country for c in cities}
+            )
+        )
+
+        async def transfer(city: City) -> None:
+            await stream_city_stats_to_s3(
+                city,
+                DATE,
+                scheduler.fetch(
+                    iter_raw_city_stats_from_ref_server(city, DATE, session)
+                ),
+                s3_client,
+                storage_state,
+                upload_slots=scheduler.upload_slots,
+            )
+
+        start = time.perf_counter()
+        results = await scheduler.transfer_cities(cities, transfer)
+        return time.perf_counter() - start, sum(not r.succeeded for r in results)
+
+
+def main(fetch_concurrencies: tuple[int, ...]) -> None:
+    rows = []
+    with moto_server(), stand_in_ref_server(
+        CITY_COUNT, COUNTRY_COUNT, BUS_COUNT, MAX_LATENCY_S
+    ):
+        for fetch_concurrency in fetch_concurrencies:
+            duration_s, failed = asyncio.run(measure(fetch_concurrency))
+            rows.append(
+                (
+                    fetch_concurrency,
+                    f"{duration_s:.2f}",
+                    f"{CITY_COUNT / duration_s:.1f}",
+                    failed,
+                )
+            )
+    print_table(("fetch concurrency", "total s", "cities/s", "failed"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or FETCH_CONCURRENCIES)
@@ -0,0 +1,108 @@
+"""Year long /country-stats range query answered by per-day aggregated stats and by rollup objects.
+
+Cache is disabled, so every query goes to S3. First rollup query creates the rollups, following queries read them.
+"""
+
+import asyncio
+import datetime
+import time
+from collections import Counter
+
+from benchmark_utils import moto_server, print_table
+from types_aiobotocore_s3 import S3Client
+
+import s3_communication
+from city_details_proccesing import Stats
+from configuration import AGGREGATED_STATS_FILE_NAME
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_aggregated_stats_for_country_and_date,
+    get_aggregated_stats_for_country_and_dates,
+    get_s3_client,
+)
+from stats_cache import StatsCache
+
+COUNTRY = "country-rollups"
+DAY_COUNT = 365
+START_DATE = datetime.date(2023, 1, 1)
+DATES = [str(START_DATE + datetime.timedelta(days)) for days in range(DAY_COUNT)]
+
+
+async def populate(s3_client: S3Client, storage_state: StorageState) -> None:
+    await create_bucket(s3_client, COUNTRY, storage_state)
+    await asyncio.gather(
+        *(
+            s3_client.put_object(
+                Bucket=COUNTRY,
+                Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}",
+                Body=b"",
+                Metadata=Stats.create_stats_from_sums(
+                    1, 1, 0, 1
+                ).create_s3_metadata_from_stats(),
+            )
+            for date in DATES
+        )
+    )
+
+
+async def per_day_query(s3_client: S3Client, storage_state: StorageState) -> None:
+    await asyncio.gather(
+        *(
+            get_aggregated_stats_for_country_and_date(
+                COUNTRY, date, s3_client, storage_state
+            )
+            for date in DATES
+        )
+    )
+
+
+async def rollup_query(s3_client: S3Client, storage_state: StorageState) -> None:
+    await get_aggregated_stats_for_country_and_dates(
+        COUNTRY, DATES, s3_client, storage_state
+    )
+
+
+async def measure() -> list[tuple[str, str, str]]:
+    storage_state = StorageState(aggregated_stats_cache=StatsCache(0, ttl_s=3600))
+    s3_calls: Counter[str] = Counter()
+
+    def count_call(event_name: str, **_kwargs: object) -> None:
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    rows = []
+    async with get_s3_client() as s3_client:
+        await populate(s3_client, storage_state)
+        s3_client.meta.events.register("before-call.s3", count_call)
+        for name, yearly_min_months, query in (
+            ("per day", None, per_day_query),
+            ("monthly rollups, first query", None, rollup_query),
+            ("monthly rollups", None, rollup_query),
+            ("yearly rollup, first query", 3, rollup_query),
+            ("yearly rollup", 3, rollup_query),
+        ):
+            s3_communication.STATS_ROLLUP_YEARLY_MIN_MONTHS = yearly_min_months
+            s3_calls.clear()
+            start = time.perf_counter()
+            await query(s3_client, storage_state)
+            duration_s = time.perf_counter() - start
+            rows.append(
+                (
+                    name,
+                    f"{duration_s:.3f}",
+                    ", ".join(
+                        f"{call}={count}" for call, count in sorted(s3_calls.items())
+                    ),
+                )
+            )
+    return rows
+
+
+def main() -> None:
+    with moto_server():
+        rows = asyncio.run(measure())
+    print_table(("lookup", "total s", "S3 calls"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""CPU time and bytes saved by content encodings and compression levels of raw city data.
+
+Data is encoded part by part as by stream_city_stats_to_s3 and decoded by streaming decoder.
+"""
+
+import time
+
+from benchmark_utils import generate_raw_city_data, print_table
+
+from configuration import MULTIPART_UPLOAD_PART_SIZE
+from content_encoding import CONTENT_ENCODINGS, StreamDecoder, encode_part
+
+BUS_COUNT = 500_000
+LEVELS = {"identity": [0], "gzip": [1, 3, 6, 9]}
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def main() -> None:
+    raw_city_data = generate_raw_city_data(BUS_COUNT)
+    parts = [
+        raw_city_data[start : start + MULTIPART_UPLOAD_PART_SIZE]
+        for start in range(0, len(raw_city_data), MULTIPART_UPLOAD_PART_SIZE)
+    ]
+    rows = []
+    for content_encoding in CONTENT_ENCODINGS:
+        for level in LEVELS[content_encoding]:
+            start = time.process_time()
+            encoded = b"".join(
+                encode_part(part, content_encoding, level) for part in parts
+            )
+            encode_s = time.process_time() - start
+
+            start = time.process_time()
+            decoder = StreamDecoder(content_encoding)
+            decoded_size = sum(
+                len(
+                    decoder.decode(encoded[chunk_start : chunk_start + READ_CHUNK_SIZE])
+                )
+                for chunk_start in range(0, len(encoded), READ_CHUNK_SIZE)
+            )
+            decoder.finish()
+            decode_s = time.process_time() - start
+            assert decoded_size == len(raw_city_data)
+
+            rows.append(
+                (
+                    content_encoding,
+                    level,
+                    f"{len(encoded) / 2**20:.1f}",
+                    f"{1 - len(encoded) / len(raw_city_data):.1%}",
+                    f"{encode_s:.2f}",
+                    f"{len(raw_city_data) / 2**20 / max(encode_s, 1e-9):.0f}",
+                    f"{decode_s:.2f}",
+                )
+            )
+    print(f"Raw data: {len(raw_city_data) / 2**20:.1f} MiB")
+    print_table(
+        (
+            "encoding",
+            "level",
+            "stored MiB",
+            "saved",
+            "encode CPU s",
+            "encode MiB/s",
+            "decode CPU s",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
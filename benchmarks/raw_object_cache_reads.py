@@ -0,0 +1,95 @@
+"""Wall time of reading and decoding all raw city objects of a day without object disk cache, with cold cache and with
+warm cache.
+
+Cold read downloads objects and writes their local copies on the way. Warm read makes only conditional requests and
+decodes memory-mapped local copies. Parsing is left out, so the difference is not hidden by it. The stand-in S3 is local moto server, so download is cheaper than from real S3 and
+the difference is a lower bound.
+"""
+
+import asyncio
+import datetime
+import sys
+import tempfile
+import time
+
+from benchmark_utils import generate_raw_city_data, moto_server, print_table
+
+from city_details_proccesing import City
+from object_disk_cache import ObjectDiskCache
+from s3_communication import (
+    StorageState,
+    create_bucket,
+    get_s3_client,
+    iter_raw_city_stats_from_s3,
+    push_city_stats_to_s3,
+)
+
+CITY_COUNT = 8
+COUNTRY = "country-raw-object-cache"
+BUS_COUNTS = (10_000, 100_000)
+DATE = datetime.date(2024, 1, 1)
+
+
+async def populate(bus_count: int) -> int:
+    """Return stored size of all raw data."""
+    raw_city_data = generate_raw_city_data(bus_count)
+    storage_state = StorageState(object_disk_cache=None)
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, COUNTRY, storage_state)
+        for city_index in range(CITY_COUNT):
+            await push_city_stats_to_s3(
+                City(f"city-{city_index}", COUNTRY, city_index),
+                DATE,
+                raw_city_data,
+                s3_client,
+                storage_state,
+            )
+        response = await s3_client.head_object(Bucket=COUNTRY, Key=f"{DATE}/city-0")
+    return CITY_COUNT * response["ContentLength"]
+
+
+async def read_all(storage_state: StorageState) -> float:
+    async with get_s3_client() as s3_client:
+        start = time.perf_counter()
+        for city_index in range(CITY_COUNT):
+            async for _ in iter_raw_city_stats_from_s3(
+                City(f"city-{city_index}", COUNTRY, city_index),
+                DATE,
+                s3_client,
+                storage_state,
+            ):
+                pass
+        return time.perf_counter() - start
+
+
+def main(bus_counts: tuple[int, ...]) -> None:
+    rows = []
+    with moto_server(), tempfile.TemporaryDirectory() as directory:
+        for bus_count in bus_counts:
+            stored_size = asyncio.run(populate(bus_count))
+            cache = ObjectDiskCache(f"{directory}/{bus_count}", 2**40)
+            for case_name, case_cache in (
+                ("no cache", None),
+                ("cold cache", cache),
+                ("warm cache", cache),
+            ):
+                hits, misses = cache.hits, cache.misses
+                duration_s = asyncio.run(
+                    read_all(StorageState(object_disk_cache=case_cache))
+                )
+                scan_hits = cache.hits - hits
+                scan_requests = scan_hits + cache.misses - misses
+                rows.append(
+                    (
+                        bus_count,
+                        f"{stored_size / 1_000_000:.1f}",
+                        case_name,
+                        f"{duration_s:.2f}",
+                        f"{scan_hits / scan_requests:.2f}" if scan_requests else "-",
+                    )
+                )
+    print_table(("buses per city", "stored MB", "case", "read s", "hit ratio"), rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or BUS_COUNTS)
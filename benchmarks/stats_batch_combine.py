@@ -0,0 +1,146 @@
+"""Memory per record and combine throughput of stats held as Stats objects and as StatsBatch.
+
+Records are city stats of many countries, dates and cities read from S3 metadata, with sketches as stored by
+ingestion. Memory is measured by tracemalloc while all records are held. Combine reduces the city axis, giving stats of
+each country and date, by combine_stats of groups of Stats objects and by StatsBatch.combine. Results of both are
+checked to be identical.
+"""
+
+import dataclasses
+import json
+import random
+import sys
+import timeit
+import tracemalloc
+from typing import Any, Callable
+
+from benchmark_utils import generate_raw_city_data, print_table
+
+from city_details_proccesing import (
+    Stats,
+    combine_stats,
+    create_city_stats_from_city_data,
+)
+from stats_batch import StatsBatch
+
+COUNTRY_COUNT = 10
+DATE_COUNT = 100
+CITY_COUNTS = (10, 100)
+BUS_COUNT = 100
+REPEATS = 3
+
+# Stats before they were slotted. Same fields, regular instance __dict__.
+UnslottedStats = dataclasses.make_dataclass(
+    "UnslottedStats",
+    [(field.name, field.type) for field in dataclasses.fields(Stats)],
+)
+
+Records = list[tuple[str, str, str, dict[str, str]]]
+
+
+def generate_records(city_count: int) -> Records:
+    """Metadata of each country, date and city. Few distinct sketches are reused, as generating them is slow."""
+    rng = random.Random(0)
+    metadata_variants = [
+        create_city_stats_from_city_data(
+            json.loads(generate_raw_city_data(BUS_COUNT, seed))
+        ).create_s3_metadata_from_stats()
+        for seed in range(20)
+    ]
+    return [
+        (
+            f"country-{country}",
+            f"2024-{date:03d}",
+            f"city-{city}",
+            dict(rng.choice(metadata_variants)),
+        )
+        for country in range(COUNTRY_COUNT)
+        for date in range(DATE_COUNT)
+        for city in range(city_count)
+    ]
+
+
+def stats_objects(records: Records) -> dict[tuple[str, str], list[Any]]:
+    stats: dict[tuple[str, str], list[Any]] = {}
+    for country, date, _, metadata in records:
+        stats.setdefault((country, date), []).append(
+            Stats.create_stats_from_s3_metadata(metadata)
+        )
+    return stats
+
+
+def unslotted_stats_objects(records: Records) -> list[Any]:
+    return [
+        UnslottedStats(**dataclasses.asdict(Stats.create_stats_from_s3_metadata(m)))
+        for *_, m in records
+    ]
+
+
+def stats_batch(records: Records) -> StatsBatch:
+    batch = StatsBatch()
+    for country, date, city, metadata in records:
+        batch.append_s3_metadata(metadata, country, date, city)
+    return batch
+
+
+def bytes_per_record(build: Callable[[Records], Any], records: Records) -> float:
+    """Memory held by built representation. Records are copied while traced, so their strings are counted as well."""
+    serialized_records = json.dumps(records)
+    tracemalloc.start()
+    held = build(json.loads(serialized_records))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size / len(records)
+
+
+def main(city_counts: tuple[int, ...]) -> None:
+    memory_rows = []
+    combine_rows = []
+    for city_count in city_counts:
+        records = generate_records(city_count)
+        for name, build in (
+            ("Stats (unslotted)", unslotted_stats_objects),
+            ("Stats", stats_objects),
+            ("StatsBatch", stats_batch),
+        ):
+            memory_rows.append(
+                (len(records), name, f"{bytes_per_record(build, records):.0f}")
+            )
+
+        grouped_stats = stats_objects(records)
+        batch = stats_batch(records)
+        combined_batch = batch.combine(keep=("country", "date"))
+        for index in range(len(combined_batch)):
+            country, date, _ = combined_batch.labels(index)
+            assert combined_batch.stats(index) == combine_stats(
+                grouped_stats[(country, date)]
+            )
+        timings = {}
+        for name, combine in (
+            (
+                "combine_stats",
+                lambda: [combine_stats(stats) for stats in grouped_stats.values()],
+            ),
+            (
+                "StatsBatch.combine",
+                lambda: batch.combine(keep=("country", "date")),
+            ),
+        ):
+            timings[name] = min(timeit.repeat(combine, number=1, repeat=REPEATS))
+            combine_rows.append(
+                (
+                    len(records),
+                    name,
+                    f"{timings[name] * 1000:.0f}",
+                    f"{len(records) / timings[name]:,.0f}",
+                    f"{timings['combine_stats'] / timings[name]:.1f}x",
+                )
+            )
+    print_table(("records", "representation", "bytes/record"), memory_rows)
+    print()
+    print_table(("records", "combine", "ms", "records/s", "speedup"), combine_rows)
+
+
+if __name__ == "__main__":
+    main(tuple(int(arg) for arg in sys.argv[1:]) or CITY_COUNTS)
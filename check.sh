@@ -1,4 +1,4 @@
-DIRS_WITH_CODE="src test"
+DIRS_WITH_CODE="src test benchmarks"
 
 # Type hints
 echo "Mypy:"
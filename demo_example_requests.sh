@@ -1,9 +1,14 @@
-# Get some data by telling app_server to get data from ref_server to S3. Check only status code:
+# Get some data by telling app_server to get data from ref_server to S3. Data is transferred in background jobs.
+# Check only status code:
 curl  -s -o /dev/null -w "%{http_code}" -X POST "http://127.0.0.1:8080/process-request?date=2024-05-01"
 curl  -s -o /dev/null -w "%{http_code}" -X POST "http://127.0.0.1:8080/process-request?date=2024-05-02"
 curl  -s -o /dev/null -w "%{http_code}" -X POST "http://127.0.0.1:8080/process-request?date=2024-05-04"
 curl  -s -o /dev/null -w "%{http_code}" -X POST "http://127.0.0.1:8080/process-request?date=2024-05-05"
 
+# Each of the requests above returns job status with its id. Progress of the job is available at:
+# curl -s -X GET "http://127.0.0.1:8080/jobs/<job_id>"
+sleep 10
+
 # Get statistics from app_server. See full json response:
 curl -s -X GET "http://127.0.0.1:8080/country-stats?from=2024-05-02&to2024-05-04"
 # To easily parse json response, you can send this last request from browser.
\ No newline at end of file
@@ -1,90 +1,601 @@
 import asyncio
 import datetime
 from collections import defaultdict
+from contextlib import aclosing, asynccontextmanager
 from logging import getLogger
-from typing import Any
+from typing import Annotated, Any, AsyncIterator, Coroutine, TypeVar
 
 import aiohttp
 from litestar import Litestar, MediaType, Request, get, post
+from litestar.datastructures import State
+from litestar.di import Provide
+from litestar.exceptions import HTTPException, NotFoundException
+from litestar.params import Dependency, Parameter
+from litestar.response import Stream
+from litestar.serialization import encode_json
+from litestar.status_codes import HTTP_202_ACCEPTED
+from slugify import slugify
 from types_aiobotocore_s3 import S3Client
 
-from city_details_proccesing import City
+from city_analytics import GroupBy
+from city_catalogue import CityCatalogue
+from city_details_proccesing import City, Stats
+from configuration import (
+    CITY_CATALOGUE_PATH,
+    CITY_CATALOGUE_TTL_S,
+    INGESTION_BACKFILL_MAX_DATES_IN_FLIGHT,
+    INGESTION_BACKOFF_BASE_S,
+    INGESTION_BACKOFF_MAX_S,
+    INGESTION_FETCH_CONCURRENCY,
+    INGESTION_MAX_ATTEMPTS,
+    INGESTION_MAX_PARALLEL_JOBS,
+    INGESTION_MAX_RETAINED_JOBS,
+    INGESTION_PUBLISH_AGGREGATED_STATS,
+    INGESTION_UPLOAD_CONCURRENCY,
+    STATS_EXECUTOR_KIND,
+    STATS_EXECUTOR_MAX_PENDING,
+    STATS_EXECUTOR_MAX_WORKERS,
+)
+from ingestion_jobs import BackfillJob, CityFilter, IngestionJob, IngestionJobManager
+from ingestion_scheduler import IngestionScheduler
 from ref_server_communication import (
+    create_ref_server_session,
     expected_date_format,
-    get_cities,
-    get_raw_city_stats_from_ref_server,
+    iter_raw_city_stats_from_ref_server,
     parse_start_and_end_date_from_query_params,
 )
 from s3_communication import (
+    DataChange,
+    StorageState,
     create_bucket,
-    get_aggregated_stats_for_country_and_date,
+    data_change,
+    get_aggregated_stats_for_country_and_dates,
+    get_country_registry,
     get_s3_client,
-    push_city_stats_to_s3,
+    iter_aggregated_stats_for_countries_and_dates,
+    publish_aggregated_stats_for_date,
+    scan_city_analytics,
+    stream_city_stats_to_s3,
 )
+from stats_executor import StatsExecutor
 
 logger = getLogger(__name__)
 
+T = TypeVar("T")
+
 Result = dict[str, dict[str, Any]]
 
+# App wide resources created in lifespan. They are not validated, as they are not data.
+S3ClientDependency = Annotated[S3Client, Dependency(skip_validation=True)]
+RefServerSessionDependency = Annotated[
+    aiohttp.ClientSession, Dependency(skip_validation=True)
+]
+StatsExecutorDependency = Annotated[StatsExecutor, Dependency(skip_validation=True)]
+IngestionSchedulerDependency = Annotated[
+    IngestionScheduler, Dependency(skip_validation=True)
+]
+IngestionJobManagerDependency = Annotated[
+    IngestionJobManager, Dependency(skip_validation=True)
+]
+CityCatalogueDependency = Annotated[CityCatalogue, Dependency(skip_validation=True)]
+StorageStateDependency = Annotated[StorageState, Dependency(skip_validation=True)]
+
 
-@post("/process-request")
-async def collect_cities_data_to_s3(date: str) -> None:
+@post("/process-request", status_code=HTTP_202_ACCEPTED)
+async def collect_cities_data_to_s3(
+    date: str,
+    s3_client: S3ClientDependency,
+    ref_server_session: RefServerSessionDependency,
+    stats_executor: StatsExecutorDependency,
+    ingestion_scheduler: IngestionSchedulerDependency,
+    ingestion_jobs: IngestionJobManagerDependency,
+    city_catalogue: CityCatalogueDependency,
+    storage_state: StorageStateDependency,
+) -> dict[str, Any]:
+    """Start background job transferring data of all cities. Returns job status, see /jobs/{job_id}.
+
+    If there already is unfinished job for the same date, its status is returned instead of starting new job.
+    """
     checked_date = datetime.datetime.strptime(date, expected_date_format).date()
-    async with get_s3_client() as s3_client:
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector()) as session:
-            cities = await get_cities(session)
-            create_s3_buckets_tasks = (
-                asyncio.create_task(create_bucket(s3_client, country))
-                for country in set(city.country for city in cities)
-            )
-            transfer_city_stats_tasks = (
-                asyncio.create_task(
-                    _transfer_city_stats_to_s3(session, s3_client, city, checked_date)
+
+    async def run(job: IngestionJob) -> None:
+        await _transfer_cities_data_to_s3(
+            job,
+            s3_client,
+            storage_state,
+            ref_server_session,
+            stats_executor,
+            ingestion_scheduler,
+            city_catalogue,
+        )
+
+    return ingestion_jobs.submit(checked_date, run).to_status()
+
+
+@post("/process-range", status_code=HTTP_202_ACCEPTED)
+async def collect_cities_data_range_to_s3(
+    start_date: Annotated[str, Parameter(query="from")],
+    end_date: Annotated[str, Parameter(query="to")],
+    s3_client: S3ClientDependency,
+    ref_server_session: RefServerSessionDependency,
+    stats_executor: StatsExecutorDependency,
+    ingestion_scheduler: IngestionSchedulerDependency,
+    ingestion_jobs: IngestionJobManagerDependency,
+    city_catalogue: CityCatalogueDependency,
+    storage_state: StorageStateDependency,
+    country: list[str] | None = None,
+    city: list[str] | None = None,
+) -> dict[str, Any]:
+    """Start background backfill of all dates from start_date to end_date. Returns its status, see /jobs/{job_id}.
+
+    Optional country and city parameters, each can be repeated, select only some cities. Each date has its own job,
+    whose id is in backfill status. Dates that already have unfinished job with the same selection reuse it.
+    """
+    dates = _parse_date_range(start_date, end_date)
+    city_filter = CityFilter(
+        frozenset(slugify(name) for name in country or []),
+        frozenset(slugify(name) for name in city or []),
+    )
+
+    async def run(backfill: BackfillJob) -> None:
+        await _backfill_cities_data_to_s3(
+            backfill,
+            s3_client,
+            storage_state,
+            ref_server_session,
+            stats_executor,
+            ingestion_scheduler,
+            city_catalogue,
+        )
+
+    return ingestion_jobs.submit_backfill(dates, run, city_filter).to_status()
+
+
+@get("/jobs/{job_id:str}")
+async def get_job_status(
+    job_id: str, ingestion_jobs: IngestionJobManagerDependency
+) -> dict[str, Any]:
+    """Progress of each city, transferred bytes, throughput and errors of ingestion job."""
+    if (job := ingestion_jobs.get(job_id)) is None:
+        raise NotFoundException(f"Job {job_id} does not exist.")
+    return job.to_status()
+
+
+@get("/metrics")
+async def get_metrics(storage_state: StorageStateDependency) -> dict[str, Any]:
+    """Counters of in-process caches, object disk cache, country registry, aggregation fan-out queue and deduplicated aggregations."""
+    return storage_state.counters()
+
+
+@get("/country-stats", media_type=MediaType.JSON)
+async def get_country_stats(
+    request: Request,
+    s3_client: S3ClientDependency,
+    storage_state: StorageStateDependency,
+) -> Result:
+    dates = _get_dates_from_query_params(request)
+    countries = await _list_countries(s3_client, storage_state)
+
+    stats_by_country = await _cancel_on_disconnect(
+        request,
+        storage_state.aggregation_fan_out.map(
+            lambda country: get_aggregated_stats_for_country_and_dates(
+                country, dates, s3_client, storage_state
+            ),
+            countries,
+        ),
+    )
+
+    results: Result = defaultdict(dict)
+    for country, stats_by_date in zip(countries, stats_by_country):
+        for date in dates:
+            results[country][date] = stats_by_date[date].create_response_from_stats()
+    return results
+
+
+@get("/country-stats/stream", media_type="application/x-ndjson")
+async def stream_country_stats(
+    request: Request,
+    s3_client: S3ClientDependency,
+    storage_state: StorageStateDependency,
+) -> Stream:
+    """Same stats as /country-stats as NDJSON with one {"country", "date", "stats"} object per line.
+
+    Lines are sent as soon as stats of their dates are read, in no particular order, so large ranges start arriving
+    early and are never held in memory as a whole.
+    """
+    dates = _get_dates_from_query_params(request)
+    countries = await _list_countries(s3_client, storage_state)
+
+    async def iter_lines() -> AsyncIterator[bytes]:
+        async for (
+            country,
+            stats_by_date,
+        ) in iter_aggregated_stats_for_countries_and_dates(
+            countries, dates, s3_client, storage_state
+        ):
+            yield b"".join(
+                encode_json(
+                    {
+                        "country": country,
+                        "date": date,
+                        "stats": stats.create_response_from_stats(),
+                    }
                 )
-                for city in cities
+                + b"\n"
+                for date, stats in stats_by_date.items()
             )
-            await asyncio.gather(*create_s3_buckets_tasks, *transfer_city_stats_tasks)
 
+    return Stream(iter_lines(), media_type="application/x-ndjson")
 
-@get("/country-stats", media_type=MediaType.JSON)
-async def get_country_stats(request: Request) -> Result:
+
+@get("/city-analytics")
+async def get_city_analytics(
+    request: Request,
+    start_date: Annotated[str, Parameter(query="from")],
+    end_date: Annotated[str, Parameter(query="to")],
+    s3_client: S3ClientDependency,
+    stats_executor: StatsExecutorDependency,
+    storage_state: StorageStateDependency,
+    group_by: GroupBy = "city",
+    country: list[str] | None = None,
+) -> Result:
+    """Stats and delay percentiles of groups of buses of each country, computed by scanning stored raw data.
+
+    Buses are grouped by city, date, bus-type or departure hour. Optional country parameter, can be repeated, selects
+    only some countries. Scan reads whole raw data of the range, so it is much slower than /country-stats.
+    """
+    dates = [str(date) for date in _parse_date_range(start_date, end_date)]
+    countries = await _list_countries(s3_client, storage_state)
+    if country:
+        selected_countries = set(slugify(name) for name in country)
+        countries = [name for name in countries if name in selected_countries]
+
+    groups_by_country = await _cancel_on_disconnect(
+        request,
+        scan_city_analytics(
+            countries, dates, group_by, s3_client, storage_state, stats_executor
+        ),
+    )
+    return {
+        country_name: {
+            group_key: group.to_result() for group_key, group in groups.items()
+        }
+        for country_name, groups in groups_by_country.items()
+    }
+
+
+async def _cancel_on_disconnect(request: Request, work: Coroutine[Any, Any, T]) -> T:
+    """Await work, but cancel it if client disconnects before it is done."""
+
+    async def wait_for_disconnect() -> None:
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    work_task = asyncio.create_task(work)
+    disconnect_task = asyncio.create_task(wait_for_disconnect())
+    try:
+        await asyncio.wait(
+            (work_task, disconnect_task), return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        disconnect_task.cancel()
+        work_task.cancel()
+    if not work_task.done() or work_task.cancelled():
+        raise HTTPException(status_code=499, detail="Client disconnected.")
+    return work_task.result()
+
+
+def _parse_date_range(start_date: str, end_date: str) -> list[datetime.date]:
+    checked_start_date = datetime.datetime.strptime(
+        start_date, expected_date_format
+    ).date()
+    checked_end_date = datetime.datetime.strptime(end_date, expected_date_format).date()
+    if checked_end_date < checked_start_date:
+        raise HTTPException(
+            status_code=400, detail="End date must not be before start date."
+        )
+    return [
+        checked_start_date + datetime.timedelta(days=days)
+        for days in range((checked_end_date - checked_start_date).days + 1)
+    ]
+
+
+def _get_dates_from_query_params(request: Request) -> list[str]:
     start_date, end_date = parse_start_and_end_date_from_query_params(request)
-    dates = [
+    return [
         str(start_date + datetime.timedelta(days=days))
         for days in range((end_date - start_date).days + 1)
     ]
 
-    async with get_s3_client() as s3_client:
-        countries = [
-            bucket["Name"] for bucket in (await s3_client.list_buckets())["Buckets"]
-        ]
-
-        aggregate_stats_tasks = []
-        for country in countries:
-            for date in dates:
-                aggregate_stats_tasks.append(
-                    asyncio.create_task(
-                        get_aggregated_stats_for_country_and_date(
-                            country, date, s3_client
-                        )
-                    )
+
+async def _list_countries(
+    s3_client: S3Client, storage_state: StorageState
+) -> list[str]:
+    return (await get_country_registry(s3_client, storage_state)).countries()
+
+
+async def _transfer_cities_data_to_s3(
+    job: IngestionJob,
+    s3_client: S3Client,
+    storage_state: StorageState,
+    ref_server_session: aiohttp.ClientSession,
+    stats_executor: StatsExecutor,
+    ingestion_scheduler: IngestionScheduler,
+    city_catalogue: CityCatalogue,
+) -> None:
+    """Transfer data of all cities on job date. Failure of some cities does not fail others.
+
+    All pushes of one country share one data change.
+    """
+    cities = await city_catalogue.get_cities(ref_server_session)
+    job.add_cities(cities)
+    await _create_missing_buckets(cities, s3_client, storage_state)
+    async with data_change(
+        set(city.country for city in cities), job.date, s3_client, storage_state
+    ) as change:
+        await _transfer_cities_on_job_date(
+            job,
+            cities,
+            s3_client,
+            storage_state,
+            ref_server_session,
+            stats_executor,
+            ingestion_scheduler,
+            in_data_change=change,
+        )
+    await _publish_aggregated_stats(job, s3_client, storage_state)
+
+
+async def _backfill_cities_data_to_s3(
+    backfill: BackfillJob,
+    s3_client: S3Client,
+    storage_state: StorageState,
+    ref_server_session: aiohttp.ClientSession,
+    stats_executor: StatsExecutor,
+    ingestion_scheduler: IngestionScheduler,
+    city_catalogue: CityCatalogue,
+) -> None:
+    """Transfer data of selected cities on all backfill dates as one pipeline.
+
+    Cities are listed and buckets created once. Dates are started in order, at most
+    INGESTION_BACKFILL_MAX_DATES_IN_FLIGHT at once, and their cities share limits of ingestion scheduler with all other
+    jobs. All pushes of one country and date share one data change. Failure of some dates does not fail others.
+    """
+    cities = set(
+        city
+        for city in await city_catalogue.get_cities(ref_server_session)
+        if backfill.city_filter.matches(city)
+    )
+    await _create_missing_buckets(cities, s3_client, storage_state)
+    countries = set(city.country for city in cities)
+    date_slots = asyncio.Semaphore(INGESTION_BACKFILL_MAX_DATES_IN_FLIGHT)
+
+    async def transfer_date(job: IngestionJob) -> None:
+        try:
+            job.start()
+            job.add_cities(cities)
+            async with data_change(
+                countries, job.date, s3_client, storage_state
+            ) as change:
+                await _transfer_cities_on_job_date(
+                    job,
+                    cities,
+                    s3_client,
+                    storage_state,
+                    ref_server_session,
+                    stats_executor,
+                    ingestion_scheduler,
+                    in_data_change=change,
                 )
+            await _publish_aggregated_stats(job, s3_client, storage_state)
+            job.finish()
+        except Exception as error:
+            logger.exception(f"Ingestion job {job.id} failed.")
+            job.finish(error)
+        finally:
+            date_slots.release()
 
-        task_results = iter(await asyncio.gather(*aggregate_stats_tasks))
+    date_tasks = []
+    try:
+        for job in backfill.jobs:
+            if backfill.owns(job):
+                await date_slots.acquire()
+                date_tasks.append(asyncio.create_task(transfer_date(job)))
+            else:
+                date_tasks.append(asyncio.create_task(job.wait()))
+        await asyncio.gather(*date_tasks)
+    finally:
+        for task in date_tasks:
+            task.cancel()
 
-    # Fill result dict in same loop as gather keeps order of insertion.
-    results: Result = defaultdict(dict)
-    for country in countries:
-        for date in dates:
-            results[country][date] = next(task_results)
-    return results
+
+async def _publish_aggregated_stats(
+    job: IngestionJob, s3_client: S3Client, storage_state: StorageState
+) -> None:
+    """Optional post-ingest stage creating aggregated stats of countries with new data on job date.
+
+    Failure only leaves the aggregation to the first query, so it does not fail the job.
+    """
+    if not INGESTION_PUBLISH_AGGREGATED_STATS:
+        return
+    countries = set(
+        progress.country
+        for progress in job.cities.values()
+        if progress.status == "succeeded"
+    )
+    try:
+        await publish_aggregated_stats_for_date(
+            countries, job.date, s3_client, storage_state
+        )
+    except Exception:
+        logger.exception(f"Publishing aggregated stats of job {job.id} failed.")
 
 
-async def _transfer_city_stats_to_s3(
-    session: aiohttp.ClientSession, s3_client: S3Client, city: City, date: datetime.date
+async def _create_missing_buckets(
+    cities: set[City], s3_client: S3Client, storage_state: StorageState
 ) -> None:
-    raw_city_stats = await get_raw_city_stats_from_ref_server(city, date, session)
-    await push_city_stats_to_s3(city, date, raw_city_stats, s3_client)
+    await asyncio.gather(
+        *(
+            create_bucket(s3_client, country, storage_state)
+            for country in set(city.country for city in cities)
+            if not storage_state.country_registry.knows_country(country)
+        )
+    )
+
+
+async def _transfer_cities_on_job_date(
+    job: IngestionJob,
+    cities: set[City],
+    s3_client: S3Client,
+    storage_state: StorageState,
+    ref_server_session: aiohttp.ClientSession,
+    stats_executor: StatsExecutor,
+    ingestion_scheduler: IngestionScheduler,
+    in_data_change: DataChange | None = None,
+) -> None:
+    async def stream_city_stats(city: City) -> Stats:
+        # Fetch slot is held only while ref server response is being received.
+        async with aclosing(
+            ingestion_scheduler.fetch(
+                iter_raw_city_stats_from_ref_server(city, job.date, ref_server_session)
+            )
+        ) as chunks:
+            return await stream_city_stats_to_s3(
+                city,
+                job.date,
+                job.track_transfer(city, chunks),
+                s3_client,
+                storage_state,
+                stats_executor=stats_executor,
+                upload_slots=ingestion_scheduler.upload_slots,
+                in_data_change=in_data_change,
+            )
+
+    async def transfer_city_stats_to_s3(city: City) -> None:
+        # Concurrent transfer of the same city and date is awaited instead of transferring data twice.
+        await ingestion_scheduler.city_transfers.run(
+            (city, job.date), lambda: stream_city_stats(city)
+        )
+
+    async def transfer_and_record(city: City) -> None:
+        job.record_result(
+            city,
+            await ingestion_scheduler.transfer_city(city, transfer_city_stats_to_s3),
+        )
+
+    await asyncio.gather(*(transfer_and_record(city) for city in cities))
+
+
+@asynccontextmanager
+async def stats_executor_lifespan(app: Litestar) -> AsyncIterator[None]:
+    """Run CPU bound stats computation in executor that lives as long as the app."""
+    stats_executor = StatsExecutor(
+        STATS_EXECUTOR_KIND, STATS_EXECUTOR_MAX_WORKERS, STATS_EXECUTOR_MAX_PENDING
+    )
+    stats_executor.start()
+    app.state.stats_executor = stats_executor
+    try:
+        yield
+    finally:
+        stats_executor.shutdown()
+
+
+@asynccontextmanager
+async def clients_lifespan(app: Litestar) -> AsyncIterator[None]:
+    """Share S3 client and ref server session with their connection pools by all requests."""
+    async with get_s3_client() as s3_client, create_ref_server_session() as session:
+        app.state.s3_client = s3_client
+        app.state.ref_server_session = session
+        yield
 
 
-app = Litestar([collect_cities_data_to_s3, get_country_stats], debug=False)
+@asynccontextmanager
+async def ingestion_jobs_lifespan(app: Litestar) -> AsyncIterator[None]:
+    """Run ingestion job workers as long as the app."""
+    ingestion_jobs = IngestionJobManager(
+        INGESTION_MAX_PARALLEL_JOBS, INGESTION_MAX_RETAINED_JOBS
+    )
+    ingestion_jobs.start()
+    app.state.ingestion_jobs = ingestion_jobs
+    try:
+        yield
+    finally:
+        await ingestion_jobs.shutdown()
+
+
+def create_ingestion_scheduler(app: Litestar) -> None:
+    app.state.ingestion_scheduler = IngestionScheduler(
+        INGESTION_FETCH_CONCURRENCY,
+        INGESTION_UPLOAD_CONCURRENCY,
+        INGESTION_MAX_ATTEMPTS,
+        INGESTION_BACKOFF_BASE_S,
+        INGESTION_BACKOFF_MAX_S,
+    )
+
+
+def create_city_catalogue(app: Litestar) -> None:
+    app.state.city_catalogue = CityCatalogue(CITY_CATALOGUE_PATH, CITY_CATALOGUE_TTL_S)
+
+
+def create_storage_state(app: Litestar) -> None:
+    app.state.storage_state = StorageState()
+
+
+def provide_s3_client(state: State) -> S3Client:
+    return state.s3_client
+
+
+def provide_ref_server_session(state: State) -> aiohttp.ClientSession:
+    return state.ref_server_session
+
+
+def provide_stats_executor(state: State) -> StatsExecutor:
+    return state.stats_executor
+
+
+def provide_ingestion_scheduler(state: State) -> IngestionScheduler:
+    return state.ingestion_scheduler
+
+
+def provide_ingestion_jobs(state: State) -> IngestionJobManager:
+    return state.ingestion_jobs
+
+
+def provide_city_catalogue(state: State) -> CityCatalogue:
+    return state.city_catalogue
+
+
+def provide_storage_state(state: State) -> StorageState:
+    return state.storage_state
+
+
+app = Litestar(
+    [
+        collect_cities_data_to_s3,
+        collect_cities_data_range_to_s3,
+        get_job_status,
+        get_country_stats,
+        stream_country_stats,
+        get_city_analytics,
+        get_metrics,
+    ],
+    lifespan=[clients_lifespan, stats_executor_lifespan, ingestion_jobs_lifespan],
+    on_startup=[
+        create_ingestion_scheduler,
+        create_city_catalogue,
+        create_storage_state,
+    ],
+    dependencies={
+        "s3_client": Provide(provide_s3_client, sync_to_thread=False),
+        "ref_server_session": Provide(provide_ref_server_session, sync_to_thread=False),
+        "stats_executor": Provide(provide_stats_executor, sync_to_thread=False),
+        "ingestion_scheduler": Provide(
+            provide_ingestion_scheduler, sync_to_thread=False
+        ),
+        "ingestion_jobs": Provide(provide_ingestion_jobs, sync_to_thread=False),
+        "city_catalogue": Provide(provide_city_catalogue, sync_to_thread=False),
+        "storage_state": Provide(provide_storage_state, sync_to_thread=False),
+    },
+    debug=False,
+)
@@ -0,0 +1,133 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+from typing import AsyncIterator, Awaitable, Callable, Sequence, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Fan-out whose slot is held by the current item, if any.
+_slot_holder: contextvars.ContextVar["BoundedFanOut | None"] = contextvars.ContextVar(
+    "slot_holder", default=None
+)
+
+
+class BoundedFanOut:
+    """Runs items of any number of (nested) fan-outs with a global limit on items in flight.
+
+    Items wait in a queue and their coroutines are created only when they get a slot, so even very wide fan-out
+    creates at most max_in_flight workers per map call. Item that fans out again gives up its slot while waiting for
+    its nested items, so nested fan-out can't deadlock. Cancelling map cancels all its items.
+
+    Slots are not bound to event loop, so one instance can be shared by the whole process.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.cancelled = 0
+        self._waiters: collections.deque[asyncio.Future[None]] = collections.deque()
+
+    async def map(
+        self, function: Callable[[T], Awaitable[R]], items: Sequence[T]
+    ) -> list[R]:
+        """Return results of function on each item, in order of items."""
+        results: dict[int, R] = {}
+        indexes = iter(range(len(items)))
+        self.queued += len(items)
+
+        async def worker() -> None:
+            for index in indexes:
+                try:
+                    try:
+                        await self._acquire()
+                    finally:
+                        self.queued -= 1
+                    _slot_holder.set(self)
+                    try:
+                        results[index] = await function(items[index])
+                    finally:
+                        self._release()
+                except asyncio.CancelledError:
+                    self.cancelled += 1
+                    raise
+                self.completed += 1
+
+        async with self.slot_released():
+            workers = [
+                asyncio.create_task(worker())
+                for _ in range(min(len(items), self.max_in_flight))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                not_started = sum(1 for _ in indexes)
+                self.queued -= not_started
+                self.cancelled += not_started
+                raise
+        return [results[index] for index in range(len(items))]
+
+    @contextlib.asynccontextmanager
+    async def slot_released(self) -> AsyncIterator[None]:
+        """Give up slot of the current item, if any, while waiting for work that needs slots itself."""
+        holds_slot = _slot_holder.get() is self
+        if holds_slot:
+            self._release()
+        try:
+            yield
+        except BaseException:
+            if holds_slot:
+                # The item releases its slot when it ends. Don't wait for a free one just to release it.
+                self.in_flight += 1
+            raise
+        if holds_slot:
+            await self._reacquire()
+
+    def counters(self) -> dict[str, int]:
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+        }
+
+    async def _acquire(self) -> None:
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was already handed over. Pass it on.
+                self._release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Hand the slot over, in_flight stays the same.
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _reacquire(self) -> None:
+        """Get back slot of the current item after its nested fan-out. The item releases it when it ends."""
+        try:
+            await self._acquire()
+        except asyncio.CancelledError:
+            self.in_flight += 1
+            raise
@@ -0,0 +1,145 @@
+"""Ad hoc analytics over raw city data, for cuts that precomputed stats in metadata can't answer.
+
+Raw data of each city and date is scanned by CityStatsParser with CityAnalyticsAccumulator, which keeps partial
+aggregates of each group. Cities with up to date columnar copy are aggregated from only the needed columns instead.
+Partial aggregates of all scanned objects are merged afterward.
+"""
+
+import collections
+import dataclasses
+import datetime
+import math
+from typing import Any, Iterable, Literal
+
+from city_columns import ColumnValue
+from city_details_proccesing import CityStatsAccumulator, parse_delay_s
+
+GroupBy = Literal["city", "date", "bus-type", "hour"]
+DELAY_PERCENTILES = (50, 90, 99)
+
+
+@dataclasses.dataclass
+class GroupAggregate:
+    """Mergeable aggregate of buses of one group. Delays are counted by value, so percentiles are exact."""
+
+    bus_count: int = 0
+    passenger_count: int = 0
+    accident_count: int = 0
+    total_delay_s: float = 0
+    delay_counts: collections.Counter[float] = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    def add(self, passengers: int, accident: bool, delay_s: float) -> None:
+        self.bus_count += 1
+        self.passenger_count += passengers
+        self.accident_count += accident
+        self.total_delay_s += delay_s
+        self.delay_counts[delay_s] += 1
+
+    def merge(self, other: "GroupAggregate") -> None:
+        self.bus_count += other.bus_count
+        self.passenger_count += other.passenger_count
+        self.accident_count += other.accident_count
+        self.total_delay_s += other.total_delay_s
+        self.delay_counts.update(other.delay_counts)
+
+    def delay_percentile_s(self, percentile: float) -> float:
+        """Nearest-rank percentile of delays. Zero for empty group."""
+        rank = max(1, math.ceil(percentile / 100 * self.bus_count))
+        seen = 0
+        for delay_s in sorted(self.delay_counts):
+            seen += self.delay_counts[delay_s]
+            if seen >= rank:
+                return delay_s
+        return 0
+
+    def to_result(self) -> dict[str, Any]:
+        return {
+            "bus_count": self.bus_count,
+            "passenger_count": self.passenger_count,
+            "accident_count": self.accident_count,
+            "average_delay_s": round(self.total_delay_s / self.bus_count)
+            if self.bus_count
+            else 0,
+            "delay_percentiles_s": {
+                str(percentile): self.delay_percentile_s(percentile)
+                for percentile in DELAY_PERCENTILES
+            },
+        }
+
+
+class CityAnalyticsAccumulator(CityStatsAccumulator):
+    """Accumulates stats of one city and date and aggregates of its groups of buses."""
+
+    def __init__(self, group_by: GroupBy, city_name: str, date: str) -> None:
+        super().__init__()
+        self.group_by = group_by
+        self.city_name = city_name
+        self.date = date
+        self.groups: dict[str, GroupAggregate] = collections.defaultdict(GroupAggregate)
+
+    def add(self, city_data: list[dict[str, Any]]) -> None:
+        super().add(city_data)
+        for bus_details in city_data:
+            self.groups[self._group_key(bus_details)].add(
+                bus_details["passengers"],
+                bus_details["accident"],
+                parse_delay_s(bus_details["delay"]),
+            )
+
+    def _group_key(self, bus_details: dict[str, Any]) -> str:
+        if self.group_by == "city":
+            return self.city_name
+        if self.group_by == "date":
+            return self.date
+        if self.group_by == "bus-type":
+            return bus_details["bus-type"]
+        return (
+            f"{datetime.datetime.fromisoformat(bus_details['departure-time']).hour:02d}"
+        )
+
+
+def group_by_columns(group_by: GroupBy) -> list[str]:
+    """Columns of columnar copy needed to aggregate groups."""
+    group_column = {"bus-type": ["bus-type"], "hour": ["departure-time"]}
+    return [
+        "passengers",
+        "accident",
+        "delay-seconds",
+        *group_column.get(group_by, []),
+    ]
+
+
+def aggregate_city_columns(
+    group_by: GroupBy, city_name: str, date: str, columns: dict[str, list[ColumnValue]]
+) -> dict[str, GroupAggregate]:
+    """Aggregates of groups of buses of one city and date read from columnar copy."""
+    groups: dict[str, GroupAggregate] = collections.defaultdict(GroupAggregate)
+    for row, (passengers, accident, delay_s) in enumerate(
+        zip(columns["passengers"], columns["accident"], columns["delay-seconds"])
+    ):
+        if group_by == "city":
+            group_key = city_name
+        elif group_by == "date":
+            group_key = date
+        elif group_by == "bus-type":
+            group_key = str(columns["bus-type"][row])
+        else:
+            departure_time = datetime.datetime.fromtimestamp(
+                int(columns["departure-time"][row]), datetime.UTC
+            )
+            group_key = f"{departure_time.hour:02d}"
+        groups[group_key].add(int(passengers), bool(accident), float(delay_s))
+    return groups
+
+
+def merge_groups(
+    groups_of_objects: Iterable[dict[str, GroupAggregate]],
+) -> dict[str, GroupAggregate]:
+    """Merge partial aggregates of groups of many scanned objects."""
+    merged: dict[str, GroupAggregate] = collections.defaultdict(GroupAggregate)
+    for groups in groups_of_objects:
+        for group_key, group in groups.items():
+            merged[group_key].merge(group)
+    return dict(sorted(merged.items()))
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+import time
+from logging import getLogger
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+from slugify import slugify
+
+from city_details_proccesing import City
+from ref_server_communication import CitiesResponse, get_cities_if_modified
+from single_flight import SingleFlight
+
+logger = getLogger(__name__)
+
+CITY_CATALOGUE_FORMAT_VERSION = 1
+
+FetchCities = Callable[
+    [aiohttp.ClientSession, str | None, str | None], Awaitable[CitiesResponse | None]
+]
+
+
+class CityCatalogue:
+    """Cities of ref server with slugs used in their S3 keys.
+
+    Cities are fetched again only after TTL expires, by conditional request if ref server sent ETag or Last-Modified.
+    Slugs are computed once per city id and kept even if ref server renames the city, so its data keeps going to the
+    same S3 keys. If path is given, catalogue is stored there and loaded on start, so restarted app does not wait for
+    ref server while catalogue is fresh.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        ttl_s: float,
+        fetch: FetchCities = get_cities_if_modified,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.fetch = fetch
+        self.clock = clock
+        self.fetches = 0
+        self.not_modified = 0
+        self._entries: dict[int, dict[str, Any]] = {}
+        self._etag: str | None = None
+        self._last_modified: str | None = None
+        self._fetched_at = float("-inf")
+        self._cities: set[City] = set()
+        self._refresh: SingleFlight[None, None] = SingleFlight()
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+    async def get_cities(self, session: aiohttp.ClientSession) -> set[City]:
+        if self._fetched_at + self.ttl_s <= self.clock():
+            await self._refresh.run(
+                None, lambda: self._refresh_from_ref_server(session)
+            )
+        return self._cities
+
+    def counters(self) -> dict[str, int]:
+        return {
+            "cities": len(self._cities),
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+        }
+
+    async def _refresh_from_ref_server(self, session: aiohttp.ClientSession) -> None:
+        response = await self.fetch(session, self._etag, self._last_modified)
+        self.fetches += 1
+        if response is None:
+            self.not_modified += 1
+        else:
+            self._update(response.cities)
+            self._etag = response.etag
+            self._last_modified = response.last_modified
+        self._fetched_at = self.clock()
+        if self.path is not None:
+            self._save(self.path)
+
+    def _update(self, listed_cities: list[dict[str, Any]]) -> None:
+        for known_entry in self._entries.values():
+            known_entry["listed"] = False
+        for city in listed_cities:
+            entry = self._entries.get(city["id"])
+            if entry is None:
+                entry = {
+                    "name_slug": slugify(city["name"]),
+                    "country_slug": slugify(city["country"]),
+                }
+                self._entries[city["id"]] = entry
+            elif (entry["name"], entry["country"]) != (city["name"], city["country"]):
+                logger.warning(
+                    f"City {city['id']} renamed from {entry['name']}, {entry['country']} to "
+                    f"{city['name']}, {city['country']}. Keeping its S3 keys."
+                )
+            entry.update(name=city["name"], country=city["country"], listed=True)
+        self._cities = self._create_cities()
+
+    def _create_cities(self) -> set[City]:
+        return set(
+            City.create_city_from_slugs(entry["name_slug"], entry["country_slug"], id)
+            for id, entry in self._entries.items()
+            if entry["listed"]
+        )
+
+    def _load(self, path: str) -> None:
+        with open(path) as file:
+            catalogue = json.load(file)
+        if catalogue["version"] != CITY_CATALOGUE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported city catalogue version {catalogue['version']} in {path}."
+            )
+        self._entries = {int(id): entry for id, entry in catalogue["cities"].items()}
+        self._etag = catalogue["etag"]
+        self._last_modified = catalogue["last_modified"]
+        self._fetched_at = catalogue["fetched_at"]
+        self._cities = self._create_cities()
+
+    def _save(self, path: str) -> None:
+        """Write catalogue to temporary file and replace the old one, so it is never left half written."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False
+        ) as file:
+            json.dump(
+                {
+                    "version": CITY_CATALOGUE_FORMAT_VERSION,
+                    "etag": self._etag,
+                    "last_modified": self._last_modified,
+                    "fetched_at": self._fetched_at,
+                    "cities": self._entries,
+                },
+                file,
+            )
+        os.replace(file.name, path)
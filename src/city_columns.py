@@ -0,0 +1,250 @@
+"""Compressed typed columnar copy of raw ref server city data.
+
+Layout is similar to Parquet. Object starts with magic bytes, followed by zlib compressed column chunks of each row
+group. JSON footer with offsets and min/max of each column chunk is at the end, followed by footer length and magic
+bytes. Readers fetch footer first and then only column chunks of requested columns in row groups whose min/max can
+match filters.
+
+Columns:
+- departure-time: seconds since epoch (departure time is treated as UTC)
+- bus-type: dictionary encoded strings, dictionary of each row group is in footer
+- passengers
+- delay-seconds
+- accident
+"""
+
+import asyncio
+import datetime
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Awaitable, Callable, Iterable
+
+from city_details_proccesing import parse_delay_s
+
+COLUMNS_MAGIC = b"CCL1"
+COLUMNS_FORMAT_VERSION = 1
+COLUMN_TYPECODES = {
+    "departure-time": "q",
+    "bus-type": "I",
+    "passengers": "q",
+    "delay-seconds": "d",
+    "accident": "B",
+}
+_footer_length_format = "<I"
+_footer_tail_size = struct.calcsize(_footer_length_format) + len(COLUMNS_MAGIC)
+
+ColumnValue = int | float | bool | str
+# Inclusive (min, max) range of values for each filtered column.
+ColumnFilters = dict[str, tuple[ColumnValue, ColumnValue]]
+# Reads bytes [start, end) of columnar object.
+RangeReader = Callable[[int, int], Awaitable[bytes]]
+
+
+def _departure_time_s(departure_time: str) -> int:
+    return int(
+        datetime.datetime.fromisoformat(departure_time)
+        .replace(tzinfo=datetime.UTC)
+        .timestamp()
+    )
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode, data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class CityColumnsWriter:
+    """Encodes batches of bus details to row groups of columnar object.
+
+    Finished row groups are taken out by take_encoded, so the writer only holds the current row group and footer.
+    """
+
+    def __init__(self, row_group_size: int, compression_level: int = 6) -> None:
+        self.row_group_size = row_group_size
+        self.compression_level = compression_level
+        self._columns = self._empty_columns()
+        self._bus_types: dict[str, int] = {}
+        self._encoded = bytearray(COLUMNS_MAGIC)
+        self._size = len(COLUMNS_MAGIC)
+        self._row_groups: list[dict[str, Any]] = []
+
+    @staticmethod
+    def _empty_columns() -> dict[str, array]:
+        return {name: array(typecode) for name, typecode in COLUMN_TYPECODES.items()}
+
+    def add(self, city_data: list[dict[str, Any]]) -> None:
+        start = 0
+        while start < len(city_data):
+            free_rows = self.row_group_size - len(self._columns["passengers"])
+            self._add_batch(city_data[start : start + free_rows])
+            start += free_rows
+            if len(self._columns["passengers"]) == self.row_group_size:
+                self._flush_row_group()
+
+    def _add_batch(self, city_data: list[dict[str, Any]]) -> None:
+        columns = self._columns
+        columns["departure-time"].extend(
+            _departure_time_s(bus_details["departure-time"])
+            for bus_details in city_data
+        )
+        columns["bus-type"].extend(
+            self._bus_types.setdefault(bus_details["bus-type"], len(self._bus_types))
+            for bus_details in city_data
+        )
+        columns["passengers"].extend(
+            bus_details["passengers"] for bus_details in city_data
+        )
+        columns["delay-seconds"].extend(
+            parse_delay_s(bus_details["delay"]) for bus_details in city_data
+        )
+        columns["accident"].extend(bus_details["accident"] for bus_details in city_data)
+
+    def _flush_row_group(self) -> None:
+        row_count = len(self._columns["passengers"])
+        if not row_count:
+            return
+        dictionary = list(self._bus_types)
+        row_group: dict[str, Any] = {"row_count": row_count, "columns": {}}
+        for name, values in self._columns.items():
+            chunk = zlib.compress(_to_little_endian(values), self.compression_level)
+            column_meta: dict[str, Any] = {"offset": self._size, "length": len(chunk)}
+            if name == "bus-type":
+                column_meta["dictionary"] = dictionary
+                used_bus_types = sorted(dictionary[index] for index in set(values))
+                column_meta["min"], column_meta["max"] = (
+                    used_bus_types[0],
+                    used_bus_types[-1],
+                )
+            else:
+                column_meta["min"], column_meta["max"] = min(values), max(values)
+            row_group["columns"][name] = column_meta
+            self._encoded += chunk
+            self._size += len(chunk)
+        self._row_groups.append(row_group)
+        self._columns = self._empty_columns()
+        self._bus_types = {}
+
+    def take_encoded(self) -> bytes:
+        """Return bytes of the columnar object encoded since last call."""
+        encoded = bytes(self._encoded)
+        self._encoded.clear()
+        return encoded
+
+    def finish(self) -> bytes:
+        """Flush last row group and return rest of the columnar object including footer."""
+        self._flush_row_group()
+        footer = json.dumps(
+            {
+                "version": COLUMNS_FORMAT_VERSION,
+                "columns": COLUMN_TYPECODES,
+                "row_groups": self._row_groups,
+            }
+        ).encode("utf-8")
+        self._encoded += (
+            footer + struct.pack(_footer_length_format, len(footer)) + COLUMNS_MAGIC
+        )
+        return self.take_encoded()
+
+
+def encode_city_columns(
+    city_data: list[dict[str, Any]], row_group_size: int, compression_level: int = 6
+) -> bytes:
+    writer = CityColumnsWriter(row_group_size, compression_level)
+    writer.add(city_data)
+    return writer.take_encoded() + writer.finish()
+
+
+def _row_group_may_match(row_group: dict[str, Any], filters: ColumnFilters) -> bool:
+    for name, (low, high) in filters.items():
+        column_meta = row_group["columns"][name]
+        if column_meta["max"] < low or column_meta["min"] > high:
+            return False
+    return True
+
+
+def _decode_column_chunk(
+    name: str, chunk: bytes, column_meta: dict[str, Any]
+) -> list[ColumnValue]:
+    values = _from_little_endian(COLUMN_TYPECODES[name], zlib.decompress(chunk))
+    if name == "bus-type":
+        dictionary = column_meta["dictionary"]
+        return [dictionary[index] for index in values]
+    if name == "accident":
+        return [bool(value) for value in values]
+    return values.tolist()
+
+
+async def read_city_columns(
+    read_range: RangeReader,
+    object_size: int,
+    columns: Iterable[str],
+    filters: ColumnFilters | None = None,
+    footer_read_size: int = 64 * 1024,
+) -> dict[str, list[ColumnValue]]:
+    """Read requested columns of rows matching filters.
+
+    Only footer and column chunks of requested and filtered columns in row groups that can match filters are read.
+    """
+    filters = filters or {}
+    columns = list(columns)
+    tail_start = max(0, object_size - footer_read_size)
+    tail = await read_range(tail_start, object_size)
+    if tail[-len(COLUMNS_MAGIC) :] != COLUMNS_MAGIC:
+        raise ValueError("Invalid city columns object!")
+    (footer_length,) = struct.unpack(
+        _footer_length_format, tail[-_footer_tail_size : -len(COLUMNS_MAGIC)]
+    )
+    footer_start = object_size - _footer_tail_size - footer_length
+    if footer_start < tail_start:
+        tail = await read_range(footer_start, object_size)
+        tail_start = footer_start
+    footer = json.loads(
+        tail[footer_start - tail_start : footer_start - tail_start + footer_length]
+    )
+    if footer["version"] > COLUMNS_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported city columns format version {footer['version']}."
+        )
+
+    read_column_names = list(dict.fromkeys([*columns, *filters]))
+    results: dict[str, list[ColumnValue]] = {name: [] for name in columns}
+    for row_group in footer["row_groups"]:
+        if not _row_group_may_match(row_group, filters):
+            continue
+        column_metas = [row_group["columns"][name] for name in read_column_names]
+        chunks = await asyncio.gather(
+            *(
+                read_range(
+                    column_meta["offset"], column_meta["offset"] + column_meta["length"]
+                )
+                for column_meta in column_metas
+            )
+        )
+        row_group_columns = {
+            name: _decode_column_chunk(name, chunk, column_meta)
+            for name, chunk, column_meta in zip(read_column_names, chunks, column_metas)
+        }
+        selected_rows = [
+            row
+            for row in range(row_group["row_count"])
+            if all(
+                low <= row_group_columns[name][row] <= high  # type: ignore[operator]
+                for name, (low, high) in filters.items()
+            )
+        ]
+        for name in columns:
+            values = row_group_columns[name]
+            results[name].extend(values[row] for row in selected_rows)
+    return results
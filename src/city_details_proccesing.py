@@ -1,12 +1,26 @@
+import codecs
+import copy
 import dataclasses
+import functools
+import json
+import operator
+import re
 from dataclasses import dataclass
-from typing import Any, Iterable
+from typing import TYPE_CHECKING, Any, Iterable
 
 import isodate  # type:ignore[import-untyped] # Stub files not published
 from slugify import slugify
 
+from stats_sketches import DelaySketch, DistinctSketch
 
-@dataclasses.dataclass
+if TYPE_CHECKING:
+    from city_columns import CityColumnsWriter
+
+
+STATS_DELAY_PERCENTILES = (50, 95, 99)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class Stats:
     """Represents stats from one city in one day or cumulative stats from many cities in one day."""
 
@@ -14,23 +28,106 @@ class Stats:
     passenger_count: int
     exist_accident: bool
     average_delay_s: int
+    accident_count: int
+    total_delay_s: float
+    delay_sketch: DelaySketch | None = dataclasses.field(
+        default=None, compare=False, repr=False
+    )
+    bus_type_sketch: DistinctSketch | None = dataclasses.field(
+        default=None, compare=False, repr=False
+    )
+
+    @classmethod
+    def create_stats_from_sums(
+        cls,
+        bus_count: int,
+        passenger_count: int,
+        accident_count: int,
+        total_delay_s: float,
+        delay_sketch: DelaySketch | None = None,
+        bus_type_sketch: DistinctSketch | None = None,
+    ) -> "Stats":
+        return Stats(
+            bus_count=bus_count,
+            passenger_count=passenger_count,
+            exist_accident=accident_count > 0,
+            average_delay_s=round(total_delay_s / bus_count) if bus_count else 0,
+            accident_count=accident_count,
+            total_delay_s=total_delay_s,
+            delay_sketch=delay_sketch,
+            bus_type_sketch=bus_type_sketch,
+        )
 
     @classmethod
     def create_stats_from_s3_metadata(cls, metadata: dict[str, str]) -> "Stats":
+        bus_count, passenger_count, accident_count, total_delay_s = (
+            parse_sums_from_s3_metadata(metadata)
+        )
         return Stats(
-            bus_count=int(metadata["bus-count"]),
-            passenger_count=int(metadata["passenger-count"]),
+            bus_count=bus_count,
+            passenger_count=passenger_count,
             exist_accident=bool(int((metadata["exist-accident"]))),
             average_delay_s=int(metadata["average-delay-s"]),
+            accident_count=accident_count,
+            total_delay_s=total_delay_s,
+            delay_sketch=DelaySketch.decode(metadata["delay-sketch"])
+            if "delay-sketch" in metadata
+            else None,
+            bus_type_sketch=DistinctSketch.decode(metadata["bus-type-sketch"])
+            if "bus-type-sketch" in metadata
+            else None,
         )
 
     def create_s3_metadata_from_stats(self) -> dict[str, str]:
-        return {
+        metadata = {
             "bus-count": str(self.bus_count),
             "passenger-count": str(self.passenger_count),
             "exist-accident": str(int(self.exist_accident)),
             "average-delay-s": str(self.average_delay_s),
+            "accident-count": str(self.accident_count),
+            "total-delay-s": repr(self.total_delay_s),
         }
+        if self.delay_sketch is not None:
+            metadata["delay-sketch"] = self.delay_sketch.encode()
+        if self.bus_type_sketch is not None:
+            metadata["bus-type-sketch"] = self.bus_type_sketch.encode()
+        return metadata
+
+    def create_response_from_stats(self) -> dict[str, Any]:
+        """Stats as returned by API. Values derived from sketches are None if some of the data has no sketches."""
+        return {
+            "bus_count": self.bus_count,
+            "passenger_count": self.passenger_count,
+            "exist_accident": self.exist_accident,
+            "average_delay_s": self.average_delay_s,
+            "accident_count": self.accident_count,
+            "total_delay_s": self.total_delay_s,
+            "delay_percentiles_s": {
+                str(percentile): round(self.delay_sketch.quantile(percentile / 100))
+                for percentile in STATS_DELAY_PERCENTILES
+            }
+            if self.delay_sketch is not None
+            else None,
+            "distinct_bus_types": self.bus_type_sketch.estimate()
+            if self.bus_type_sketch is not None
+            else None,
+        }
+
+
+def parse_sums_from_s3_metadata(
+    metadata: dict[str, str],
+) -> tuple[int, int, int, float]:
+    """Bus count, passenger count, accident count and total delay stored in S3 metadata."""
+    bus_count = int(metadata["bus-count"])
+    exist_accident = bool(int((metadata["exist-accident"])))
+    average_delay_s = int(metadata["average-delay-s"])
+    return (
+        bus_count,
+        int(metadata["passenger-count"]),
+        # Metadata written before sums were stored. Sums are approximated from averages.
+        int(metadata.get("accident-count", int(exist_accident))),
+        float(metadata.get("total-delay-s", average_delay_s * bus_count)),
+    )
 
 
 def is_city_data_valid(city_data: list[dict[str, Any]]) -> bool:
@@ -38,45 +135,220 @@ def is_city_data_valid(city_data: list[dict[str, Any]]) -> bool:
     return True
 
 
-def create_city_stats_from_city_data(city_data: list[dict[str, Any]]):
+_simple_delay_format = re.compile(r"PT(\d+)([SM])")
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_delay_s(delay: str) -> float:
+    """Parse ISO-8601 duration to seconds."""
+    if match := _simple_delay_format.fullmatch(delay):
+        return float(int(match[1]) * (60 if match[2] == "M" else 1))
+    return isodate.parse_duration(delay).total_seconds()
+
+
+class CityStatsAccumulator:
+    """Accumulates single city single day stats from batches of bus details."""
+
+    def __init__(self) -> None:
+        self.total_delay_s: float = 0
+        self.total_passangers = 0
+        self.accident_count = 0
+        self.bus_count = 0
+        self.delay_sketch = DelaySketch()
+        self.bus_type_sketch = DistinctSketch()
+
+    def add(self, city_data: list[dict[str, Any]]) -> None:
+        delays_s = [parse_delay_s(bus_details["delay"]) for bus_details in city_data]
+        passengers = [bus_details["passengers"] for bus_details in city_data]
+        accidents = [bus_details["accident"] for bus_details in city_data]
+
+        # Builtin sum of floats is compensated, sequential addition matches bus by bus summation.
+        self.total_delay_s = functools.reduce(
+            operator.add, delays_s, self.total_delay_s
+        )
+        self.total_passangers += sum(passengers)
+        self.accident_count += sum(accidents)
+        self.bus_count += len(city_data)
+        self.delay_sketch.add(delays_s)
+        self.bus_type_sketch.add(
+            bus_details["bus-type"]
+            for bus_details in city_data
+            if "bus-type" in bus_details
+        )
+
+    def create_stats(self) -> Stats:
+        return Stats.create_stats_from_sums(
+            bus_count=self.bus_count,
+            passenger_count=self.total_passangers,
+            accident_count=self.accident_count,
+            total_delay_s=self.total_delay_s,
+            delay_sketch=copy.deepcopy(self.delay_sketch),
+            bus_type_sketch=copy.deepcopy(self.bus_type_sketch),
+        )
+
+
+class CityStatsParser:
+    """Incrementally parses raw ref server city data chunk by chunk and accumulates its stats."""
+
+    _whitespace = re.compile(r"[ \t\n\r]*")
+    _json_decoder = json.JSONDecoder()
+
+    def __init__(
+        self,
+        columns_writer: "CityColumnsWriter | None" = None,
+        accumulator: CityStatsAccumulator | None = None,
+    ) -> None:
+        self.columns_writer = columns_writer
+        self.accumulator = accumulator or CityStatsAccumulator()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        # One of: "start", "first_item", "item", "separator", "end"
+        self._expecting = "start"
+
+    def feed(self, chunk: bytes) -> None:
+        self._parse_available(self._text_decoder.decode(chunk))
+
+    def finish(self) -> Stats:
+        self._parse_available(self._text_decoder.decode(b"", final=True))
+        if self._expecting != "end" or self._position != len(self._buffer):
+            raise ValueError("Invalid input data!")
+        return self.accumulator.create_stats()
+
+    def _parse_available(self, text: str) -> None:
+        self._buffer = self._buffer[self._position :] + text
+        self._position = 0
+        batch: list[dict[str, Any]] = []
+        try:
+            self._parse_buffer(batch)
+        finally:
+            self.accumulator.add(batch)
+            if self.columns_writer is not None:
+                self.columns_writer.add(batch)
+
+    def _parse_buffer(self, batch: list[dict[str, Any]]) -> None:
+        while True:
+            whitespace = self._whitespace.match(self._buffer, self._position)
+            position = self._position = (
+                whitespace.end() if whitespace else self._position
+            )
+            if position == len(self._buffer) or self._expecting == "end":
+                return
+            char = self._buffer[position]
+            if self._expecting == "start":
+                if char != "[":
+                    raise ValueError("Invalid input data!")
+                self._position += 1
+                self._expecting = "first_item"
+            elif char == "]" and self._expecting in ("first_item", "separator"):
+                self._position += 1
+                self._expecting = "end"
+            elif self._expecting == "separator":
+                if char != ",":
+                    raise ValueError("Invalid input data!")
+                self._position += 1
+                self._expecting = "item"
+            elif self._parse_complete_items(batch):
+                self._expecting = "separator"
+            else:
+                try:
+                    bus_details, self._position = self._json_decoder.raw_decode(
+                        self._buffer, position
+                    )
+                except json.JSONDecodeError:
+                    # Incomplete bus details. Wait for next chunk.
+                    return
+                batch.append(bus_details)
+                self._expecting = "separator"
+
+    def _parse_complete_items(self, batch: list[dict[str, Any]]) -> bool:
+        """Fast path decoding all complete items in buffer by single json.loads call."""
+        end = self._buffer.rfind("}") + 1
+        if end <= self._position:
+            return False
+        try:
+            items = json.loads(f"[{self._buffer[self._position : end]}]")
+        except json.JSONDecodeError:
+            return False
+        batch.extend(items)
+        self._position = end
+        return True
+
+
+def feed_city_stats_parser(parser: CityStatsParser, data: bytes) -> CityStatsParser:
+    """Feed data to parser and return it. Used to run parsing in another process, which works on parser copy."""
+    parser.feed(data)
+    return parser
+
+
+def create_city_stats_from_city_data(city_data: list[dict[str, Any]]) -> Stats:
     """Creates single city single day stats."""
     if not is_city_data_valid(city_data):
         raise ValueError("Invalid input data!")
 
-    total_delay_s = 0
-    total_passangers = 0
-    exist_accident = False
-    bus_count = len(city_data)
-    for bus_details in city_data:
-        total_delay_s += isodate.parse_duration(bus_details["delay"]).total_seconds()
-        total_passangers += bus_details["passengers"]
-        exist_accident = exist_accident or bus_details["accident"]
-
-    return Stats(
-        bus_count=bus_count,
-        passenger_count=total_passangers,
-        exist_accident=exist_accident,
-        average_delay_s=round(total_delay_s / bus_count),
-    )
+    accumulator = CityStatsAccumulator()
+    accumulator.add(city_data)
+    return accumulator.create_stats()
+
+
+def create_city_stats_from_raw_city_data(raw_city_data: bytes) -> Stats:
+    """Creates single city single day stats directly from raw ref server response."""
+    parser = CityStatsParser()
+    parser.feed(raw_city_data)
+    return parser.finish()
 
 
 def combine_stats(mupltiple_stats: Iterable[Stats]) -> Stats:
     """Combine multiple stats to single aggregated result."""
-    total_delay_s = 0
+    total_delay_s = 0.0
     total_passangers = 0
-    exist_accident = False
+    accident_count = 0
     bus_count = 0
+    delay_sketch: DelaySketch | None = DelaySketch()
+    bus_type_sketch: DistinctSketch | None = DistinctSketch()
     for single_stats in mupltiple_stats:
-        total_delay_s += single_stats.average_delay_s * single_stats.bus_count
+        total_delay_s += single_stats.total_delay_s
         total_passangers += single_stats.passenger_count
-        exist_accident = exist_accident or single_stats.exist_accident
+        accident_count += single_stats.accident_count
         bus_count += single_stats.bus_count
+        if single_stats.delay_sketch is not None and delay_sketch is not None:
+            delay_sketch.merge(single_stats.delay_sketch)
+        elif single_stats.bus_count:
+            delay_sketch = None
+        if single_stats.bus_type_sketch is not None and bus_type_sketch is not None:
+            bus_type_sketch.merge(single_stats.bus_type_sketch)
+        elif single_stats.bus_count:
+            bus_type_sketch = None
 
-    return Stats(
+    return Stats.create_stats_from_sums(
         bus_count=bus_count,
         passenger_count=total_passangers,
-        exist_accident=exist_accident,
-        average_delay_s=total_delay_s // bus_count,
+        accident_count=accident_count,
+        total_delay_s=total_delay_s,
+        delay_sketch=delay_sketch,
+        bus_type_sketch=bus_type_sketch,
+    )
+
+
+def subtract_stats(aggregated_stats: Stats, removed_stats: Stats) -> Stats:
+    """Remove contribution of removed_stats from aggregated stats that contain it."""
+    delay_sketch = None
+    if aggregated_stats.delay_sketch is not None and (
+        removed_stats.delay_sketch is not None or not removed_stats.bus_count
+    ):
+        delay_sketch = copy.deepcopy(aggregated_stats.delay_sketch)
+        if removed_stats.delay_sketch is not None:
+            delay_sketch.subtract(removed_stats.delay_sketch)
+    return Stats.create_stats_from_sums(
+        bus_count=aggregated_stats.bus_count - removed_stats.bus_count,
+        passenger_count=aggregated_stats.passenger_count
+        - removed_stats.passenger_count,
+        accident_count=aggregated_stats.accident_count - removed_stats.accident_count,
+        total_delay_s=aggregated_stats.total_delay_s - removed_stats.total_delay_s,
+        delay_sketch=delay_sketch,
+        bus_type_sketch=aggregated_stats.bus_type_sketch
+        if not removed_stats.bus_count
+        else None,
     )
 
 
@@ -90,3 +362,14 @@ class City:
         self.name = slugify(name)
         self.country = slugify(country)
         self.id = id
+
+    @classmethod
+    def create_city_from_slugs(
+        cls, name_slug: str, country_slug: str, id: int
+    ) -> "City":
+        """City with already slugified name and country."""
+        city = cls.__new__(cls)
+        city.name = name_slug
+        city.country = country_slug
+        city.id = id
+        return city
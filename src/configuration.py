@@ -1,8 +1,12 @@
 import os
 import socket
+from typing import cast
 
 from types_aiobotocore_s3.literals import BucketLocationConstraintType
 
+from content_encoding import DEFAULT_COMPRESSION_LEVELS, check_content_encoding
+from stats_executor import ExecutorKind, default_executor_kind
+
 # Deployment is out of scope of the task. Simple string constants to be used as a configuration.
 if os.environ.get("DOCKER_COMPOSE"):
     # Names used in docker compose
@@ -21,10 +25,103 @@ else:
 
 
 REFERENCE_SERVER = f"http://{REFERENCE_SERVER_ADDRESS}:{REFERENCE_SERVER_PORT}"
+REFERENCE_SERVER_READ_CHUNK_SIZE = 64 * 1024
+# Connection pool of app wide ref server session.
+REFERENCE_SERVER_MAX_CONNECTIONS = 100
+REFERENCE_SERVER_MAX_CONNECTIONS_PER_HOST = 50
+REFERENCE_SERVER_KEEPALIVE_TIMEOUT_S = 30
+# Ref server responses are decompressed by aiohttp while they are read.
+REFERENCE_SERVER_ACCEPT_ENCODING = "gzip, deflate"
 AWS_ACCESS_KEY_ID = "some_id"
 AWS_SECRET_ACCESS_KEY = "some_key"
 AWS_REGION_NAME: BucketLocationConstraintType = "us-west-2"
 os.environ["AWS_ENDPOINT_URL"] = (
     f"http://{MOCKED_MOTO_SERVER_ADDRESS}:{MOCKED_MOTO_SERVER_PORT}"
 )
+# Connection pool of app wide S3 client.
+S3_MAX_POOL_CONNECTIONS = 100
+S3_TCP_KEEPALIVE = True
 AGGREGATED_STATS_FILE_NAME = "aggregated_stats"
+# Every data change of country and date creates two generation objects under this prefix. See README.md.
+AGGREGATED_STATS_GENERATIONS_PREFIX = "generations"
+# Generation objects older than this, except the latest one, are deleted whenever a data change ends.
+AGGREGATED_STATS_GENERATION_RETENTION_S = 15 * 60
+# Data change (intent generation without its done generation) older than this is considered finished. It bounds how
+# long a push that died in the middle blocks storing of aggregated stats of its country and date.
+AGGREGATED_STATS_DATA_CHANGE_LEASE_S = 60 * 60
+# In-process cache of aggregated stats per country and date.
+AGGREGATED_STATS_CACHE_MAX_ENTRIES = 100_000
+AGGREGATED_STATS_CACHE_TTL_S = 60 * 60
+# Range queries read yearly rollup instead of monthly rollups if they cover at least this many months of the year.
+# None disables yearly rollups.
+STATS_ROLLUP_YEARLY_MIN_MONTHS: int | None = 3
+# Known countries and their dates with data are refreshed from S3 after this time. Countries created by other app
+# instances are not visible to queries of this instance for at most this long.
+COUNTRY_REGISTRY_TTL_S = 60
+# Cities of ref server are fetched again after this time. Catalogue is stored in file at path, if set, so it survives
+# restarts and keeps S3 keys of renamed cities stable.
+CITY_CATALOGUE_PATH = os.environ.get("CITY_CATALOGUE_PATH")
+CITY_CATALOGUE_TTL_S = 10 * 60
+# Aggregation work items (countries, rollups, dates, city files) in flight at once in the whole app.
+# Keep below S3_MAX_POOL_CONNECTIONS.
+AGGREGATION_MAX_IN_FLIGHT = 64
+# Streamed /country-stats reads at most this many chunks (dates of one country in one rollup) at once.
+COUNTRY_STATS_STREAM_MAX_PENDING_CHUNKS = 8
+# Raw city objects scanned by /city-analytics at once in the whole app. Decoded data is parsed in parts of this size.
+ANALYTICS_SCAN_MAX_OBJECTS_IN_FLIGHT = 16
+ANALYTICS_SCAN_PART_SIZE = 1024 * 1024
+# Raw city stats larger than part size are uploaded by multipart upload. S3 requires at least 5 MiB parts.
+MULTIPART_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+# Multipart uploads are completed under this prefix and copied to final key once their stats are known.
+MULTIPART_UPLOAD_STAGING_PREFIX = "staging"
+# Content encoding of raw city data in S3. One of "identity", "gzip". Other values are rejected.
+RAW_DATA_CONTENT_ENCODING = check_content_encoding(
+    os.environ.get("RAW_DATA_CONTENT_ENCODING", "gzip")
+)
+RAW_DATA_COMPRESSION_LEVEL = int(
+    os.environ.get(
+        "RAW_DATA_COMPRESSION_LEVEL",
+        DEFAULT_COMPRESSION_LEVELS[RAW_DATA_CONTENT_ENCODING],
+    )
+)
+# Stats of each city file are also encoded in key of empty object under this prefix, so one listing reads all of them.
+CITY_STATS_INDEX_PREFIX = "city-stats"
+S3_LIST_PAGE_SIZE = 1000
+S3_MAX_KEY_LENGTH = 1024
+# Optional local disk cache of raw city objects read from S3 (directory path, disabled if not set) and its size limit.
+OBJECT_DISK_CACHE_PATH = os.environ.get("OBJECT_DISK_CACHE_PATH")
+OBJECT_DISK_CACHE_MAX_BYTES = int(
+    os.environ.get("OBJECT_DISK_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024)
+)
+# Optional compressed columnar copy of raw city data stored under {prefix}/{date}/{city}. See city_columns.py.
+CITY_COLUMNS_ENABLED = bool(int(os.environ.get("CITY_COLUMNS_ENABLED", "0")))
+CITY_COLUMNS_PREFIX = "columns"
+CITY_COLUMNS_ROW_GROUP_SIZE = 64 * 1024
+
+# Executor for CPU bound stats computation. One of "process", "thread", "inline".
+STATS_EXECUTOR_KIND = cast(
+    ExecutorKind, os.environ.get("STATS_EXECUTOR_KIND", default_executor_kind())
+)
+STATS_EXECUTOR_MAX_WORKERS = os.cpu_count() or 1
+# Parsing jobs waiting for executor. When full, receiving of further data is paused.
+STATS_EXECUTOR_MAX_PENDING = 2 * STATS_EXECUTOR_MAX_WORKERS
+
+# Ingestion limits shared by all /process-request calls.
+INGESTION_FETCH_CONCURRENCY = 50  # Ref server responses received at once.
+INGESTION_UPLOAD_CONCURRENCY = (
+    50  # S3 upload requests at once. Keep below S3_MAX_POOL_CONNECTIONS.
+)
+INGESTION_MAX_ATTEMPTS = 3
+INGESTION_BACKOFF_BASE_S = 0.5
+INGESTION_BACKOFF_MAX_S = 10
+# Ingestion jobs of /process-request running at once. Further jobs wait in queue.
+INGESTION_MAX_PARALLEL_JOBS = 2
+# Finished jobs whose status is still available.
+INGESTION_MAX_RETAINED_JOBS = 1000
+# After ingestion of a date, aggregated stats of its countries are created, added to rollups and cached right away, so
+# the first query of the date doesn't aggregate cities.
+INGESTION_PUBLISH_AGGREGATED_STATS = bool(
+    int(os.environ.get("INGESTION_PUBLISH_AGGREGATED_STATS", "1"))
+)
+# Dates of one /process-range backfill transferred at once. Their cities share the ingestion limits above.
+INGESTION_BACKFILL_MAX_DATES_IN_FLIGHT = 4
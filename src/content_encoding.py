@@ -0,0 +1,61 @@
+"""Content encodings of raw city data stored in S3.
+
+Data is encoded part by part. Each part is independent gzip member, so parts can be encoded in stats executor in
+parallel and their concatenation is still valid encoded stream.
+"""
+
+import gzip
+import zlib
+from typing import Any, Literal
+
+ContentEncoding = Literal["identity", "gzip"]
+
+CONTENT_ENCODINGS: tuple[ContentEncoding, ...] = ("identity", "gzip")
+DEFAULT_COMPRESSION_LEVELS: dict[ContentEncoding, int] = {
+    "identity": 0,
+    "gzip": 6,
+}
+
+
+def check_content_encoding(content_encoding: str) -> ContentEncoding:
+    if content_encoding not in CONTENT_ENCODINGS:
+        raise ValueError(
+            f"Unsupported content encoding {content_encoding}. "
+            f"Available: {', '.join(CONTENT_ENCODINGS)}."
+        )
+    return content_encoding  # type: ignore[return-value]
+
+
+def encode_part(
+    data: bytes, content_encoding: ContentEncoding, compression_level: int
+) -> bytes:
+    if content_encoding == "gzip":
+        return gzip.compress(data, compresslevel=compression_level, mtime=0)
+    return data
+
+
+class StreamDecoder:
+    """Incrementally decodes encoded stream consisting of any number of gzip members."""
+
+    def __init__(self, content_encoding: str) -> None:
+        self.content_encoding = check_content_encoding(content_encoding)
+        self._decompressor = self._create_decompressor()
+
+    def _create_decompressor(self) -> Any:
+        if self.content_encoding == "gzip":
+            return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        return None
+
+    def decode(self, chunk: bytes) -> bytes:
+        if self._decompressor is None:
+            return chunk
+        decoded = self._decompressor.decompress(chunk)
+        while self._decompressor.eof and self._decompressor.unused_data:
+            unused_data = self._decompressor.unused_data
+            self._decompressor = self._create_decompressor()
+            decoded += self._decompressor.decompress(unused_data)
+        return decoded
+
+    def finish(self) -> None:
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise ValueError("Incomplete encoded data!")
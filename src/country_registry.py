@@ -0,0 +1,51 @@
+import time
+from typing import Callable, Iterable
+
+
+class CountryRegistry:
+    """In-process index of country buckets and dates they have data for.
+
+    Filled from S3 on refresh after TTL expires. Countries and dates stored by this process are added immediately,
+    those stored by other app instances are found on next refresh. Dates are also added when queries find them in S3.
+    Data is never deleted, so refresh only adds.
+    """
+
+    def __init__(self, ttl_s: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self.refreshes = 0
+        self._dates_by_country: dict[str, set[str]] = {}
+        self._expires_at = float("-inf")
+
+    def is_expired(self) -> bool:
+        return self._expires_at <= self.clock()
+
+    def update(self, dates_by_country: dict[str, set[str]]) -> None:
+        """Add countries and dates loaded from S3 and start new TTL."""
+        for country, dates in dates_by_country.items():
+            self._dates_by_country.setdefault(country, set()).update(dates)
+        self._expires_at = self.clock() + self.ttl_s
+        self.refreshes += 1
+
+    def add_country(self, country: str) -> None:
+        self._dates_by_country.setdefault(country, set())
+
+    def add_date(self, country: str, date: str) -> None:
+        self._dates_by_country.setdefault(country, set()).add(date)
+
+    def knows_country(self, country: str) -> bool:
+        return country in self._dates_by_country
+
+    def countries(self) -> list[str]:
+        return sorted(self._dates_by_country)
+
+    def dates_with_data(self, country: str, dates: Iterable[str]) -> list[str]:
+        known_dates = self._dates_by_country.get(country, set())
+        return [date for date in dates if date in known_dates]
+
+    def counters(self) -> dict[str, int]:
+        return {
+            "countries": len(self._dates_by_country),
+            "dates": sum(len(dates) for dates in self._dates_by_country.values()),
+            "refreshes": self.refreshes,
+        }
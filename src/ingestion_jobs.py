@@ -0,0 +1,323 @@
+import asyncio
+import collections
+import dataclasses
+import datetime
+import time
+import uuid
+from logging import getLogger
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Literal
+
+from city_details_proccesing import City
+from ingestion_scheduler import CityTransferResult
+
+logger = getLogger(__name__)
+
+JobStatus = Literal["queued", "running", "finished", "failed"]
+CityStatus = Literal["pending", "running", "succeeded", "failed"]
+
+
+@dataclasses.dataclass
+class CityProgress:
+    city: str
+    country: str
+    status: CityStatus = "pending"
+    attempts: int = 0
+    bytes_transferred: int = 0
+    error: str | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class CityFilter:
+    """Cities selected for ingestion by slugs of their countries and names. Empty sets select all cities."""
+
+    countries: frozenset[str] = frozenset()
+    cities: frozenset[str] = frozenset()
+
+    def matches(self, city: City) -> bool:
+        return (not self.countries or city.country in self.countries) and (
+            not self.cities or city.name in self.cities
+        )
+
+
+@dataclasses.dataclass
+class IngestionJob:
+    """Progress of transferring data of all selected cities on one date."""
+
+    id: str
+    date: datetime.date
+    city_filter: CityFilter = CityFilter()
+    status: JobStatus = "queued"
+    error: str | None = None
+    created_at: datetime.datetime = dataclasses.field(
+        default_factory=lambda: datetime.datetime.now(datetime.UTC)
+    )
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+    cities: dict[City, CityProgress] = dataclasses.field(default_factory=dict)
+    _started_monotonic: float | None = dataclasses.field(default=None, init=False)
+    _finished_monotonic: float | None = dataclasses.field(default=None, init=False)
+    _done: asyncio.Event = dataclasses.field(default_factory=asyncio.Event, init=False)
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def bytes_transferred(self) -> int:
+        return sum(progress.bytes_transferred for progress in self.cities.values())
+
+    @property
+    def throughput_bytes_per_s(self) -> float:
+        if self._started_monotonic is None:
+            return 0
+        end = self._finished_monotonic or time.monotonic()
+        return self.bytes_transferred / max(end - self._started_monotonic, 1e-9)
+
+    def start(self) -> None:
+        self.status = "running"
+        self.started_at = datetime.datetime.now(datetime.UTC)
+        self._started_monotonic = time.monotonic()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.status = "failed" if error else "finished"
+        self.error = repr(error) if error else None
+        self.finished_at = datetime.datetime.now(datetime.UTC)
+        self._finished_monotonic = time.monotonic()
+        self._done.set()
+
+    async def wait(self) -> None:
+        await self._done.wait()
+
+    def add_cities(self, cities: set[City]) -> None:
+        for city in cities:
+            self.cities[city] = CityProgress(city.name, city.country)
+
+    async def track_transfer(
+        self, city: City, chunks: AsyncIterable[bytes]
+    ) -> AsyncIterator[bytes]:
+        """Pass through chunks of one transfer attempt of city and count its bytes."""
+        progress = self.cities[city]
+        progress.status = "running"
+        progress.attempts += 1
+        progress.bytes_transferred = 0
+        async for chunk in chunks:
+            progress.bytes_transferred += len(chunk)
+            yield chunk
+
+    def record_result(self, city: City, result: CityTransferResult) -> None:
+        progress = self.cities[city]
+        progress.status = "succeeded" if result.succeeded else "failed"
+        progress.attempts = result.attempts
+        progress.error = result.error
+
+    def to_status(self) -> dict[str, Any]:
+        city_statuses = collections.Counter(
+            progress.status for progress in self.cities.values()
+        )
+        return {
+            "id": self.id,
+            "date": str(self.date),
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at and self.started_at.isoformat(),
+            "finished_at": self.finished_at and self.finished_at.isoformat(),
+            "cities_total": len(self.cities),
+            "cities_succeeded": city_statuses["succeeded"],
+            "cities_failed": city_statuses["failed"],
+            "bytes_transferred": self.bytes_transferred,
+            "throughput_bytes_per_s": round(self.throughput_bytes_per_s),
+            "cities": [
+                dataclasses.asdict(progress) for progress in self.cities.values()
+            ],
+        }
+
+
+@dataclasses.dataclass
+class BackfillJob:
+    """Progress of transferring data of selected cities on range of dates as one pipeline.
+
+    Each date has its own IngestionJob. Dates that already had unfinished job when backfill was submitted reuse that
+    job and are not transferred again by the backfill.
+    """
+
+    id: str
+    jobs: list[IngestionJob]
+    city_filter: CityFilter
+    own_job_ids: set[str]
+    status: JobStatus = "queued"
+    error: str | None = None
+    created_at: datetime.datetime = dataclasses.field(
+        default_factory=lambda: datetime.datetime.now(datetime.UTC)
+    )
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def completed_through(self) -> datetime.date | None:
+        """Last date such that jobs of all dates up to it are done."""
+        completed_date = None
+        for job in self.jobs:
+            if job.active:
+                break
+            completed_date = job.date
+        return completed_date
+
+    def owns(self, job: IngestionJob) -> bool:
+        return job.id in self.own_job_ids
+
+    def start(self) -> None:
+        self.status = "running"
+        self.started_at = datetime.datetime.now(datetime.UTC)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.status = "failed" if error else "finished"
+        self.error = repr(error) if error else None
+        self.finished_at = datetime.datetime.now(datetime.UTC)
+        if error:
+            # Dates that were not started or not finished fail with the backfill.
+            for job in self.jobs:
+                if self.owns(job) and job.active:
+                    job.finish(error)
+
+    def to_status(self) -> dict[str, Any]:
+        job_statuses = collections.Counter(job.status for job in self.jobs)
+        completed_through = self.completed_through
+        return {
+            "id": self.id,
+            "from": str(self.jobs[0].date),
+            "to": str(self.jobs[-1].date),
+            "countries": sorted(self.city_filter.countries),
+            "cities": sorted(self.city_filter.cities),
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at and self.started_at.isoformat(),
+            "finished_at": self.finished_at and self.finished_at.isoformat(),
+            "dates_total": len(self.jobs),
+            "dates_finished": job_statuses["finished"],
+            "dates_failed": job_statuses["failed"],
+            "completed_through": completed_through and str(completed_through),
+            "bytes_transferred": sum(job.bytes_transferred for job in self.jobs),
+            "jobs": [
+                {"id": job.id, "date": str(job.date), "status": job.status}
+                for job in self.jobs
+            ],
+        }
+
+
+IngestionRun = Callable[[IngestionJob], Awaitable[None]]
+BackfillRun = Callable[[BackfillJob], Awaitable[None]]
+
+
+class IngestionJobManager:
+    """Runs ingestion jobs in background by fixed number of workers.
+
+    Submitting a date that already has queued or running job with the same city filter returns the existing job
+    instead of creating a new one. Backfill of range of dates is run by one worker and reuses such jobs as well.
+    Only the latest finished jobs are kept.
+    """
+
+    def __init__(self, max_parallel_jobs: int, max_retained_jobs: int):
+        self.max_parallel_jobs = max_parallel_jobs
+        self.max_retained_jobs = max_retained_jobs
+        self._jobs: collections.OrderedDict[str, IngestionJob | BackfillJob] = (
+            collections.OrderedDict()
+        )
+        self._active_jobs: dict[tuple[datetime.date, CityFilter], IngestionJob] = {}
+        self._queue: asyncio.Queue[
+            tuple[IngestionJob | BackfillJob, Callable[[], Awaitable[None]]]
+        ] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.max_parallel_jobs)
+        ]
+
+    async def shutdown(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(
+        self,
+        date: datetime.date,
+        run: IngestionRun,
+        city_filter: CityFilter = CityFilter(),
+    ) -> IngestionJob:
+        if (job := self._get_active_job(date, city_filter)) is not None:
+            return job
+        job = self._create_job(date, city_filter)
+        self._queue.put_nowait((job, lambda: run(job)))
+        self._forget_old_jobs()
+        return job
+
+    def submit_backfill(
+        self,
+        dates: list[datetime.date],
+        run: BackfillRun,
+        city_filter: CityFilter = CityFilter(),
+    ) -> BackfillJob:
+        """Create job for each date without unfinished job and run all dates by one worker. Dates must be ordered."""
+        jobs = []
+        own_job_ids = set()
+        for date in dates:
+            if (job := self._get_active_job(date, city_filter)) is None:
+                job = self._create_job(date, city_filter)
+                own_job_ids.add(job.id)
+            jobs.append(job)
+        backfill = BackfillJob(uuid.uuid4().hex, jobs, city_filter, own_job_ids)
+        self._jobs[backfill.id] = backfill
+        self._queue.put_nowait((backfill, lambda: run(backfill)))
+        self._forget_old_jobs()
+        return backfill
+
+    def get(self, job_id: str) -> IngestionJob | BackfillJob | None:
+        return self._jobs.get(job_id)
+
+    def _get_active_job(
+        self, date: datetime.date, city_filter: CityFilter
+    ) -> IngestionJob | None:
+        # Dates of running backfill are done one by one, but they are forgotten together when the backfill ends.
+        job = self._active_jobs.get((date, city_filter))
+        return job if job is not None and job.active else None
+
+    def _create_job(self, date: datetime.date, city_filter: CityFilter) -> IngestionJob:
+        job = IngestionJob(id=uuid.uuid4().hex, date=date, city_filter=city_filter)
+        self._jobs[job.id] = job
+        self._active_jobs[(date, city_filter)] = job
+        return job
+
+    async def _worker(self) -> None:
+        while True:
+            job, run = await self._queue.get()
+            job.start()
+            try:
+                await run()
+                job.finish()
+            except Exception as error:
+                logger.exception(f"Ingestion job {job.id} failed.")
+                job.finish(error)
+            finally:
+                if isinstance(job, BackfillJob):
+                    for date_job in job.jobs:
+                        if job.owns(date_job):
+                            self._forget_active_job(date_job)
+                else:
+                    self._forget_active_job(job)
+                self._queue.task_done()
+
+    def _forget_active_job(self, job: IngestionJob) -> None:
+        if self._active_jobs.get((job.date, job.city_filter)) is job:
+            del self._active_jobs[(job.date, job.city_filter)]
+
+    def _forget_old_jobs(self) -> None:
+        finished_jobs = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished_jobs[: max(0, len(self._jobs) - self.max_retained_jobs)]:
+            del self._jobs[job_id]
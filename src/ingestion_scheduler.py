@@ -0,0 +1,137 @@
+import asyncio
+import dataclasses
+import datetime
+import random
+from logging import getLogger
+from typing import AsyncGenerator, AsyncIterable, Awaitable, Callable, Iterable
+
+import aiohttp
+import botocore.exceptions
+from botocore.exceptions import ClientError
+
+from city_details_proccesing import City, Stats
+from single_flight import SingleFlight
+
+logger = getLogger(__name__)
+
+# S3 error codes of throttled requests. Server errors (5xx) are recognized by HTTP status.
+THROTTLING_ERROR_CODES = frozenset(
+    (
+        "RequestLimitExceeded",
+        "RequestTimeout",
+        "RequestTimeTooSkewed",
+        "SlowDown",
+        "Throttling",
+        "ThrottlingException",
+        "TooManyRequests",
+    )
+)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Whether error can disappear on retry: throttling, server errors, timeouts and connection errors.
+
+    Other errors, like invalid data, missing bucket or denied access, are reported immediately.
+    """
+    if isinstance(error, ClientError):
+        return (
+            error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+            or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+            >= 500
+        )
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(
+        error,
+        (
+            aiohttp.ClientError,
+            botocore.exceptions.ConnectionError,
+            botocore.exceptions.HTTPClientError,
+            ConnectionError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+@dataclasses.dataclass
+class CityTransferResult:
+    """Result of transferring data of one city from ref server to S3."""
+
+    city: str
+    country: str
+    attempts: int
+    error: str | None = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class IngestionScheduler:
+    """Limits concurrency of ingestion stages and retries failed city transfers.
+
+    Fetch stage is limited by number of concurrently received ref server responses, see fetch. Upload stage is limited
+    by number of concurrent S3 upload requests. Parse stage is limited by StatsExecutor. Concurrent transfers of the
+    same city and date can share one transfer through city_transfers.
+    """
+
+    def __init__(
+        self,
+        fetch_concurrency: int,
+        upload_concurrency: int,
+        max_attempts: int,
+        backoff_base_s: float,
+        backoff_max_s: float,
+    ):
+        self.fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        self.upload_slots = asyncio.Semaphore(upload_concurrency)
+        self.city_transfers: SingleFlight[tuple[City, datetime.date], Stats] = (
+            SingleFlight()
+        )
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+    def backoff_s(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(
+            0, min(self.backoff_max_s, self.backoff_base_s * 2 ** (attempt - 1))
+        )
+
+    async def fetch(self, chunks: AsyncIterable[bytes]) -> AsyncGenerator[bytes, None]:
+        """Pass through chunks of ref server response while holding fetch slot.
+
+        Slot is released as soon as the whole response is received, so it is not held while the rest of the transfer
+        is being uploaded. Callers close the iterator (contextlib.aclosing) to release the slot also on failure.
+        """
+        async with self.fetch_slots:
+            async for chunk in chunks:
+                yield chunk
+
+    async def transfer_city(
+        self, city: City, transfer: Callable[[City], Awaitable[object]]
+    ) -> CityTransferResult:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await transfer(city)
+                return CityTransferResult(city.name, city.country, attempt)
+            except Exception as error:
+                if not is_transient_error(error) or attempt >= self.max_attempts:
+                    return self._failed(city, attempt, error)
+                logger.warning(f"Retrying transfer of {city} after error: {error!r}")
+                await asyncio.sleep(self.backoff_s(attempt))
+
+    async def transfer_cities(
+        self, cities: Iterable[City], transfer: Callable[[City], Awaitable[object]]
+    ) -> list[CityTransferResult]:
+        """Transfer all cities. Failure of one city does not stop transfers of others."""
+        return await asyncio.gather(
+            *(self.transfer_city(city, transfer) for city in cities)
+        )
+
+    @staticmethod
+    def _failed(city: City, attempts: int, error: Exception) -> CityTransferResult:
+        logger.error(f"Transfer of {city} failed after {attempts} attempts: {error!r}")
+        return CityTransferResult(city.name, city.country, attempts, repr(error))
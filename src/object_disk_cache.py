@@ -0,0 +1,266 @@
+"""Local disk copies of S3 objects, so repeated reads of the same large objects don't download them again.
+
+Each object is stored as file named by hash of its bucket, key and ETag, next to small JSON file with its description.
+Only the latest ETag of each bucket and key is kept. Callers ask S3 whether cached ETag is still current by
+conditional request and read the local copy through mmap only if it is.
+Files are opened, written, mapped and removed in threads, so event loop never waits for disk. Entries are only
+changed on event loop.
+"""
+
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from typing import IO, AsyncIterator, Iterable
+
+ObjectKey = tuple[str, str]
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+@dataclasses.dataclass
+class _Entry:
+    etag: str
+    content_encoding: str
+    size: int
+    path: str
+
+
+class ObjectDiskCache:
+    """Disk cache of whole S3 objects keyed by bucket, key and ETag with LRU eviction bounded by total size.
+
+    Entries found in directory on start are kept, ordered by their last use.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stored_bytes = 0
+        self._entries: collections.OrderedDict[ObjectKey, _Entry] = (
+            collections.OrderedDict()
+        )
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def etag(self, bucket: str, key: str) -> str | None:
+        """ETag of cached copy of object, None if it is not cached."""
+        entry = self._entries.get((bucket, key))
+        return entry.etag if entry is not None else None
+
+    @contextlib.asynccontextmanager
+    async def read(
+        self, bucket: str, key: str, etag: str
+    ) -> AsyncIterator[tuple[memoryview, str] | None]:
+        """Memory-mapped content and content encoding of cached object. None if it is no longer cached.
+
+        Copy evicted while being read stays readable until the read ends.
+        """
+        entry = self._entries.get((bucket, key))
+        if entry is None or entry.etag != etag:
+            yield None
+            return
+        try:
+            file = await asyncio.to_thread(_open_to_map, entry.path, entry.size)
+        except FileNotFoundError:
+            if self._entries.get((bucket, key)) is entry:
+                await self._remove((bucket, key))
+            yield None
+            return
+        self.hits += 1
+        if self._entries.get((bucket, key)) is entry:
+            self._entries.move_to_end((bucket, key))
+        file_object, mapped = file
+        with file_object:
+            if mapped is None:
+                yield memoryview(b""), entry.content_encoding
+                return
+            with mapped, memoryview(mapped) as content:
+                yield content, entry.content_encoding
+
+    async def writer(
+        self, bucket: str, key: str, etag: str, content_encoding: str
+    ) -> "ObjectDiskCacheWriter":
+        """Writer of new copy of object. Reading object from S3 instead of cache counts as miss."""
+        self.misses += 1
+        file = await asyncio.to_thread(_create_temporary_file, self.directory)
+        return ObjectDiskCacheWriter(self, (bucket, key), etag, content_encoding, file)
+
+    def counters(self) -> dict[str, int | float]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "stored_bytes": self.stored_bytes,
+        }
+
+    def _add(self, object_key: ObjectKey, entry: _Entry) -> list[str]:
+        """Add entry and return paths of replaced and evicted copies, which are to be removed."""
+        removed_paths = []
+        replaced = self._entries.pop(object_key, None)
+        if replaced is not None:
+            self.stored_bytes -= replaced.size
+            if replaced.path != entry.path:
+                removed_paths.append(replaced.path)
+        self._entries[object_key] = entry
+        self.stored_bytes += entry.size
+        while self.stored_bytes > self.max_bytes:
+            removed_paths.extend(self._forget(next(iter(self._entries))))
+            self.evictions += 1
+        return removed_paths
+
+    async def _remove(self, object_key: ObjectKey) -> None:
+        await asyncio.to_thread(_remove_files, self._forget(object_key))
+
+    def _forget(self, object_key: ObjectKey) -> list[str]:
+        entry = self._entries.pop(object_key, None)
+        if entry is None:
+            return []
+        self.stored_bytes -= entry.size
+        return [entry.path]
+
+    def _path(self, object_key: ObjectKey, etag: str) -> str:
+        bucket, key = object_key
+        name = hashlib.sha256(f"{bucket}/{key}/{etag}".encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _load(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # Copy of interrupted write.
+                os.remove(path)
+            elif name.endswith(".json"):
+                with open(path) as file:
+                    description = json.load(file)
+                object_key = (description["bucket"], description["key"])
+                path = self._path(object_key, description["etag"])
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    os.remove(f"{path}.json")
+                    continue
+                entry = _Entry(
+                    description["etag"],
+                    description["content_encoding"],
+                    stat.st_size,
+                    path,
+                )
+                entries.append((stat.st_mtime_ns, object_key, entry))
+        for _, object_key, entry in sorted(entries, key=lambda item: item[0]):
+            _remove_files(self._add(object_key, entry))
+
+
+class ObjectDiskCacheWriter:
+    """Writes copy of object to temporary file. Copy is added to cache only when the whole object was written.
+
+    Chunks are buffered and written by WRITE_BUFFER_SIZE.
+    """
+
+    def __init__(
+        self,
+        cache: ObjectDiskCache,
+        object_key: ObjectKey,
+        etag: str,
+        content_encoding: str,
+        file: IO[bytes],
+    ):
+        self.cache = cache
+        self.object_key = object_key
+        self.etag = etag
+        self.content_encoding = content_encoding
+        self.size = 0
+        self._file = file
+        self._buffer = bytearray()
+        self._finished = False
+
+    async def write(self, chunk: bytes) -> None:
+        if self._finished:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_bytes:
+            # Object would evict everything else.
+            await self.abort()
+            return
+        self._buffer += chunk
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self._flush()
+
+    async def commit(self) -> None:
+        if self._finished:
+            return
+        await self._flush()
+        self._finished = True
+        path = self.cache._path(self.object_key, self.etag)
+        bucket, key = self.object_key
+        description = {
+            "bucket": bucket,
+            "key": key,
+            "etag": self.etag,
+            "content_encoding": self.content_encoding,
+        }
+        await asyncio.to_thread(_commit_file, self._file, path, description)
+        removed_paths = self.cache._add(
+            self.object_key, _Entry(self.etag, self.content_encoding, self.size, path)
+        )
+        await asyncio.to_thread(_remove_files, removed_paths)
+
+    async def abort(self) -> None:
+        """Discard the copy unless it was already committed."""
+        if self._finished:
+            return
+        self._finished = True
+        self._buffer.clear()
+        await asyncio.to_thread(_discard_file, self._file)
+
+    async def _flush(self) -> None:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.to_thread(self._file.write, data)
+
+
+def _create_temporary_file(directory: str) -> IO[bytes]:
+    return tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False)
+
+
+def _open_to_map(path: str, size: int) -> tuple[IO[bytes], mmap.mmap | None]:
+    """Open and map copy of object. Empty copy can't be mapped."""
+    file = open(path, "rb")
+    try:
+        # Last use survives restart as modification time.
+        os.utime(path)
+        if size == 0:
+            return file, None
+        return file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        file.close()
+        raise
+
+
+def _commit_file(file: IO[bytes], path: str, description: dict[str, str]) -> None:
+    file.close()
+    with open(f"{path}.json", "w") as description_file:
+        json.dump(description, description_file)
+    os.replace(file.name, path)
+
+
+def _discard_file(file: IO[bytes]) -> None:
+    file.close()
+    os.remove(file.name)
+
+
+def _remove_files(paths: Iterable[str]) -> None:
+    for path in paths:
+        for file_path in (path, f"{path}.json"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_path)
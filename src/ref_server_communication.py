@@ -1,34 +1,90 @@
+import dataclasses
 import datetime
 import json
 from logging import getLogger
+from typing import Any, AsyncIterator
 
 import aiohttp
 from litestar import Request
 
 from city_details_proccesing import City
-from configuration import REFERENCE_SERVER
+from configuration import (
+    REFERENCE_SERVER,
+    REFERENCE_SERVER_ACCEPT_ENCODING,
+    REFERENCE_SERVER_KEEPALIVE_TIMEOUT_S,
+    REFERENCE_SERVER_MAX_CONNECTIONS,
+    REFERENCE_SERVER_MAX_CONNECTIONS_PER_HOST,
+    REFERENCE_SERVER_READ_CHUNK_SIZE,
+)
 
 logger = getLogger(__name__)
 
 
+def create_ref_server_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=REFERENCE_SERVER_MAX_CONNECTIONS,
+            limit_per_host=REFERENCE_SERVER_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=REFERENCE_SERVER_KEEPALIVE_TIMEOUT_S,
+        ),
+        headers={"Accept-Encoding": REFERENCE_SERVER_ACCEPT_ENCODING},
+    )
+
+
+@dataclasses.dataclass
+class CitiesResponse:
+    """Cities as listed by ref server with validators for conditional requests."""
+
+    cities: list[dict[str, Any]]
+    etag: str | None = None
+    last_modified: str | None = None
+
+
 async def get_cities(session: aiohttp.ClientSession) -> set[City]:
-    async with session.get(f"{REFERENCE_SERVER}/cities") as response:
-        response_text = await response.read()
-        return set(
-            City(city_dict["name"], city_dict["country"], city_dict["id"])
-            for city_dict in json.loads(response_text)
+    response = await get_cities_if_modified(session)
+    # Never "not modified" without validators.
+    assert response is not None
+    return set(
+        City(city_dict["name"], city_dict["country"], city_dict["id"])
+        for city_dict in response.cities
+    )
+
+
+async def get_cities_if_modified(
+    session: aiohttp.ClientSession,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> CitiesResponse | None:
+    """Get cities unless they did not change since response with etag or last_modified. Returns None if unchanged."""
+    headers = {}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
+    async with session.get(f"{REFERENCE_SERVER}/cities", headers=headers) as response:
+        if response.status == 304:
+            return None
+        response.raise_for_status()
+        return CitiesResponse(
+            json.loads(await response.read()),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
         )
 
 
-async def get_raw_city_stats_from_ref_server(
+async def iter_raw_city_stats_from_ref_server(
     city: City, date: datetime.date, session: aiohttp.ClientSession
-) -> bytes:
+) -> AsyncIterator[bytes]:
+    """Yield raw city stats chunk by chunk as the response arrives."""
     params = {"date": str(date)}
     async with session.get(
         f"{REFERENCE_SERVER}/cities/{city.id}/stats", params=params
     ) as response:
-        response_text = await response.read()
-    return response_text
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(
+            REFERENCE_SERVER_READ_CHUNK_SIZE
+        ):
+            yield chunk
 
 
 def parse_start_and_end_date_from_query_params(
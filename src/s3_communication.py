@@ -1,26 +1,145 @@
 import asyncio
+import contextlib
+import dataclasses
 import datetime
+import itertools
 import json
+import uuid
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    cast,
+)
 
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
 from botocore.exceptions import ClientError
 from types_aiobotocore_s3 import S3Client
+from types_aiobotocore_s3.type_defs import ObjectTypeDef, UploadPartOutputTypeDef
 
+from bounded_fan_out import BoundedFanOut
+from city_analytics import (
+    CityAnalyticsAccumulator,
+    GroupAggregate,
+    GroupBy,
+    aggregate_city_columns,
+    group_by_columns,
+    merge_groups,
+)
+from city_columns import (
+    CityColumnsWriter,
+    ColumnFilters,
+    ColumnValue,
+    read_city_columns,
+)
 from city_details_proccesing import (
     City,
+    CityStatsParser,
     Stats,
     combine_stats,
-    create_city_stats_from_city_data,
+    feed_city_stats_parser,
+    subtract_stats,
 )
 from configuration import (
+    AGGREGATED_STATS_CACHE_MAX_ENTRIES,
+    AGGREGATED_STATS_CACHE_TTL_S,
+    AGGREGATED_STATS_DATA_CHANGE_LEASE_S,
     AGGREGATED_STATS_FILE_NAME,
+    AGGREGATED_STATS_GENERATION_RETENTION_S,
+    AGGREGATED_STATS_GENERATIONS_PREFIX,
+    AGGREGATION_MAX_IN_FLIGHT,
+    ANALYTICS_SCAN_MAX_OBJECTS_IN_FLIGHT,
+    ANALYTICS_SCAN_PART_SIZE,
     AWS_ACCESS_KEY_ID,
     AWS_REGION_NAME,
     AWS_SECRET_ACCESS_KEY,
+    CITY_COLUMNS_ENABLED,
+    CITY_COLUMNS_PREFIX,
+    CITY_COLUMNS_ROW_GROUP_SIZE,
+    CITY_STATS_INDEX_PREFIX,
+    COUNTRY_REGISTRY_TTL_S,
+    COUNTRY_STATS_STREAM_MAX_PENDING_CHUNKS,
+    MULTIPART_UPLOAD_PART_SIZE,
+    MULTIPART_UPLOAD_STAGING_PREFIX,
+    OBJECT_DISK_CACHE_MAX_BYTES,
+    OBJECT_DISK_CACHE_PATH,
+    RAW_DATA_COMPRESSION_LEVEL,
+    RAW_DATA_CONTENT_ENCODING,
+    S3_LIST_PAGE_SIZE,
+    S3_MAX_KEY_LENGTH,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_TCP_KEEPALIVE,
+    STATS_ROLLUP_YEARLY_MIN_MONTHS,
+)
+from content_encoding import ContentEncoding, StreamDecoder, encode_part
+from country_registry import CountryRegistry
+from object_disk_cache import ObjectDiskCache
+from single_flight import SingleFlight
+from stats_batch import StatsBatch
+from stats_cache import StatsCache
+from stats_executor import StatsExecutor, inline_stats_executor
+from stats_rollups import (
+    RollupDays,
+    decode_rollup,
+    encode_rollup,
+    monthly_rollup_key,
+    rollup_keys_for_dates,
+    rollup_period,
 )
 
 
-async def create_bucket(s3_client: S3Client, bucket_name: str) -> None:
+def _create_object_disk_cache() -> ObjectDiskCache | None:
+    if OBJECT_DISK_CACHE_PATH is None:
+        return None
+    return ObjectDiskCache(OBJECT_DISK_CACHE_PATH, OBJECT_DISK_CACHE_MAX_BYTES)
+
+
+@dataclasses.dataclass
+class StorageState:
+    """In-process caches and limits shared by all S3 communication of one app. Created in app lifespan."""
+
+    aggregated_stats_cache: StatsCache = dataclasses.field(
+        default_factory=lambda: StatsCache(
+            AGGREGATED_STATS_CACHE_MAX_ENTRIES, AGGREGATED_STATS_CACHE_TTL_S
+        )
+    )
+    aggregation_fan_out: BoundedFanOut = dataclasses.field(
+        default_factory=lambda: BoundedFanOut(AGGREGATION_MAX_IN_FLIGHT)
+    )
+    analytics_fan_out: BoundedFanOut = dataclasses.field(
+        default_factory=lambda: BoundedFanOut(ANALYTICS_SCAN_MAX_OBJECTS_IN_FLIGHT)
+    )
+    aggregation_single_flight: SingleFlight[
+        tuple[str, str], tuple[Stats, int | None]
+    ] = dataclasses.field(default_factory=SingleFlight)
+    country_registry: CountryRegistry = dataclasses.field(
+        default_factory=lambda: CountryRegistry(COUNTRY_REGISTRY_TTL_S)
+    )
+    country_registry_refresh: SingleFlight[None, None] = dataclasses.field(
+        default_factory=SingleFlight
+    )
+    object_disk_cache: ObjectDiskCache | None = dataclasses.field(
+        default_factory=_create_object_disk_cache
+    )
+
+    def counters(self) -> dict[str, Any]:
+        return {
+            "aggregated_stats_cache": self.aggregated_stats_cache.counters(),
+            "aggregation_fan_out": self.aggregation_fan_out.counters(),
+            "aggregation_single_flight": self.aggregation_single_flight.counters(),
+            "country_registry": self.country_registry.counters(),
+            "object_disk_cache": self.object_disk_cache.counters()
+            if self.object_disk_cache is not None
+            else None,
+        }
+
+
+async def create_bucket(
+    s3_client: S3Client, bucket_name: str, storage_state: StorageState
+) -> None:
     try:
         await s3_client.create_bucket(
             Bucket=bucket_name,
@@ -33,87 +152,1259 @@ async def create_bucket(s3_client: S3Client, bucket_name: str) -> None:
         ):
             # Do not raise if bucket already exists.
             raise client_error
+    storage_state.country_registry.add_country(bucket_name)
+
+
+async def get_country_registry(
+    s3_client: S3Client, storage_state: StorageState
+) -> CountryRegistry:
+    """Country registry, refreshed from S3 first if its TTL expired."""
+    if storage_state.country_registry.is_expired():
+        await storage_state.country_registry_refresh.run(
+            None,
+            lambda: _refresh_country_registry(s3_client, storage_state),
+            storage_state.aggregation_fan_out.slot_released,
+        )
+    return storage_state.country_registry
+
+
+async def _refresh_country_registry(
+    s3_client: S3Client, storage_state: StorageState
+) -> None:
+    """Every bucket is a country. Dates are read by single delimited listing of each bucket."""
+    countries = [
+        bucket["Name"] for bucket in (await s3_client.list_buckets())["Buckets"]
+    ]
+    dates = await storage_state.aggregation_fan_out.map(
+        lambda country: _list_dates_with_data(country, s3_client), countries
+    )
+    storage_state.country_registry.update(dict(zip(countries, dates)))
+
+
+async def _list_dates_with_data(country: str, s3_client: S3Client) -> set[str]:
+    dates = set()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(
+        Bucket=country,
+        Delimiter="/",
+        PaginationConfig={"PageSize": S3_LIST_PAGE_SIZE},
+    ):
+        for common_prefix in page.get("CommonPrefixes", []):
+            prefix = common_prefix["Prefix"].removesuffix("/")
+            try:
+                datetime.date.fromisoformat(prefix)
+            except ValueError:
+                continue  # Not a date, for example rollups or city stats index.
+            dates.add(prefix)
+    return dates
 
 
-def get_s3_client() -> S3Client:
+async def _get_dates_with_data(
+    country: str, dates: Iterable[str], s3_client: S3Client, storage_state: StorageState
+) -> set[str]:
+    """Dates of country with data. Dates not in country registry are looked up in listings of generations."""
+    registry = await get_country_registry(s3_client, storage_state)
+    if not registry.knows_country(country):
+        return set()
+    dates = list(dates)
+    dates_with_data = set(registry.dates_with_data(country, dates))
+    dates_by_rollup = rollup_keys_for_dates(
+        (
+            datetime.date.fromisoformat(date)
+            for date in dates
+            if date not in dates_with_data
+        ),
+        STATS_ROLLUP_YEARLY_MIN_MONTHS,
+    )
+    latest_generations = await storage_state.aggregation_fan_out.map(
+        lambda rollup_key: _get_latest_generations(
+            country, rollup_period(rollup_key), s3_client
+        ),
+        list(dates_by_rollup),
+    )
+    for rollup_dates, generations in zip(dates_by_rollup.values(), latest_generations):
+        for date in map(str, rollup_dates):
+            if date in generations:
+                registry.add_date(country, date)
+                dates_with_data.add(date)
+    return dates_with_data
+
+
+def get_s3_client(
+    max_pool_connections: int = S3_MAX_POOL_CONNECTIONS,
+    tcp_keepalive: bool = S3_TCP_KEEPALIVE,
+) -> S3Client:
     return get_session().create_client(
         "s3",
         region_name=AWS_REGION_NAME,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
         aws_access_key_id=AWS_ACCESS_KEY_ID,
+        config=AioConfig(
+            max_pool_connections=max_pool_connections, tcp_keepalive=tcp_keepalive
+        ),
     )
 
 
 async def push_city_stats_to_s3(
-    city: City, date: datetime.date, raw_city_stats: bytes, s3_client: S3Client
-):
-    # Expects existing buckets or other tasks already scheduled for creating them.
-    await s3_client.get_waiter("bucket_exists").wait(
-        Bucket=city.country, WaiterConfig={"MaxAttempts": 2, "Delay": 2}
+    city: City,
+    date: datetime.date,
+    raw_city_stats: bytes,
+    s3_client: S3Client,
+    storage_state: StorageState,
+) -> Stats:
+    """Upload already downloaded raw city stats with their stats in metadata."""
+    return await stream_city_stats_to_s3(
+        city, date, _single_chunk(raw_city_stats), s3_client, storage_state
     )
 
-    stats = create_city_stats_from_city_data(json.loads(raw_city_stats))
-    metadata = stats.create_s3_metadata_from_stats()
 
-    # New data makes existing aggregated stats invalid. Delete them if they exist.
-    await s3_client.delete_object(
-        Bucket=city.country, Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}"
+async def stream_city_stats_to_s3(
+    city: City,
+    date: datetime.date,
+    raw_city_stats_chunks: AsyncIterable[bytes],
+    s3_client: S3Client,
+    storage_state: StorageState,
+    part_size: int = MULTIPART_UPLOAD_PART_SIZE,
+    stats_executor: StatsExecutor = inline_stats_executor,
+    upload_slots: asyncio.Semaphore | None = None,
+    city_columns_enabled: bool = CITY_COLUMNS_ENABLED,
+    content_encoding: ContentEncoding = RAW_DATA_CONTENT_ENCODING,
+    compression_level: int = RAW_DATA_COMPRESSION_LEVEL,
+    in_data_change: "DataChange | None" = None,
+) -> Stats:
+    """Forward raw city stats chunks to S3 as they arrive and compute their stats on the fly."""
+    upload_slot = upload_slots or contextlib.nullcontext()
+    country_registry = storage_state.country_registry
+    if not country_registry.knows_country(city.country):
+        # Expects existing buckets or other tasks already scheduled for creating them.
+        await s3_client.get_waiter("bucket_exists").wait(
+            Bucket=city.country, WaiterConfig={"MaxAttempts": 2, "Delay": 2}
+        )
+        country_registry.add_country(city.country)
+
+    parse_task: asyncio.Future[CityStatsParser] = asyncio.Future()
+    parse_task.set_result(
+        CityStatsParser(
+            CityColumnsWriter(CITY_COLUMNS_ROW_GROUP_SIZE)
+            if city_columns_enabled
+            else None
+        )
     )
+    # Encoded row groups are taken from parser after each part, so they are not passed to executor again.
+    city_columns = bytearray()
+    part = bytearray()
+    encoded_part = bytearray()
+    multipart_upload: _MultipartUpload | None = None
 
-    await s3_client.put_object(
-        Bucket=city.country,
-        Key=f"{date}/{city.name}",
-        Body=raw_city_stats,
-        Metadata=metadata,
-        ContentType="application/json",
+    async def encode(data: bytes) -> bytes:
+        if content_encoding == "identity":
+            return data
+        return await stats_executor.run(
+            encode_part, data, content_encoding, compression_level
+        )
+
+    try:
+        async for chunk in raw_city_stats_chunks:
+            part += chunk
+            if len(part) >= part_size:
+                data = bytes(part)
+                part.clear()
+                # Parts are parsed in order. Waiting for previous part slows down receiving when executor is busy.
+                parser = await parse_task
+                if parser.columns_writer is not None:
+                    city_columns += parser.columns_writer.take_encoded()
+                parse_task = asyncio.create_task(
+                    stats_executor.run(feed_city_stats_parser, parser, data)
+                )
+                encoded_part += await encode(data)
+                if len(encoded_part) < part_size:
+                    continue
+                if multipart_upload is None:
+                    multipart_upload = await _MultipartUpload.create(
+                        s3_client,
+                        upload_slot,
+                        bucket=city.country,
+                        key=f"{MULTIPART_UPLOAD_STAGING_PREFIX}/{date}/{city.name}/{uuid.uuid4().hex}",
+                    )
+                await multipart_upload.upload_part(bytes(encoded_part))
+                encoded_part.clear()
+        parse_task = asyncio.create_task(
+            stats_executor.run(feed_city_stats_parser, await parse_task, bytes(part))
+        )
+        encoded_part += await encode(bytes(part))
+        parser = await parse_task
+        stats = parser.finish()
+        if parser.columns_writer is not None:
+            city_columns += parser.columns_writer.take_encoded()
+            city_columns += parser.columns_writer.finish()
+
+        # Identity data is stored without Content-Encoding header.
+        encoding_args: dict[str, Any] = (
+            {}
+            if content_encoding == "identity"
+            else {"ContentEncoding": content_encoding}
+        )
+
+        async def store() -> None:
+            await _delete_city_stats_index(city, date, s3_client)
+            if multipart_upload is None:
+                async with upload_slot:
+                    await s3_client.put_object(
+                        Bucket=city.country,
+                        Key=f"{date}/{city.name}",
+                        Body=bytes(encoded_part),
+                        Metadata=stats.create_s3_metadata_from_stats(),
+                        ContentType="application/json",
+                        **encoding_args,
+                    )
+            else:
+                if encoded_part:
+                    await multipart_upload.upload_part(bytes(encoded_part))
+                await multipart_upload.complete()
+                async with upload_slot:
+                    await s3_client.copy_object(
+                        Bucket=city.country,
+                        Key=f"{date}/{city.name}",
+                        CopySource={
+                            "Bucket": city.country,
+                            "Key": multipart_upload.key,
+                        },
+                        MetadataDirective="REPLACE",
+                        Metadata=stats.create_s3_metadata_from_stats(),
+                        ContentType="application/json",
+                        **encoding_args,
+                    )
+            async with upload_slot:
+                await s3_client.put_object(
+                    Bucket=city.country,
+                    Key=city_stats_index_key(date, city.name, stats),
+                    Body=b"",
+                )
+                if city_columns:
+                    await s3_client.put_object(
+                        Bucket=city.country,
+                        Key=f"{CITY_COLUMNS_PREFIX}/{date}/{city.name}",
+                        Body=bytes(city_columns),
+                        ContentType="application/octet-stream",
+                    )
+                else:
+                    await s3_client.delete_object(
+                        Bucket=city.country,
+                        Key=f"{CITY_COLUMNS_PREFIX}/{date}/{city.name}",
+                    )
+
+        async def store_in(change: DataChange) -> None:
+            replaced_stats = (
+                await _get_stored_city_stats(city, date, s3_client)
+                if city.country in change.aggregated_stats
+                else None
+            )
+            try:
+                await store()
+            except BaseException:
+                change.discard(city.country)
+                raise
+            if replaced_stats is not None:
+                change.record(city.country, replaced_stats, stats)
+
+        if in_data_change is not None:
+            await store_in(in_data_change)
+        else:
+            async with data_change(
+                [city.country], date, s3_client, storage_state
+            ) as change:
+                await store_in(change)
+        country_registry.add_date(city.country, str(date))
+    finally:
+        parse_task.cancel()
+        if multipart_upload is not None:
+            await multipart_upload.clean_up()
+    return stats
+
+
+async def iter_raw_city_stats_from_s3(
+    city: City,
+    date: datetime.date | str,
+    s3_client: S3Client,
+    storage_state: StorageState,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[bytes]:
+    """Yield raw city stats stored in S3 chunk by chunk, decoded according to their content encoding."""
+    async for chunk in _iter_decoded_object(
+        city.country,
+        f"{date}/{city.name}",
+        s3_client,
+        storage_state.object_disk_cache,
+        chunk_size,
+    ):
+        yield chunk
+
+
+async def _iter_decoded_object(
+    bucket: str,
+    key: str,
+    s3_client: S3Client,
+    object_disk_cache: ObjectDiskCache | None,
+    chunk_size: int = 64 * 1024,
+    cached_chunk_size: int = 1024 * 1024,
+) -> AsyncIterator[bytes]:
+    """Yield decoded object chunk by chunk, from its local copy if S3 confirms its ETag is still current."""
+    cached_etag = (
+        object_disk_cache.etag(bucket, key) if object_disk_cache is not None else None
     )
+    if object_disk_cache is not None and cached_etag is not None:
+        try:
+            response = await s3_client.get_object(
+                Bucket=bucket, Key=key, IfNoneMatch=cached_etag
+            )
+        except ClientError as client_error:
+            if client_error.response.get("Error", {}).get("Code") != "304":
+                raise client_error
+            async with object_disk_cache.read(bucket, key, cached_etag) as cached:
+                if cached is not None:
+                    content, content_encoding = cached
+                    decoder = StreamDecoder(content_encoding)
+                    for start in range(0, len(content), cached_chunk_size):
+                        decoded = await asyncio.to_thread(
+                            _decode_mapped_part,
+                            decoder,
+                            content,
+                            start,
+                            start + cached_chunk_size,
+                        )
+                        if decoded:
+                            yield decoded
+                    decoder.finish()
+                    return
+            # Local copy was evicted after the request.
+            response = await s3_client.get_object(Bucket=bucket, Key=key)
+    else:
+        response = await s3_client.get_object(Bucket=bucket, Key=key)
 
+    content_encoding = response.get("ContentEncoding", "identity")
+    decoder = StreamDecoder(content_encoding)
+    writer = (
+        await object_disk_cache.writer(bucket, key, response["ETag"], content_encoding)
+        if object_disk_cache is not None
+        else None
+    )
+    try:
+        async for chunk in response["Body"].iter_chunks(chunk_size):
+            if writer is not None:
+                await writer.write(chunk)
+            if decoded := decoder.decode(chunk):
+                yield decoded
+        decoder.finish()
+        if writer is not None:
+            await writer.commit()
+    finally:
+        if writer is not None:
+            await writer.abort()
 
-async def create_aggregated_stats_for_country_and_date(
-    country: str, date: str, s3_client: S3Client
+
+def _decode_mapped_part(
+    decoder: StreamDecoder, content: memoryview, start: int, end: int
+) -> bytes:
+    # Slice of mapped file is decoded without copying it to bytes first. Decoders accept any buffer.
+    with content[start:end] as content_part:
+        return bytes(decoder.decode(cast(bytes, content_part)))
+
+
+async def _single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def _get_stored_city_stats(
+    city: City, date: datetime.date, s3_client: S3Client
 ) -> Stats:
-    """Collect stats from metadata of files in country bucket with specific date and return combined stats."""
-    data_files_info = await s3_client.list_objects_v2(Bucket=country, Prefix=f"{date}/")
-    if "Contents" not in data_files_info:
-        aggregated_stats = Stats(
-            0, 0, False, 0
-        )  # No data on this day in any city of this country.
-    else:
-        data_files = data_files_info["Contents"]
-        get_metadata_tasks = [
-            asyncio.create_task(
-                s3_client.head_object(Bucket=country, Key=data_file["Key"])
+    """Stats of data of the city currently stored in S3. Zero stats if there is no data."""
+    try:
+        metadata = (
+            await s3_client.head_object(Bucket=city.country, Key=f"{date}/{city.name}")
+        )["Metadata"]
+    except ClientError as client_error:
+        if client_error.response.get("Error", {}).get("Code") != "404":
+            raise client_error
+        return combine_stats([])
+    return Stats.create_stats_from_s3_metadata(metadata)
+
+
+async def scan_city_analytics(
+    countries: list[str],
+    dates: list[str],
+    group_by: GroupBy,
+    s3_client: S3Client,
+    storage_state: StorageState,
+    stats_executor: StatsExecutor = inline_stats_executor,
+    part_size: int = ANALYTICS_SCAN_PART_SIZE,
+    city_columns_enabled: bool = CITY_COLUMNS_ENABLED,
+) -> dict[str, dict[str, GroupAggregate]]:
+    """Scan data of all cities of countries on dates and return aggregates of groups of each country."""
+    dates_with_data = await storage_state.aggregation_fan_out.map(
+        lambda country: _get_dates_with_data(country, dates, s3_client, storage_state),
+        countries,
+    )
+    country_dates = [
+        (country, date)
+        for country, country_dates_with_data in zip(countries, dates_with_data)
+        for date in dates
+        if date in country_dates_with_data
+    ]
+    city_objects = await storage_state.aggregation_fan_out.map(
+        lambda country_date: _list_city_objects(
+            *country_date, s3_client, city_columns_enabled
+        ),
+        country_dates,
+    )
+    objects = [
+        (country, date, city_name, columns_size)
+        for (country, date), date_city_objects in zip(country_dates, city_objects)
+        for city_name, columns_size in date_city_objects.items()
+    ]
+
+    async def scan_object(
+        object_: tuple[str, str, str, int | None],
+    ) -> dict[str, GroupAggregate]:
+        country, date, city_name, columns_size = object_
+        if columns_size is not None:
+            columns = await _read_city_columns_object(
+                country,
+                f"{CITY_COLUMNS_PREFIX}/{date}/{city_name}",
+                columns_size,
+                group_by_columns(group_by),
+                s3_client,
             )
-            for data_file in data_files
-        ]
-        await asyncio.gather(*get_metadata_tasks)
-        stats = [
-            Stats.create_stats_from_s3_metadata(task.result()["Metadata"])
-            for task in get_metadata_tasks
-        ]
-        aggregated_stats = combine_stats(stats)
+            return await stats_executor.run(
+                aggregate_city_columns, group_by, city_name, date, columns
+            )
+        parse_task: asyncio.Future[CityStatsParser] = asyncio.Future()
+        parse_task.set_result(
+            CityStatsParser(
+                accumulator=CityAnalyticsAccumulator(group_by, city_name, date)
+            )
+        )
+        part = bytearray()
+        try:
+            async for chunk in _iter_decoded_object(
+                country,
+                f"{date}/{city_name}",
+                s3_client,
+                storage_state.object_disk_cache,
+            ):
+                part += chunk
+                if len(part) >= part_size:
+                    data = bytes(part)
+                    part.clear()
+                    parse_task = asyncio.create_task(
+                        stats_executor.run(
+                            feed_city_stats_parser, await parse_task, data
+                        )
+                    )
+            parser = await stats_executor.run(
+                feed_city_stats_parser, await parse_task, bytes(part)
+            )
+        finally:
+            parse_task.cancel()
+        parser.finish()
+        return cast(CityAnalyticsAccumulator, parser.accumulator).groups
+
+    groups_of_objects = await storage_state.analytics_fan_out.map(scan_object, objects)
+    groups_by_country: dict[str, list[dict[str, GroupAggregate]]] = {
+        country: [] for country in countries
+    }
+    for (country, *_), groups in zip(objects, groups_of_objects):
+        groups_by_country[country].append(groups)
+    return {
+        country: merge_groups(country_groups)
+        for country, country_groups in groups_by_country.items()
+    }
+
+
+async def read_city_columns_from_s3(
+    city: City,
+    date: datetime.date | str,
+    columns: list[str],
+    s3_client: S3Client,
+    filters: ColumnFilters | None = None,
+) -> dict[str, list[ColumnValue]]:
+    """Read columns of city data rows matching filters from columnar copy by ranged GETs."""
+    key = f"{CITY_COLUMNS_PREFIX}/{date}/{city.name}"
+    object_size = (await s3_client.head_object(Bucket=city.country, Key=key))[
+        "ContentLength"
+    ]
+    return await _read_city_columns_object(
+        city.country, key, object_size, columns, s3_client, filters
+    )
+
+
+async def _read_city_columns_object(
+    country: str,
+    key: str,
+    object_size: int,
+    columns: list[str],
+    s3_client: S3Client,
+    filters: ColumnFilters | None = None,
+) -> dict[str, list[ColumnValue]]:
+    async def read_range(start: int, end: int) -> bytes:
+        response = await s3_client.get_object(
+            Bucket=country, Key=key, Range=f"bytes={start}-{end - 1}"
+        )
+        return await response["Body"].read()
+
+    return await read_city_columns(read_range, object_size, columns, filters)
+
+
+def city_stats_index_key(
+    date: datetime.date | str, city_name: str, stats: Stats
+) -> str:
+    """Key with stats and sketches of city data. Sketches are left out if the key would be too long for S3."""
+    prefix = f"{CITY_STATS_INDEX_PREFIX}/{date}/{city_name}/"
+    sums = f"{stats.bus_count}_{stats.passenger_count}_{stats.accident_count}_{stats.total_delay_s!r}"
+    if stats.delay_sketch is not None and stats.bus_type_sketch is not None:
+        key = f"{prefix}v3_{sums}~{stats.delay_sketch.encode()}~{stats.bus_type_sketch.encode()}"
+        if len(key) <= S3_MAX_KEY_LENGTH:
+            return key
+    return f"{prefix}v2_{sums}"
+
+
+def _parse_city_stats_index_key(key: str) -> tuple[str, dict[str, str]]:
+    """Return city name and stats encoded in city stats index key, in S3 metadata representation."""
+    *_, city_name, encoded_stats = key.split("/")
+    if encoded_stats.startswith(("v2_", "v3_")):
+        sums, *sketches = encoded_stats[3:].split("~")
+        bus_count, passenger_count, accident_count, total_delay_s = sums.split("_")
+        metadata = Stats.create_stats_from_sums(
+            bus_count=int(bus_count),
+            passenger_count=int(passenger_count),
+            accident_count=int(accident_count),
+            total_delay_s=float(total_delay_s),
+        ).create_s3_metadata_from_stats()
+        if sketches:
+            metadata["delay-sketch"], metadata["bus-type-sketch"] = sketches
+        return city_name, metadata
+    # Index entries written before sums were stored.
+    bus_count, passenger_count, exist_accident, average_delay_s = encoded_stats.split(
+        "_"
+    )
+    return city_name, {
+        "bus-count": bus_count,
+        "passenger-count": passenger_count,
+        "exist-accident": exist_accident,
+        "average-delay-s": average_delay_s,
+    }
+
+
+async def _delete_city_stats_index(
+    city: City, date: datetime.date, s3_client: S3Client
+) -> None:
+    # Index entries of older data of the city would otherwise be mistaken for stats of the new data.
+    index_keys = [
+        index_object["Key"]
+        async for index_object in _list_objects(
+            city.country, f"{CITY_STATS_INDEX_PREFIX}/{date}/{city.name}/", s3_client
+        )
+    ]
+    await asyncio.gather(
+        *(
+            s3_client.delete_object(Bucket=city.country, Key=index_key)
+            for index_key in index_keys
+        )
+    )
+
+
+async def _list_objects(
+    bucket: str, prefix: str, s3_client: S3Client
+) -> AsyncIterator[ObjectTypeDef]:
+    """List all objects with prefix, following pagination."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(
+        Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": S3_LIST_PAGE_SIZE}
+    ):
+        for s3_object in page.get("Contents", []):
+            yield s3_object
+
+
+class _MultipartUpload:
+    """Multipart upload whose parts are uploaded in background while next part is being received."""
+
+    def __init__(
+        self,
+        s3_client: S3Client,
+        upload_slot: AsyncContextManager,
+        bucket: str,
+        key: str,
+        upload_id: str,
+    ):
+        self.s3_client = s3_client
+        self.upload_slot = upload_slot
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = upload_id
+        self.completed = False
+        self._part_tasks: list[asyncio.Task] = []
+
+    @classmethod
+    async def create(
+        cls,
+        s3_client: S3Client,
+        upload_slot: AsyncContextManager,
+        bucket: str,
+        key: str,
+    ) -> "_MultipartUpload":
+        response = await s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        return cls(s3_client, upload_slot, bucket, key, response["UploadId"])
+
+    async def upload_part(self, data: bytes) -> None:
+        # Keep at most one part in flight to bound memory.
+        if self._part_tasks:
+            await self._part_tasks[-1]
+        self._part_tasks.append(
+            asyncio.create_task(self._upload_part(len(self._part_tasks) + 1, data))
+        )
+
+    async def _upload_part(
+        self, part_number: int, data: bytes
+    ) -> UploadPartOutputTypeDef:
+        async with self.upload_slot:
+            return await self.s3_client.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+
+    async def complete(self) -> None:
+        uploaded_parts = await asyncio.gather(*self._part_tasks)
+        await self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": uploaded_part["ETag"], "PartNumber": part_number}
+                    for part_number, uploaded_part in enumerate(uploaded_parts, 1)
+                ]
+            },
+        )
+        self.completed = True
+
+    async def clean_up(self) -> None:
+        """Remove staging data. Abort upload if it was not completed."""
+        await asyncio.gather(*self._part_tasks, return_exceptions=True)
+        if self.completed:
+            await self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+        else:
+            await self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+
+async def create_aggregated_stats_for_country_and_date(
+    country: str, date: str, s3_client: S3Client, storage_state: StorageState
+) -> Stats:
+    """Collect stats of files in country bucket with specific date and return combined stats."""
+    stats, _ = await _create_aggregated_stats_with_generation(
+        country, date, s3_client, storage_state
+    )
+    return stats
+
+
+async def _create_aggregated_stats_with_generation(
+    country: str,
+    date: str,
+    s3_client: S3Client,
+    storage_state: StorageState,
+    generation: int | None = None,
+) -> tuple[Stats, int | None]:
+    """Return combined stats and generation of data they were computed from. None if data was changing."""
+    if generation is None:
+        generation = (await _get_latest_generations(country, date, s3_client)).get(
+            date, 0
+        )
+    city_names, indexed_stats = await asyncio.gather(
+        _list_city_names(country, date, s3_client),
+        _list_indexed_city_stats(country, date, s3_client),
+    )
+    not_indexed_city_names = [
+        city_name for city_name in city_names if city_name not in indexed_stats
+    ]
+    metadata_responses = await storage_state.aggregation_fan_out.map(
+        lambda city_name: s3_client.head_object(
+            Bucket=country, Key=f"{date}/{city_name}"
+        ),
+        not_indexed_city_names,
+    )
+    aggregated_stats = _combine_s3_metadata(
+        itertools.chain(
+            (
+                indexed_stats[city_name]
+                for city_name in city_names
+                if city_name in indexed_stats
+            ),
+            (response["Metadata"] for response in metadata_responses),
+        )
+    )
 
+    if await get_generation(country, date, s3_client) != (generation, 0):
+        return aggregated_stats, None
+    await _put_aggregated_stats(country, date, aggregated_stats, generation, s3_client)
+    return aggregated_stats, generation
+
+
+def _combine_s3_metadata(multiple_metadata: Iterable[dict[str, str]]) -> Stats:
+    """Combine stats in S3 metadata representation. Sketches are merged without decoding each of them."""
+    batch = StatsBatch()
+    for metadata in multiple_metadata:
+        batch.append_s3_metadata(metadata)
+    # No data on this day in any city of this country gives zero stats.
+    return batch.combine().stats(0) if len(batch) else combine_stats([])
+
+
+async def _put_aggregated_stats(
+    country: str,
+    date: datetime.date | str,
+    stats: Stats,
+    generation: int,
+    s3_client: S3Client,
+) -> None:
     await s3_client.put_object(
         Bucket=country,
         Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}",
         Body=b"Aggregated stats file. Details in metadata",
-        Metadata=aggregated_stats.create_s3_metadata_from_stats(),
+        Metadata={
+            **stats.create_s3_metadata_from_stats(),
+            "generation": str(generation),
+        },
         ContentType="application/json",
     )
-    return aggregated_stats
 
 
-async def get_aggregated_stats_for_country_and_date(
-    country: str, date: str, s3_client: S3Client
-) -> Stats:
-    """Get existing stats or create new ones if there are no existing ones."""
-    aggregated_file_key = f"{date}/{AGGREGATED_STATS_FILE_NAME}"
+async def _update_aggregated_stats(
+    country: str,
+    date: datetime.date,
+    aggregated_stats: Stats,
+    generation: int,
+    replaced_stats: list[Stats],
+    new_stats: list[Stats],
+    s3_client: S3Client,
+) -> None:
+    """Replace contribution of replaced stats by new stats in aggregated stats and store them as generation."""
+    removed_stats = combine_stats(replaced_stats)
+    updated_stats = combine_stats(
+        [subtract_stats(aggregated_stats, removed_stats), *new_stats]
+    )
+    if removed_stats.bus_count:
+        indexed_stats = _combine_s3_metadata(
+            (await _list_indexed_city_stats(country, str(date), s3_client)).values()
+        )
+        if indexed_stats.bus_count != updated_stats.bus_count:
+            return  # Some cities are not indexed. Aggregated stats will be recreated when needed.
+        updated_stats = dataclasses.replace(
+            updated_stats, bus_type_sketch=indexed_stats.bus_type_sketch
+        )
+    await _put_aggregated_stats(country, date, updated_stats, generation, s3_client)
+
+
+@dataclasses.dataclass
+class DataChange:
+    """Stats replaced and pushed inside data_change of countries with incrementally updated aggregated stats."""
+
+    aggregated_stats: dict[str, Stats] = dataclasses.field(default_factory=dict)
+    replaced_stats: dict[str, list[Stats]] = dataclasses.field(default_factory=dict)
+    new_stats: dict[str, list[Stats]] = dataclasses.field(default_factory=dict)
+
+    def record(self, country: str, replaced_stats: Stats, new_stats: Stats) -> None:
+        self.replaced_stats.setdefault(country, []).append(replaced_stats)
+        self.new_stats.setdefault(country, []).append(new_stats)
+
+    def discard(self, country: str) -> None:
+        """Push failed after it may have changed some data, so aggregated stats must be recreated."""
+        self.aggregated_stats.pop(country, None)
+
+
+async def _read_aggregated_stats_of_generation(
+    country: str, date: datetime.date, generation: int, s3_client: S3Client
+) -> Stats | None:
     try:
-        metadata_of_aggregated_stats_file = (
-            await s3_client.head_object(Bucket=country, Key=aggregated_file_key)
+        metadata = (
+            await s3_client.head_object(
+                Bucket=country, Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}"
+            )
         )["Metadata"]
-        return Stats.create_stats_from_s3_metadata(metadata_of_aggregated_stats_file)
-    except ClientError:
-        return await create_aggregated_stats_for_country_and_date(
+    except ClientError as client_error:
+        if client_error.response.get("Error", {}).get("Code") != "404":
+            raise client_error
+        return None
+    if metadata.get("generation") != str(generation):
+        return None
+    return Stats.create_stats_from_s3_metadata(metadata)
+
+
+@contextlib.asynccontextmanager
+async def data_change(
+    countries: Iterable[str],
+    date: datetime.date,
+    s3_client: S3Client,
+    storage_state: StorageState,
+) -> AsyncIterator[DataChange]:
+    """Enclose pushes of many cities of countries on date by one pair of generations per country."""
+    countries = list(countries)
+    intents = await asyncio.gather(
+        *(_create_next_generation(country, date, s3_client) for country in countries),
+        return_exceptions=True,
+    )
+    intent_generations = {
+        country: intent[0]
+        for country, intent in zip(countries, intents)
+        if not isinstance(intent, BaseException)
+    }
+    change = DataChange()
+    try:
+        for intent in intents:
+            if isinstance(intent, BaseException):
+                raise intent
+        updatable = [
+            country
+            for country, intent in zip(countries, intents)
+            if not isinstance(intent, BaseException) and intent[1] == 1
+        ]
+        for country, stats in zip(
+            updatable,
+            await asyncio.gather(
+                *(
+                    _read_aggregated_stats_of_generation(
+                        country, date, intent_generations[country] - 1, s3_client
+                    )
+                    for country in updatable
+                )
+            ),
+        ):
+            if stats is not None:
+                change.aggregated_stats[country] = stats
+        yield change
+    finally:
+        try:
+            done_generations = dict(
+                zip(
+                    intent_generations,
+                    await asyncio.gather(
+                        *(
+                            _create_next_generation(
+                                country,
+                                date,
+                                s3_client,
+                                finished_intent=intent_generation,
+                            )
+                            for country, intent_generation in intent_generations.items()
+                        )
+                    ),
+                )
+            )
+        finally:
+            # Also after failed pushes, which may have changed some data.
+            for country in countries:
+                storage_state.aggregated_stats_cache.invalidate(country, str(date))
+                storage_state.aggregation_single_flight.forget((country, str(date)))
+    await asyncio.gather(
+        *(
+            _update_aggregated_stats(
+                country,
+                date,
+                aggregated_stats,
+                done_generations[country][0],
+                change.replaced_stats.get(country, []),
+                change.new_stats.get(country, []),
+                s3_client,
+            )
+            for country, aggregated_stats in change.aggregated_stats.items()
+            if done_generations[country][0] == intent_generations[country] + 1
+        )
+    )
+
+
+def _generation_key(date: datetime.date | str, generation: int) -> str:
+    return f"{AGGREGATED_STATS_GENERATIONS_PREFIX}/{date}/{generation:012d}"
+
+
+async def get_generation(
+    country: str, date: datetime.date | str, s3_client: S3Client
+) -> tuple[int, int]:
+    """Return latest generation of data of country and date and number of data changes in progress."""
+    generation, intents, _ = await _get_latest_generation(country, date, s3_client)
+    return generation, len(_unexpired_intents(intents))
+
+
+async def _get_latest_generation(
+    country: str, date: datetime.date | str, s3_client: S3Client
+) -> tuple[int, dict[int, float], list[ObjectTypeDef]]:
+    """Return latest generation, start times of data changes in progress by intent generation and listed generations."""
+    while True:
+        generation_objects = [
+            generation_object
+            async for generation_object in _list_objects(
+                country, f"{AGGREGATED_STATS_GENERATIONS_PREFIX}/{date}/", s3_client
+            )
+        ]
+        if not generation_objects:
+            return 0, {}, []
+        latest_generation_key = max(
+            generation_object["Key"] for generation_object in generation_objects
+        )
+        try:
+            response = await s3_client.get_object(
+                Bucket=country, Key=latest_generation_key
+            )
+        except ClientError as client_error:
+            if client_error.response.get("Error", {}).get("Code") != "NoSuchKey":
+                raise client_error
+            continue  # Deleted by pruning after listing. Newer generation exists.
+        intents = json.loads(await response["Body"].read())["intents"]
+        return (
+            int(latest_generation_key.rsplit("/", 1)[1]),
+            {
+                int(intent_generation): started_s
+                for intent_generation, started_s in intents.items()
+            },
+            generation_objects,
+        )
+
+
+def _unexpired_intents(intents: dict[int, float]) -> dict[int, float]:
+    """Intents of data changes started within lease. Older ones belong to pushes that died without finishing."""
+    leased_since = (
+        datetime.datetime.now(datetime.UTC).timestamp()
+        - AGGREGATED_STATS_DATA_CHANGE_LEASE_S
+    )
+    return {
+        intent_generation: started_s
+        for intent_generation, started_s in intents.items()
+        if started_s >= leased_since
+    }
+
+
+async def _create_next_generation(
+    country: str,
+    date: datetime.date,
+    s3_client: S3Client,
+    finished_intent: int | None = None,
+) -> tuple[int, int]:
+    """Create generation following the latest one. Returns created generation and number of data changes in progress."""
+    while True:
+        generation, intents, generation_objects = await _get_latest_generation(
             country, date, s3_client
         )
+        intents = _unexpired_intents(intents)
+        generation += 1
+        if finished_intent is None:
+            intents[generation] = datetime.datetime.now(datetime.UTC).timestamp()
+        else:
+            intents.pop(finished_intent, None)
+        try:
+            await s3_client.put_object(
+                Bucket=country,
+                Key=_generation_key(date, generation),
+                Body=json.dumps({"intents": intents}).encode("utf-8"),
+                ContentType="application/json",
+                IfNoneMatch="*",
+            )
+        except ClientError as client_error:
+            if (
+                client_error.response.get("Error", {}).get("Code")
+                != "PreconditionFailed"
+            ):
+                raise client_error
+            continue  # Concurrent data change created this generation.
+        if finished_intent is not None:
+            await _prune_generations(country, generation_objects, s3_client)
+        return generation, len(intents)
+
+
+async def _prune_generations(
+    country: str, generation_objects: list[ObjectTypeDef], s3_client: S3Client
+) -> None:
+    """Delete listed generation objects older than retention."""
+    retained_since = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+        seconds=AGGREGATED_STATS_GENERATION_RETENTION_S
+    )
+    await asyncio.gather(
+        *(
+            s3_client.delete_object(Bucket=country, Key=generation_object["Key"])
+            for generation_object in generation_objects
+            if generation_object["LastModified"] < retained_since
+        )
+    )
+
+
+async def _get_latest_generations(
+    country: str, date_prefix: str, s3_client: S3Client
+) -> dict[str, int]:
+    """Latest generation of each date starting with date prefix, from single listing. Dates without any are omitted."""
+    latest_generations: dict[str, int] = {}
+    async for generation_object in _list_objects(
+        country, f"{AGGREGATED_STATS_GENERATIONS_PREFIX}/{date_prefix}", s3_client
+    ):
+        _, date, generation = generation_object["Key"].rsplit("/", 2)
+        latest_generations[date] = max(latest_generations.get(date, 0), int(generation))
+    return latest_generations
+
+
+async def _list_city_names(country: str, date: str, s3_client: S3Client) -> list[str]:
+    return [
+        city_name
+        async for data_file in _list_objects(country, f"{date}/", s3_client)
+        if (city_name := data_file["Key"].removeprefix(f"{date}/"))
+        != AGGREGATED_STATS_FILE_NAME
+    ]
+
+
+async def _list_city_objects(
+    country: str, date: str, s3_client: S3Client, with_columns: bool
+) -> dict[str, int | None]:
+    """Names of cities with data on date and sizes of their columnar copies. None if there is no up to date copy."""
+    data_modified = {
+        data_file["Key"].removeprefix(f"{date}/"): data_file["LastModified"]
+        async for data_file in _list_objects(country, f"{date}/", s3_client)
+    }
+    data_modified.pop(AGGREGATED_STATS_FILE_NAME, None)
+    city_objects: dict[str, int | None] = dict.fromkeys(data_modified)
+    if with_columns:
+        async for columns_file in _list_objects(
+            country, f"{CITY_COLUMNS_PREFIX}/{date}/", s3_client
+        ):
+            city_name = columns_file["Key"].removeprefix(
+                f"{CITY_COLUMNS_PREFIX}/{date}/"
+            )
+            if (
+                city_name in data_modified
+                and columns_file["LastModified"] >= data_modified[city_name]
+            ):
+                city_objects[city_name] = columns_file["Size"]
+    return city_objects
+
+
+async def _list_indexed_city_stats(
+    country: str, date: str, s3_client: S3Client
+) -> dict[str, dict[str, str]]:
+    """Stats of cities from city stats index in S3 metadata representation. The newest entry of a city wins."""
+    index_objects = [
+        index_object
+        async for index_object in _list_objects(
+            country, f"{CITY_STATS_INDEX_PREFIX}/{date}/", s3_client
+        )
+    ]
+    index_objects.sort(key=lambda index_object: index_object["LastModified"])
+    return dict(
+        _parse_city_stats_index_key(index_object["Key"])
+        for index_object in index_objects
+    )
+
+
+async def get_aggregated_stats_for_country_and_date(
+    country: str, date: str, s3_client: S3Client, storage_state: StorageState
+) -> Stats:
+    """Get cached or existing stats or create new ones if there are no existing ones."""
+    aggregated_stats_cache = storage_state.aggregated_stats_cache
+    if (cached_stats := aggregated_stats_cache.get(country, date)) is not None:
+        return cached_stats
+    fill_token = aggregated_stats_cache.fill_token()
+    stats, _ = await _get_aggregated_stats_with_generation(
+        country, date, s3_client, storage_state
+    )
+    aggregated_stats_cache.put(country, date, stats, fill_token)
+    return stats
+
+
+async def _get_aggregated_stats_with_generation(
+    country: str, date: str, s3_client: S3Client, storage_state: StorageState
+) -> tuple[Stats, int | None]:
+    """Get existing or create new stats. Returns also their generation, None if they can't be stored."""
+    return await storage_state.aggregation_single_flight.run(
+        (country, date),
+        lambda: _read_or_create_aggregated_stats(
+            country, date, s3_client, storage_state
+        ),
+        storage_state.aggregation_fan_out.slot_released,
+    )
+
+
+async def _read_or_create_aggregated_stats(
+    country: str, date: str, s3_client: S3Client, storage_state: StorageState
+) -> tuple[Stats, int | None]:
+    """Read stored stats if they are of the latest generation, otherwise create them."""
+
+    async def read_metadata() -> dict[str, str]:
+        try:
+            return (
+                await s3_client.head_object(
+                    Bucket=country, Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}"
+                )
+            )["Metadata"]
+        except ClientError:
+            return {}
+
+    latest_generations, metadata = await asyncio.gather(
+        _get_latest_generations(country, date, s3_client), read_metadata()
+    )
+    generation = latest_generations.get(date, 0)
+    if metadata.get("generation") == str(generation):
+        return Stats.create_stats_from_s3_metadata(metadata), generation
+    # Aggregated stats don't exist or data changed after they were created.
+    return await _create_aggregated_stats_with_generation(
+        country, date, s3_client, storage_state, generation
+    )
+
+
+async def get_aggregated_stats_for_country_and_dates(
+    country: str, dates: list[str], s3_client: S3Client, storage_state: StorageState
+) -> dict[str, Stats]:
+    """Get aggregated stats of many dates of one country."""
+    dates_with_data = await _get_dates_with_data(
+        country, dates, s3_client, storage_state
+    )
+    stats_by_date = {}
+    missing_dates = []
+    for date in dates:
+        if date not in dates_with_data:
+            stats_by_date[date] = combine_stats([])
+        elif (
+            cached_stats := storage_state.aggregated_stats_cache.get(country, date)
+        ) is not None:
+            stats_by_date[date] = cached_stats
+        else:
+            missing_dates.append(datetime.date.fromisoformat(date))
+
+    dates_by_rollup = rollup_keys_for_dates(
+        missing_dates, STATS_ROLLUP_YEARLY_MIN_MONTHS
+    )
+    for rollup_stats in await storage_state.aggregation_fan_out.map(
+        lambda rollup: _get_aggregated_stats_through_rollup(
+            country,
+            rollup[0],
+            [str(date) for date in rollup[1]],
+            s3_client,
+            storage_state,
+        ),
+        list(dates_by_rollup.items()),
+    ):
+        stats_by_date.update(rollup_stats)
+    return stats_by_date
+
+
+async def iter_aggregated_stats_for_countries_and_dates(
+    countries: list[str],
+    dates: list[str],
+    s3_client: S3Client,
+    storage_state: StorageState,
+    max_pending_chunks: int = COUNTRY_STATS_STREAM_MAX_PENDING_CHUNKS,
+) -> AsyncIterator[tuple[str, dict[str, Stats]]]:
+    """Yield aggregated stats of countries and dates chunk by chunk as soon as each chunk is read."""
+    date_chunks = [
+        [str(date) for date in chunk_dates]
+        for chunk_dates in rollup_keys_for_dates(
+            (datetime.date.fromisoformat(date) for date in dates),
+            STATS_ROLLUP_YEARLY_MIN_MONTHS,
+        ).values()
+    ]
+    chunks = ((country, chunk) for country in countries for chunk in date_chunks)
+
+    async def get_chunk(country: str, chunk: list[str]) -> tuple[str, dict[str, Stats]]:
+        return country, await get_aggregated_stats_for_country_and_dates(
+            country, chunk, s3_client, storage_state
+        )
+
+    pending: set[asyncio.Task[tuple[str, dict[str, Stats]]]] = set()
+    try:
+        while True:
+            pending.update(
+                asyncio.create_task(get_chunk(country, chunk))
+                for country, chunk in itertools.islice(
+                    chunks, max_pending_chunks - len(pending)
+                )
+            )
+            if not pending:
+                return
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def publish_aggregated_stats_for_date(
+    countries: Iterable[str],
+    date: datetime.date | str,
+    s3_client: S3Client,
+    storage_state: StorageState,
+) -> None:
+    """Create aggregated stats of countries on date, add them to monthly rollups and cache them in process."""
+    await get_country_registry(s3_client, storage_state)
+    await storage_state.aggregation_fan_out.map(
+        lambda country: _get_aggregated_stats_through_rollup(
+            country, monthly_rollup_key(date), [str(date)], s3_client, storage_state
+        ),
+        list(countries),
+    )
+
+
+async def _get_aggregated_stats_through_rollup(
+    country: str,
+    rollup_key: str,
+    dates: list[str],
+    s3_client: S3Client,
+    storage_state: StorageState,
+) -> dict[str, Stats]:
+    """Get stats of dates from rollup. Dates missing in rollup or with outdated stats are added to it."""
+    aggregated_stats_cache = storage_state.aggregated_stats_cache
+    fill_token = aggregated_stats_cache.fill_token()
+    rollup_days, migrated = await _get_rollup(country, rollup_key, s3_client)
+    latest_generations = await _get_latest_generations(
+        country, rollup_period(rollup_key), s3_client
+    )
+    stats_by_date = {}
+    for date in dates:
+        if date in rollup_days and rollup_days.generation(
+            date
+        ) == latest_generations.get(date, 0):
+            stats, _ = rollup_days[date]
+            stats_by_date[date] = stats
+            aggregated_stats_cache.put(country, date, stats, fill_token)
+
+    missing_dates = [date for date in dates if date not in stats_by_date]
+    missing_stats = await storage_state.aggregation_fan_out.map(
+        lambda date: _get_aggregated_stats_with_generation(
+            country, date, s3_client, storage_state
+        ),
+        missing_dates,
+    )
+    rollup_changed = migrated
+    for date, (stats, generation) in zip(missing_dates, missing_stats):
+        stats_by_date[date] = stats
+        aggregated_stats_cache.put(country, date, stats, fill_token)
+        if generation is not None:
+            rollup_days[date] = (stats, generation)
+            rollup_changed = True
+    if rollup_changed:
+        # Concurrent readers may overwrite each other's additions. Those dates are just added again later.
+        await s3_client.put_object(
+            Bucket=country,
+            Key=rollup_key,
+            Body=encode_rollup(rollup_days),
+            ContentType="application/json",
+        )
+    return stats_by_date
+
+
+async def _get_rollup(
+    country: str, rollup_key: str, s3_client: S3Client
+) -> tuple[RollupDays, bool]:
+    try:
+        response = await s3_client.get_object(Bucket=country, Key=rollup_key)
+    except ClientError as client_error:
+        if client_error.response.get("Error", {}).get("Code") != "NoSuchKey":
+            raise client_error
+        return RollupDays(), False
+    return decode_rollup(await response["Body"].read())
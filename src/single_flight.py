@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+R = TypeVar("R")
+
+
+class SingleFlight(Generic[K, R]):
+    """Deduplicates concurrent calls with the same key. Only the first caller runs the work, others await its result.
+
+    Work runs in the first caller's task. If that caller is cancelled, one of the waiting callers runs the work again.
+    Errors of the work are raised to all callers. Calls are not cached after they finish.
+    """
+
+    def __init__(self) -> None:
+        self.started = 0
+        self.joined = 0
+        self._calls: dict[K, asyncio.Future[R]] = {}
+
+    async def run(
+        self,
+        key: K,
+        work: Callable[[], Awaitable[R]],
+        while_waiting: Callable[
+            [], contextlib.AbstractAsyncContextManager[Any]
+        ] = contextlib.nullcontext,
+    ) -> R:
+        """Run work or await result of concurrent call with the same key. Waiting is wrapped in while_waiting."""
+        while (call := self._calls.get(key)) is not None:
+            self.joined += 1
+            try:
+                async with while_waiting():
+                    return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                current_task = asyncio.current_task()
+                if current_task is not None and current_task.cancelling():
+                    raise
+                # Only the running call was cancelled. Try again.
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        self.started += 1
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as error:
+            call.set_exception(error)
+            # Mark exception as retrieved, there may be no other callers.
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def forget(self, key: K) -> None:
+        """Let later calls with the key run the work again, even if current call is still running."""
+        self._calls.pop(key, None)
+
+    def counters(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "joined": self.joined,
+        }
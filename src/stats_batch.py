@@ -0,0 +1,184 @@
+"""Struct-of-arrays batch of many stats labelled by country, date and city.
+
+Counts and sums of each record are kept in typed arrays and its sketches stay in their encoded form, so a record takes
+a few tens of bytes instead of a Stats object with decoded sketches. Batch is filled directly from S3 metadata (also
+rollup days, which use the same representation) and written back to it without decoding sketches. Sketches are
+decoded only when records with them are combined.
+"""
+
+import array
+import functools
+import operator
+from typing import Collection, Iterable, Literal, Sequence, TypeVar
+
+from city_details_proccesing import Stats, parse_sums_from_s3_metadata
+from stats_sketches import DelaySketch, DistinctSketch
+
+Axis = Literal["country", "date", "city"]
+Labels = tuple[str, str, str]
+
+_Sketch = TypeVar("_Sketch", DelaySketch, DistinctSketch)
+
+
+def _gather(column: Sequence, rows: list[int]) -> Sequence:
+    """Values of rows of column. Slice of consecutive rows avoids copying values one by one in Python."""
+    if rows[-1] - rows[0] + 1 == len(rows):
+        return column[rows[0] : rows[-1] + 1]
+    return operator.itemgetter(*rows)(column)
+
+
+def _merge_encoded_sketches(
+    sketch_type: type[_Sketch],
+    encoded_sketches: Iterable[str | None],
+    bus_counts: Iterable[int],
+) -> str | None:
+    """Merge sketches the same way as combine_stats does. None if any record with some buses has no sketch."""
+    merged = sketch_type()
+    for encoded_sketch, bus_count in zip(encoded_sketches, bus_counts):
+        if encoded_sketch is not None:
+            merged.merge_encoded(encoded_sketch)
+        elif bus_count:
+            return None
+    return merged.encode()
+
+
+class StatsBatch:
+    """Many stats records, each labelled by country, date and city. Empty label means all values of the axis."""
+
+    def __init__(self) -> None:
+        self.countries: list[str] = []
+        self.dates: list[str] = []
+        self.cities: list[str] = []
+        self.bus_counts = array.array("q")
+        self.passenger_counts = array.array("q")
+        self.accident_counts = array.array("q")
+        self.total_delays_s = array.array("d")
+        self.delay_sketches: list[str | None] = []
+        self.bus_type_sketches: list[str | None] = []
+
+    def __len__(self) -> int:
+        return len(self.bus_counts)
+
+    def append(
+        self, stats: Stats, country: str = "", date: str = "", city: str = ""
+    ) -> None:
+        self._append_sums(
+            (
+                stats.bus_count,
+                stats.passenger_count,
+                stats.accident_count,
+                stats.total_delay_s,
+            ),
+            stats.delay_sketch.encode() if stats.delay_sketch is not None else None,
+            stats.bus_type_sketch.encode()
+            if stats.bus_type_sketch is not None
+            else None,
+            (country, date, city),
+        )
+
+    def append_s3_metadata(
+        self,
+        metadata: dict[str, str],
+        country: str = "",
+        date: str = "",
+        city: str = "",
+    ) -> None:
+        """Append stats stored in S3 metadata or rollup day. Sketches are kept encoded."""
+        self._append_sums(
+            parse_sums_from_s3_metadata(metadata),
+            metadata.get("delay-sketch"),
+            metadata.get("bus-type-sketch"),
+            (country, date, city),
+        )
+
+    def labels(self, index: int) -> Labels:
+        return self.countries[index], self.dates[index], self.cities[index]
+
+    def stats(self, index: int) -> Stats:
+        delay_sketch = self.delay_sketches[index]
+        bus_type_sketch = self.bus_type_sketches[index]
+        return Stats.create_stats_from_sums(
+            bus_count=self.bus_counts[index],
+            passenger_count=self.passenger_counts[index],
+            accident_count=self.accident_counts[index],
+            total_delay_s=self.total_delays_s[index],
+            delay_sketch=DelaySketch.decode(delay_sketch)
+            if delay_sketch is not None
+            else None,
+            bus_type_sketch=DistinctSketch.decode(bus_type_sketch)
+            if bus_type_sketch is not None
+            else None,
+        )
+
+    def s3_metadata(self, index: int) -> dict[str, str]:
+        """Stats of record in S3 metadata (and rollup day) representation. Sketches are copied without decoding."""
+        metadata = Stats.create_stats_from_sums(
+            bus_count=self.bus_counts[index],
+            passenger_count=self.passenger_counts[index],
+            accident_count=self.accident_counts[index],
+            total_delay_s=self.total_delays_s[index],
+        ).create_s3_metadata_from_stats()
+        if (delay_sketch := self.delay_sketches[index]) is not None:
+            metadata["delay-sketch"] = delay_sketch
+        if (bus_type_sketch := self.bus_type_sketches[index]) is not None:
+            metadata["bus-type-sketch"] = bus_type_sketch
+        return metadata
+
+    def combine(self, keep: Collection[Axis] = ()) -> "StatsBatch":
+        """Combine records with the same labels of kept axes to one record. Other axes get empty labels.
+
+        Records are combined exactly as by combine_stats: sums are added in record order and sketches are merged. Each
+        column is reduced by builtins over slices of consecutive records of a group.
+        """
+        no_labels = [""] * len(self)
+        groups: dict[Labels, list[int]] = {}
+        for index, group_labels in enumerate(
+            zip(
+                self.countries if "country" in keep else no_labels,
+                self.dates if "date" in keep else no_labels,
+                self.cities if "city" in keep else no_labels,
+            )
+        ):
+            groups.setdefault(group_labels, []).append(index)
+
+        combined = StatsBatch()
+        for group_labels, rows in groups.items():
+            bus_counts = _gather(self.bus_counts, rows)
+            combined._append_sums(
+                (
+                    sum(bus_counts),
+                    sum(_gather(self.passenger_counts, rows)),
+                    sum(_gather(self.accident_counts, rows)),
+                    # Sequential float addition, same as combine_stats. (Builtin sum of floats uses compensated
+                    # summation.)
+                    functools.reduce(
+                        operator.add, _gather(self.total_delays_s, rows), 0.0
+                    ),
+                ),
+                _merge_encoded_sketches(
+                    DelaySketch, _gather(self.delay_sketches, rows), bus_counts
+                ),
+                _merge_encoded_sketches(
+                    DistinctSketch, _gather(self.bus_type_sketches, rows), bus_counts
+                ),
+                group_labels,
+            )
+        return combined
+
+    def _append_sums(
+        self,
+        sums: tuple[int, int, int, float],
+        delay_sketch: str | None,
+        bus_type_sketch: str | None,
+        labels: Labels,
+    ) -> None:
+        bus_count, passenger_count, accident_count, total_delay_s = sums
+        self.bus_counts.append(bus_count)
+        self.passenger_counts.append(passenger_count)
+        self.accident_counts.append(accident_count)
+        self.total_delays_s.append(total_delay_s)
+        self.delay_sketches.append(delay_sketch)
+        self.bus_type_sketches.append(bus_type_sketch)
+        self.countries.append(labels[0])
+        self.dates.append(labels[1])
+        self.cities.append(labels[2])
@@ -0,0 +1,94 @@
+import collections
+import dataclasses
+import time
+from typing import Callable
+
+from city_details_proccesing import Stats
+
+CacheKey = tuple[str, str]
+
+
+@dataclasses.dataclass
+class _Entry:
+    stats: Stats | None
+    expires_at: float
+    # Value of invalidation counter when the key was last invalidated.
+    invalidated_at: int
+
+
+class StatsCache:
+    """In-process LRU cache of aggregated stats per country and date with time to live.
+
+    Invalidation is precise even for concurrent computations: stats computed from data read before invalidation are
+    not cached. Callers take fill_token before reading the data and pass it to put.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_s: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: collections.OrderedDict[CacheKey, _Entry] = (
+            collections.OrderedDict()
+        )
+        self._invalidations = 0
+        # Latest invalidation of keys that were evicted. Their own invalidation is no longer known.
+        self._evicted_invalidated_at = 0
+
+    def get(self, country: str, date: str) -> Stats | None:
+        entry = self._entries.get((country, date))
+        if entry is None or entry.stats is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= self.clock():
+            entry.stats = None
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end((country, date))
+        self.hits += 1
+        return entry.stats
+
+    def fill_token(self) -> int:
+        return self._invalidations
+
+    def put(self, country: str, date: str, stats: Stats, fill_token: int) -> None:
+        """Cache stats unless the key was invalidated after fill_token was taken."""
+        entry = self._entries.get((country, date))
+        invalidated_at = entry.invalidated_at if entry else self._evicted_invalidated_at
+        if invalidated_at > fill_token:
+            return
+        self._set(
+            (country, date), _Entry(stats, self.clock() + self.ttl_s, invalidated_at)
+        )
+
+    def invalidate(self, country: str, date: str) -> None:
+        self._invalidations += 1
+        self._set((country, date), _Entry(None, 0, self._invalidations))
+
+    def counters(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _set(self, key: CacheKey, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, evicted_entry = self._entries.popitem(last=False)
+            self._evicted_invalidated_at = max(
+                self._evicted_invalidated_at, evicted_entry.invalidated_at
+            )
+            self.evictions += 1
@@ -0,0 +1,56 @@
+import asyncio
+import concurrent.futures
+import sys
+from typing import Any, Callable, Literal, TypeVar
+
+ExecutorKind = Literal["process", "thread", "inline"]
+T = TypeVar("T")
+
+
+def default_executor_kind() -> ExecutorKind:
+    """Threads run CPU bound code in parallel only on free-threaded builds. Otherwise, processes have to be used."""
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    return "process" if gil_enabled else "thread"
+
+
+class StatsExecutor:
+    """Runs CPU bound stats computation off the event loop.
+
+    Number of submitted and not yet finished jobs is bounded. Callers wait in run until there is free slot, which
+    propagates backpressure to the stage that produces data for the jobs.
+    """
+
+    def __init__(self, kind: ExecutorKind, max_workers: int, max_pending: int):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pending_slots = asyncio.Semaphore(max_pending)
+        self._executor: concurrent.futures.Executor | None = None
+
+    def start(self) -> None:
+        if self.kind == "process":
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+        elif self.kind == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        if self._executor is None:
+            # Inline execution blocks the loop by itself, no need to bound it.
+            return function(*args)
+        async with self._pending_slots:
+            self.pending += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, function, *args
+                )
+            finally:
+                self.pending -= 1
+
+
+inline_stats_executor = StatsExecutor("inline", max_workers=1, max_pending=1)
@@ -0,0 +1,143 @@
+"""Rollup objects holding aggregated stats of many days of one country in single S3 object."""
+
+import datetime
+import json
+from typing import Callable, Iterable, Iterator, Mapping
+
+from city_details_proccesing import Stats
+from stats_batch import StatsBatch
+
+ROLLUPS_PREFIX = "rollups"
+ROLLUP_FORMAT_VERSION = 3
+
+
+class RollupDays(Mapping[str, tuple[Stats, int]]):
+    """Stats of each date with data generation they were computed from, held in StatsBatch."""
+
+    def __init__(self) -> None:
+        self._batch = StatsBatch()
+        self._rows: dict[str, tuple[int, int]] = {}
+
+    def __getitem__(self, date: str) -> tuple[Stats, int]:
+        row, generation = self._rows[date]
+        return self._batch.stats(row), generation
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __setitem__(self, date: str, day: tuple[Stats, int]) -> None:
+        stats, generation = day
+        self._rows[date] = (len(self._batch), generation)
+        self._batch.append(stats, date=date)
+
+    def set_s3_metadata(
+        self, date: str, metadata: dict[str, str], generation: int
+    ) -> None:
+        self._rows[date] = (len(self._batch), generation)
+        self._batch.append_s3_metadata(metadata, date=date)
+
+    def s3_metadata(self, date: str) -> dict[str, str]:
+        return self._batch.s3_metadata(self._rows[date][0])
+
+    def generation(self, date: str) -> int:
+        return self._rows[date][1]
+
+
+def _add_sums_to_rollup(rollup: dict) -> dict:
+    """Version 1 rollups were written before stats kept sums. Sums are approximated from averages."""
+    return {
+        "version": 2,
+        "days": {
+            date: Stats.create_stats_from_s3_metadata(
+                metadata
+            ).create_s3_metadata_from_stats()
+            for date, metadata in rollup["days"].items()
+        },
+    }
+
+
+def _drop_days_without_generation(rollup: dict) -> dict:
+    """Version 2 rollups have no generations to validate their days, so the days are recomputed."""
+    return {"version": 3, "days": {}}
+
+
+# Migration from version N to N+1 is stored under key N.
+_rollup_migrations: dict[int, Callable[[dict], dict]] = {
+    1: _add_sums_to_rollup,
+    2: _drop_days_without_generation,
+}
+
+
+def monthly_rollup_key(date: datetime.date | str) -> str:
+    """Key of monthly rollup containing date. Date can be also given in ISO format."""
+    return f"{ROLLUPS_PREFIX}/{str(date)[:7]}"
+
+
+def yearly_rollup_key(date: datetime.date | str) -> str:
+    """Key of yearly rollup containing date. Date can be also given in ISO format."""
+    return f"{ROLLUPS_PREFIX}/{str(date)[:4]}"
+
+
+def rollup_period(rollup_key: str) -> str:
+    """Common prefix of ISO format dates in rollup. For example "2024-02" for monthly rollup."""
+    return rollup_key.removeprefix(f"{ROLLUPS_PREFIX}/")
+
+
+def rollup_keys_for_dates(
+    dates: Iterable[datetime.date], yearly_rollup_min_months: int | None
+) -> dict[str, list[datetime.date]]:
+    """Group dates by rollup objects that should be read to get their stats."""
+    dates_by_month: dict[str, list[datetime.date]] = {}
+    for date in dates:
+        dates_by_month.setdefault(monthly_rollup_key(date), []).append(date)
+    if yearly_rollup_min_months is None:
+        return dates_by_month
+
+    months_by_year: dict[str, list[str]] = {}
+    for month_key in dates_by_month:
+        months_by_year.setdefault(
+            yearly_rollup_key(dates_by_month[month_key][0]), []
+        ).append(month_key)
+    dates_by_rollup: dict[str, list[datetime.date]] = {}
+    for year_key, month_keys in months_by_year.items():
+        if len(month_keys) >= yearly_rollup_min_months:
+            dates_by_rollup[year_key] = [
+                date for month_key in month_keys for date in dates_by_month[month_key]
+            ]
+        else:
+            for month_key in month_keys:
+                dates_by_rollup[month_key] = dates_by_month[month_key]
+    return dates_by_rollup
+
+
+def encode_rollup(rollup_days: RollupDays) -> bytes:
+    return json.dumps(
+        {
+            "version": ROLLUP_FORMAT_VERSION,
+            "days": {
+                date: {
+                    **rollup_days.s3_metadata(date),
+                    "generation": rollup_days.generation(date),
+                }
+                for date in sorted(rollup_days)
+            },
+        }
+    ).encode("utf-8")
+
+
+def decode_rollup(body: bytes) -> tuple[RollupDays, bool]:
+    """Decode rollup of any known version. Returns stats by date and whether the rollup was migrated."""
+    rollup = json.loads(body)
+    version = rollup["version"]
+    if version > ROLLUP_FORMAT_VERSION:
+        raise ValueError(f"Unsupported rollup format version {version}.")
+    migrated = version < ROLLUP_FORMAT_VERSION
+    while rollup["version"] < ROLLUP_FORMAT_VERSION:
+        rollup = _rollup_migrations[rollup["version"]](rollup)
+    rollup_days = RollupDays()
+    for date, day in rollup["days"].items():
+        rollup_days.set_s3_metadata(date, day, day["generation"])
+    return rollup_days, migrated
@@ -0,0 +1,231 @@
+"""Mergeable sketches of city data stored with stats: delay quantiles and number of distinct bus types.
+
+DelaySketch is log-bucketed histogram (DDSketch). Each quantile is within DELAY_SKETCH_RELATIVE_ACCURACY of the exact
+value, as long as sketch has at most DELAY_SKETCH_MAX_BUCKETS buckets. Above that, the lowest buckets are collapsed,
+which keeps upper quantiles accurate. Counts of buckets can be added and subtracted.
+
+DistinctSketch is HyperLogLog. Small cardinalities, like number of bus types, are estimated almost exactly by linear
+counting. Registers can be merged, but not subtracted.
+
+Both are encoded to short URL safe base64 strings, so they fit to S3 metadata and city stats index keys.
+"""
+
+import base64
+import collections
+import dataclasses
+import functools
+import hashlib
+import math
+from typing import Iterable
+
+DELAY_SKETCH_RELATIVE_ACCURACY = 0.02
+DELAY_SKETCH_MAX_BUCKETS = 128
+DISTINCT_SKETCH_PRECISION = 8
+
+_gamma = (1 + DELAY_SKETCH_RELATIVE_ACCURACY) / (1 - DELAY_SKETCH_RELATIVE_ACCURACY)
+_log_gamma = math.log(_gamma)
+_register_count = 2**DISTINCT_SKETCH_PRECISION
+_sparse_encoding = 0
+_dense_encoding = 1
+
+
+def _encode_varint(value: int, output: bytearray) -> None:
+    while value >= 0x80:
+        output.append(value & 0x7F | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def _decode_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _to_base64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _from_base64(encoded: str) -> bytes:
+    return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+
+
+@dataclasses.dataclass
+class DelaySketch:
+    """Counts of delays in logarithmic buckets. Delays not larger than zero are counted separately."""
+
+    zero_count: int = 0
+    buckets: dict[int, int] = dataclasses.field(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def add_counts(self, delay_counts: dict[float, int]) -> None:
+        """Add delays given as counts of each delay value."""
+        for delay_s, count in delay_counts.items():
+            if delay_s <= 0:
+                self.zero_count += count
+            else:
+                index = math.ceil(math.log(delay_s) / _log_gamma)
+                self.buckets[index] = self.buckets.get(index, 0) + count
+        self._collapse()
+
+    def add(self, delays_s: Iterable[float]) -> None:
+        self.add_counts(collections.Counter(delays_s))
+
+    def merge(self, other: "DelaySketch") -> None:
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self._collapse()
+
+    def subtract(self, other: "DelaySketch") -> None:
+        """Remove delays of other sketch that were merged to this one."""
+        self.zero_count -= other.zero_count
+        for index, count in other.buckets.items():
+            if (remaining := self.buckets.get(index, 0) - count) > 0:
+                self.buckets[index] = remaining
+            else:
+                self.buckets.pop(index, None)
+
+    def quantile(self, quantile: float) -> float:
+        """Approximate nearest-rank delay at quantile from 0 to 1. Zero for empty sketch."""
+        rank = max(1, math.ceil(quantile * self.count))
+        seen = self.zero_count
+        if rank <= seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank <= seen:
+                return 2 * _gamma**index / (_gamma + 1)
+        return 0
+
+    def _collapse(self) -> None:
+        if len(self.buckets) <= DELAY_SKETCH_MAX_BUCKETS:
+            return
+        indexes = sorted(self.buckets)
+        collapsed = indexes[: len(indexes) - DELAY_SKETCH_MAX_BUCKETS + 1]
+        self.buckets[collapsed[-1]] = sum(self.buckets.pop(i) for i in collapsed)
+
+    def encode(self) -> str:
+        output = bytearray()
+        _encode_varint(self.zero_count, output)
+        _encode_varint(len(self.buckets), output)
+        previous_index = 0
+        for index in sorted(self.buckets):
+            _encode_varint(_zigzag(index - previous_index), output)
+            _encode_varint(self.buckets[index], output)
+            previous_index = index
+        return _to_base64(bytes(output))
+
+    def merge_encoded(self, encoded: str) -> None:
+        """Merge encoded sketch without decoding it to another sketch first."""
+        data = _from_base64(encoded)
+        zero_count, position = _decode_varint(data, 0)
+        bucket_count, position = _decode_varint(data, position)
+        self.zero_count += zero_count
+        buckets = self.buckets
+        index = 0
+        for _ in range(bucket_count):
+            # Varints are mostly single byte, so they are decoded inline.
+            if (index_delta := data[position]) < 0x80:
+                position += 1
+            else:
+                index_delta, position = _decode_varint(data, position)
+            index += (index_delta >> 1) ^ -(index_delta & 1)
+            if (count := data[position]) < 0x80:
+                position += 1
+            else:
+                count, position = _decode_varint(data, position)
+            buckets[index] = buckets.get(index, 0) + count
+        self._collapse()
+
+    @classmethod
+    def decode(cls, encoded: str) -> "DelaySketch":
+        sketch = cls()
+        sketch.merge_encoded(encoded)
+        return sketch
+
+
+@functools.lru_cache(maxsize=4096)
+def _register_and_rank(value: str) -> tuple[int, int]:
+    """Register of value and position of the first set bit in the rest of its 64-bit hash.
+
+    Hash must be the same in all processes, so builtin hash can't be used. Ref server uses few distinct bus types,
+    so hashes are cached.
+    """
+    hash_ = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest())
+    rest_bits = 64 - DISTINCT_SKETCH_PRECISION
+    rest = hash_ & ((1 << rest_bits) - 1)
+    return hash_ >> rest_bits, rest_bits - rest.bit_length() + 1
+
+
+@dataclasses.dataclass
+class DistinctSketch:
+    """HyperLogLog registers holding the highest rank seen in each register."""
+
+    registers: bytearray = dataclasses.field(
+        default_factory=lambda: bytearray(_register_count)
+    )
+
+    def add(self, values: Iterable[str]) -> None:
+        for value in set(values):
+            register, rank = _register_and_rank(value)
+            if rank > self.registers[register]:
+                self.registers[register] = rank
+
+    def merge(self, other: "DistinctSketch") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        zero_registers = self.registers.count(0)
+        if zero_registers == _register_count:
+            return 0
+        alpha = 0.7213 / (1 + 1.079 / _register_count)
+        estimate = (
+            alpha
+            * _register_count**2
+            / sum(2.0**-register for register in self.registers)
+        )
+        if estimate <= 2.5 * _register_count and zero_registers:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = _register_count * math.log(_register_count / zero_registers)
+        return round(estimate)
+
+    def encode(self) -> str:
+        set_registers = [
+            (register, rank) for register, rank in enumerate(self.registers) if rank
+        ]
+        if 2 * len(set_registers) < _register_count:
+            sparse = bytearray([_sparse_encoding])
+            for register, rank in set_registers:
+                sparse += bytes((register, rank))
+            return _to_base64(bytes(sparse))
+        return _to_base64(bytes([_dense_encoding]) + self.registers)
+
+    def merge_encoded(self, encoded: str) -> None:
+        """Merge encoded sketch without decoding it to another sketch first. Sparse one updates only its registers."""
+        data = _from_base64(encoded)
+        if data[0] == _dense_encoding:
+            self.registers = bytearray(map(max, self.registers, data[1:]))
+            return
+        registers = self.registers
+        for position in range(1, len(data), 2):
+            if (rank := data[position + 1]) > registers[data[position]]:
+                registers[data[position]] = rank
+
+    @classmethod
+    def decode(cls, encoded: str) -> "DistinctSketch":
+        sketch = cls()
+        sketch.merge_encoded(encoded)
+        return sketch
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 from multiprocessing import Process
@@ -6,10 +7,12 @@ from typing import Any, cast
 import aiohttp
 import pytest
 from aiohttp import web
+from litestar.testing import AsyncTestClient
 
 from city_details_proccesing import City
 from configuration import REFERENCE_SERVER_ADDRESS, REFERENCE_SERVER_PORT
 from mocked_moto import mock_boto
+from s3_communication import StorageState
 
 EXAMPLE_CITY_1 = "City1"
 EXAMPLE_ID_1 = 1
@@ -134,3 +137,22 @@ def run_dummy_ref_server():
 def run_dummy_moto():
     with mock_boto():
         yield
+
+
+@pytest.fixture(scope="function")
+def storage_state() -> StorageState:
+    """In-process state of S3 communication of freshly started app, so tests don't share caches."""
+    return StorageState()
+
+
+async def wait_for_job(
+    client: AsyncTestClient, job_id: str, timeout_s: float = 30
+) -> dict[str, Any]:
+    """Poll ingestion job status until the job is done and return its final status."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        job_status = (await client.get(f"/jobs/{job_id}")).json()
+        if job_status["status"] not in ("queued", "running"):
+            return job_status
+        assert time.monotonic() < deadline, f"Job {job_id} did not finish in time."
+        await asyncio.sleep(0.05)
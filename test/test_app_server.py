@@ -10,13 +10,20 @@ from conftest import (
     EXAMPLE_ID_3,
     generate_example_cities,
     generate_example_city_data,
+    wait_for_job,
 )
 from litestar.testing import AsyncTestClient
 
 from app_server import app
 from city_details_proccesing import combine_stats, create_city_stats_from_city_data
 from ref_server_communication import get_cities
-from s3_communication import get_s3_client
+from s3_communication import (
+    create_bucket,
+    get_s3_client,
+    iter_raw_city_stats_from_s3,
+    push_city_stats_to_s3,
+)
+from stats_rollups import decode_rollup, monthly_rollup_key
 
 
 @pytest.mark.asyncio
@@ -29,22 +36,117 @@ async def test_get_cities(run_dummy_ref_server):
 
 
 @pytest.mark.asyncio
-async def test_process_request(run_dummy_ref_server, run_dummy_moto):
+async def test_process_request(run_dummy_ref_server, run_dummy_moto, storage_state):
     """Tests that data is correctly transferred from ref server to S3."""
     some_date = str(datetime.date(2024, 2, 1))
     expected_cities = generate_example_cities()
     expected_stats = generate_example_city_data(some_date)
     async with AsyncTestClient(app=app) as client:
-        await client.post(f"/process-request?date={some_date}")
+        response = await client.post(f"/process-request?date={some_date}")
+        job_status = await wait_for_job(client, response.json()["id"])
 
+    assert response.status_code == 202
+    assert job_status["status"] == "finished"
+    assert job_status["cities_total"] == job_status["cities_succeeded"] == 3
+    assert job_status["bytes_transferred"] == sum(
+        len(json.dumps(city_data).encode("utf-8"))
+        for city_data in expected_stats.values()
+    )
     async with get_s3_client() as s3_client:
         for city_id in expected_cities:
-            resp = await s3_client.get_object(
-                Bucket=expected_cities[city_id].country,
-                Key=f"{some_date}/{expected_cities[city_id].name}",
+            raw_stats_in_s3 = b"".join(
+                [
+                    chunk
+                    async for chunk in iter_raw_city_stats_from_s3(
+                        expected_cities[city_id], some_date, s3_client, storage_state
+                    )
+                ]
+            )
+            assert json.loads(raw_stats_in_s3) == expected_stats[city_id]
+        # Both cities of the country are pushed in one data change.
+        generations = await s3_client.list_objects_v2(
+            Bucket=expected_cities[EXAMPLE_ID_1].country,
+            Prefix=f"generations/{some_date}/",
+        )
+    assert generations["KeyCount"] == 2
+
+
+@pytest.mark.asyncio
+async def test_process_request_publishes_aggregated_stats(
+    run_dummy_ref_server, run_dummy_moto
+):
+    """Finished ingestion leaves cached aggregated stats and rollup day of the date of each country behind."""
+    some_date = str(datetime.date(2021, 8, 1))
+    example_cities = generate_example_cities()
+    city_data = generate_example_city_data(some_date)
+    async with AsyncTestClient(app=app) as client:
+        response = await client.post(f"/process-request?date={some_date}")
+        job_status = await wait_for_job(client, response.json()["id"])
+        aggregated_stats_cache = app.state.storage_state.aggregated_stats_cache
+
+    assert job_status["status"] == "finished"
+    for country in set(city.country for city in example_cities.values()):
+        expected_stats = combine_stats(
+            create_city_stats_from_city_data(city_data[city_id])
+            for city_id, city in example_cities.items()
+            if city.country == country
+        )
+        assert aggregated_stats_cache.get(country, some_date) == expected_stats
+        async with get_s3_client() as s3_client:
+            rollup = await s3_client.get_object(
+                Bucket=country, Key=monthly_rollup_key(some_date)
             )
-            stats_in_s3 = json.loads(await resp["Body"].content.read())
-            assert stats_in_s3 == expected_stats[city_id]
+            rollup_days, _ = decode_rollup(await rollup["Body"].read())
+        assert rollup_days[some_date][0] == expected_stats
+
+
+@pytest.mark.asyncio
+async def test_process_range(run_dummy_ref_server, run_dummy_moto):
+    """Backfill of selected country transfers all dates with one data change per country and date."""
+    start_date = str(datetime.date(2021, 6, 1))
+    end_date = str(datetime.date(2021, 6, 3))
+    example_cities = generate_example_cities()
+    country = example_cities[EXAMPLE_ID_1].country
+    async with AsyncTestClient(app=app) as client:
+        response = await client.post(
+            f"/process-range?from={start_date}&to={end_date}&country=Country1"
+        )
+        backfill_status = await wait_for_job(client, response.json()["id"])
+        job_statuses = [
+            (await client.get(f"/jobs/{job['id']}")).json()
+            for job in backfill_status["jobs"]
+        ]
+        stats_response = await client.get(
+            f"/country-stats?from={start_date}&to{end_date}"
+        )
+
+    assert response.status_code == 202
+    assert backfill_status["status"] == "finished"
+    assert backfill_status["countries"] == [country]
+    assert backfill_status["dates_finished"] == 3
+    assert backfill_status["completed_through"] == end_date
+    assert [job_status["date"] for job_status in job_statuses] == [
+        "2021-06-01",
+        "2021-06-02",
+        "2021-06-03",
+    ]
+    assert all(job_status["cities_succeeded"] == 2 for job_status in job_statuses)
+    expected_stats = combine_stats(
+        [
+            create_city_stats_from_city_data(city_data)
+            for city_id, city_data in generate_example_city_data(start_date).items()
+            if city_id != EXAMPLE_ID_3
+        ]
+    )
+    assert (
+        json.loads(stats_response.content)[country][start_date]["passenger_count"]
+        == expected_stats.passenger_count
+    )
+    async with get_s3_client() as s3_client:
+        generations = await s3_client.list_objects_v2(
+            Bucket=country, Prefix=f"generations/{start_date}/"
+        )
+    assert generations["KeyCount"] == 2
 
 
 @pytest.mark.asyncio
@@ -81,18 +183,31 @@ async def test_get_country_stats(run_dummy_ref_server, run_dummy_moto):
         "passenger_count": combined_stats_1_2.passenger_count,
         "exist_accident": combined_stats_1_2.exist_accident,
         "average_delay_s": combined_stats_1_2.average_delay_s,
+        "accident_count": combined_stats_1_2.accident_count,
+        "total_delay_s": combined_stats_1_2.total_delay_s,
+        # Delays 100, 200, 300, 400 within 2 %.
+        "delay_percentiles_s": {"50": 200, "95": 396, "99": 396},
+        "distinct_bus_types": 4,
     }
     date_stats_3 = {
         "bus_count": stats_3.bus_count,
         "passenger_count": stats_3.passenger_count,
         "exist_accident": stats_3.exist_accident,
         "average_delay_s": stats_3.average_delay_s,
+        "accident_count": stats_3.accident_count,
+        "total_delay_s": stats_3.total_delay_s,
+        "delay_percentiles_s": {"50": 503, "95": 590, "99": 590},
+        "distinct_bus_types": 2,
     }
     empty_stats = {
         "bus_count": 0,
         "passenger_count": 0,
         "exist_accident": False,
         "average_delay_s": 0,
+        "accident_count": 0,
+        "total_delay_s": 0,
+        "delay_percentiles_s": {"50": 0, "95": 0, "99": 0},
+        "distinct_bus_types": 0,
     }
 
     expected_result = {
@@ -116,9 +231,108 @@ async def test_get_country_stats(run_dummy_ref_server, run_dummy_moto):
             client.post(f"/process-request?date={end_date}"),
             client.post(f"/process-request?date={after_date}"),
         ]
-        await asyncio.gather(*post_requests_tasks)
+        for post_response in await asyncio.gather(*post_requests_tasks):
+            await wait_for_job(client, post_response.json()["id"])
 
         response = await client.get(f"/country-stats?from={start_date}&to{end_date}")
 
     # Assert
     assert json.loads(response.content) == expected_result
+
+
+@pytest.mark.asyncio
+async def test_stream_country_stats(run_dummy_moto, storage_state):
+    """Streamed NDJSON lines contain the same stats as /country-stats. Range spans two monthly rollups."""
+    start_date = str(datetime.date(2023, 3, 30))
+    end_date = str(datetime.date(2023, 4, 2))
+    example_cities = generate_example_cities()
+    async with get_s3_client() as s3_client:
+        for city_id, date in (
+            (EXAMPLE_ID_1, "2023-03-31"),
+            (EXAMPLE_ID_3, "2023-04-01"),
+        ):
+            await create_bucket(
+                s3_client, example_cities[city_id].country, storage_state
+            )
+            await push_city_stats_to_s3(
+                example_cities[city_id],
+                date,
+                json.dumps(generate_example_city_data(date)[city_id]).encode("utf-8"),
+                s3_client,
+                storage_state,
+            )
+
+    async with AsyncTestClient(app=app) as client:
+        response = await client.get(f"/country-stats?from={start_date}&to{end_date}")
+        stream_response = await client.get(
+            f"/country-stats/stream?from={start_date}&to{end_date}"
+        )
+
+    assert stream_response.headers["content-type"] == "application/x-ndjson"
+    streamed_result = {}
+    for line in stream_response.content.splitlines():
+        item = json.loads(line)
+        assert item["date"] not in streamed_result.setdefault(item["country"], {})
+        streamed_result[item["country"]][item["date"]] = item["stats"]
+    assert streamed_result == json.loads(response.content)
+    assert (
+        streamed_result[example_cities[EXAMPLE_ID_3].country]["2023-04-01"]["bus_count"]
+        == 2
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_city_analytics(run_dummy_moto, storage_state):
+    """Buses of selected country are grouped by departure hour with stats and delay percentiles."""
+    some_date = str(datetime.date(2021, 7, 1))
+    example_cities = generate_example_cities()
+    async with get_s3_client() as s3_client:
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2, EXAMPLE_ID_3):
+            await create_bucket(
+                s3_client, example_cities[city_id].country, storage_state
+            )
+            await push_city_stats_to_s3(
+                example_cities[city_id],
+                some_date,
+                json.dumps(generate_example_city_data(some_date)[city_id]).encode(
+                    "utf-8"
+                ),
+                s3_client,
+                storage_state,
+            )
+
+    async with AsyncTestClient(app=app) as client:
+        response = await client.get(
+            f"/city-analytics?from={some_date}&to={some_date}&group_by=hour&country=Country1"
+        )
+        invalid_response = await client.get(
+            f"/city-analytics?from={some_date}&to={some_date}&group_by=weekday"
+        )
+
+    assert response.json() == {
+        example_cities[EXAMPLE_ID_1].country: {
+            "04": {
+                "bus_count": 2,
+                "passenger_count": 60,
+                "accident_count": 1,
+                "average_delay_s": 300,
+                "delay_percentiles_s": {"50": 200, "90": 400, "99": 400},
+            },
+            "05": {
+                "bus_count": 2,
+                "passenger_count": 40,
+                "accident_count": 0,
+                "average_delay_s": 200,
+                "delay_percentiles_s": {"50": 100, "90": 300, "99": 300},
+            },
+        }
+    }
+    assert invalid_response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_missing_job_status():
+    async with AsyncTestClient(app=app) as client:
+        response = await client.get("/jobs/missing")
+
+    assert response.status_code == 404
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from bounded_fan_out import BoundedFanOut
+
+
+class ConcurrencyTracker:
+    def __init__(self) -> None:
+        self.running = 0
+        self.max_running = 0
+
+    async def leaf(self, item: int) -> int:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.001)
+        self.running -= 1
+        return item * 2
+
+
+@pytest.mark.asyncio
+async def test_nested_fan_out_respects_global_limit():
+    """Outer items give up their slots while waiting for nested items, so limit 2 neither deadlocks nor is exceeded."""
+    fan_out = BoundedFanOut(max_in_flight=2)
+    tracker = ConcurrencyTracker()
+
+    async def outer(item: int) -> list[int]:
+        return await fan_out.map(tracker.leaf, range(item * 10, item * 10 + 10))
+
+    results = await fan_out.map(outer, range(10))
+
+    assert results == [
+        [value * 2 for value in range(item * 10, item * 10 + 10)] for item in range(10)
+    ]
+    assert tracker.max_running == 2
+    assert fan_out.counters() == {
+        "queued": 0,
+        "in_flight": 0,
+        "max_in_flight": 2,
+        "completed": 110,
+        "cancelled": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_cancelled_fan_out_releases_slots():
+    fan_out = BoundedFanOut(max_in_flight=3)
+    started = asyncio.Event()
+
+    async def blocked(item: int) -> None:
+        started.set()
+        await asyncio.Event().wait()
+
+    task = asyncio.create_task(fan_out.map(blocked, range(100)))
+    await started.wait()
+    assert fan_out.counters()["in_flight"] == 3
+    assert fan_out.counters()["queued"] == 97
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert fan_out.counters()["queued"] == 0
+    assert fan_out.counters()["in_flight"] == 0
+    assert fan_out.counters()["cancelled"] == 100
+    # Slots are free again.
+    assert await fan_out.map(ConcurrencyTracker().leaf, [1, 2]) == [2, 4]
+
+
+@pytest.mark.asyncio
+async def test_failed_item_cancels_other_items():
+    fan_out = BoundedFanOut(max_in_flight=2)
+
+    async def failing(item: int) -> None:
+        if item == 1:
+            raise ValueError("Failed item")
+        await asyncio.Event().wait()
+
+    with pytest.raises(ValueError):
+        await fan_out.map(failing, range(10))
+
+    assert fan_out.counters()["in_flight"] == 0
+    assert fan_out.counters()["queued"] == 0
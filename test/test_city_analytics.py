@@ -0,0 +1,34 @@
+from conftest import EXAMPLE_ID_1, EXAMPLE_ID_2, generate_example_city_data
+
+from city_analytics import CityAnalyticsAccumulator, GroupAggregate, merge_groups
+
+
+def test_partial_aggregates_are_merged():
+    """Groups of many scanned objects are merged and their totals match stats of the scanned data."""
+    city_data = generate_example_city_data("2024-02-01")
+    accumulators = []
+    for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+        accumulator = CityAnalyticsAccumulator("date", f"city{city_id}", "2024-02-01")
+        accumulator.add(city_data[city_id][:1])
+        accumulator.add(city_data[city_id][1:])
+        accumulators.append(accumulator)
+
+    groups = merge_groups(accumulator.groups for accumulator in accumulators)
+
+    assert list(groups) == ["2024-02-01"]
+    assert groups["2024-02-01"].bus_count == sum(
+        accumulator.create_stats().bus_count for accumulator in accumulators
+    )
+    assert groups["2024-02-01"].to_result()["delay_percentiles_s"] == {
+        "50": 200,
+        "90": 400,
+        "99": 400,
+    }
+
+
+def test_empty_group_percentiles():
+    assert GroupAggregate().to_result()["delay_percentiles_s"] == {
+        "50": 0,
+        "90": 0,
+        "99": 0,
+    }
@@ -0,0 +1,85 @@
+import pytest
+
+from city_catalogue import CityCatalogue
+from city_details_proccesing import City
+from ref_server_communication import CitiesResponse
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeRefServer:
+    """Fetch of cities that answers conditional requests by ETag."""
+
+    def __init__(self, cities: list[dict]) -> None:
+        self.cities = cities
+        self.etag = '"1"'
+        self.requests: list[tuple[str | None, str | None]] = []
+
+    async def __call__(self, session, etag, last_modified):
+        self.requests.append((etag, last_modified))
+        if etag == self.etag:
+            return None
+        return CitiesResponse(list(self.cities), self.etag, None)
+
+
+@pytest.mark.asyncio
+async def test_catalogue_is_persisted_and_refreshed_conditionally(tmp_path):
+    path = str(tmp_path / "catalogue" / "cities.json")
+    clock = FakeClock()
+    ref_server = FakeRefServer(
+        [{"id": 1, "name": "Some City", "country": "Some Country"}]
+    )
+    expected_cities = {City("Some City", "Some Country", 1)}
+
+    catalogue = CityCatalogue(path, ttl_s=60, fetch=ref_server, clock=clock)
+    assert await catalogue.get_cities(None) == expected_cities
+
+    # Restarted app within TTL does not ask ref server.
+    catalogue = CityCatalogue(path, ttl_s=60, fetch=ref_server, clock=clock)
+    assert await catalogue.get_cities(None) == expected_cities
+    assert ref_server.requests == [(None, None)]
+
+    # After TTL, unchanged cities are not sent again.
+    clock.now += 60
+    assert await catalogue.get_cities(None) == expected_cities
+    assert ref_server.requests == [(None, None), ('"1"', None)]
+    assert catalogue.counters() == {"cities": 1, "fetches": 1, "not_modified": 1}
+
+
+@pytest.mark.asyncio
+async def test_renamed_city_keeps_its_slugs(tmp_path):
+    path = str(tmp_path / "cities.json")
+    clock = FakeClock()
+    ref_server = FakeRefServer(
+        [
+            {"id": 1, "name": "Old Name", "country": "Some Country"},
+            {"id": 2, "name": "Other City", "country": "Some Country"},
+        ]
+    )
+    catalogue = CityCatalogue(path, ttl_s=60, fetch=ref_server, clock=clock)
+    await catalogue.get_cities(None)
+
+    ref_server.cities = [
+        {"id": 1, "name": "New Name", "country": "Renamed Country"},
+        {"id": 3, "name": "New City", "country": "Some Country"},
+    ]
+    ref_server.etag = '"2"'
+    clock.now += 60
+    expected_cities = {
+        City("Old Name", "Some Country", 1),
+        City("New City", "Some Country", 3),
+    }
+    assert await catalogue.get_cities(None) == expected_cities
+    # Slugs of renamed city survive restart.
+    assert (
+        await CityCatalogue(path, ttl_s=60, fetch=ref_server, clock=clock).get_cities(
+            None
+        )
+        == expected_cities
+    )
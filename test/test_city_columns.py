@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from conftest import EXAMPLE_ID_1, EXAMPLE_ID_2, generate_example_city_data
+
+from city_columns import CityColumnsWriter, encode_city_columns, read_city_columns
+from city_details_proccesing import CityStatsParser
+
+CITY_DATA = (
+    generate_example_city_data("2024-01-01")[EXAMPLE_ID_1]
+    + generate_example_city_data("2024-01-02")[EXAMPLE_ID_2]
+) * 3
+
+
+async def read_columns(body: bytes, *args, **kwargs):
+    reads = []
+
+    async def read_range(start: int, end: int) -> bytes:
+        reads.append((start, end))
+        return body[start:end]
+
+    return await read_city_columns(read_range, len(body), *args, **kwargs), reads
+
+
+@pytest.mark.asyncio
+async def test_city_columns_round_trip():
+    body = encode_city_columns(CITY_DATA, row_group_size=4)
+    columns, _ = await read_columns(body, ["bus-type", "passengers", "accident"])
+    assert columns == {
+        "bus-type": [bus_details["bus-type"] for bus_details in CITY_DATA],
+        "passengers": [bus_details["passengers"] for bus_details in CITY_DATA],
+        "accident": [bus_details["accident"] for bus_details in CITY_DATA],
+    }
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 100))
+def test_city_columns_written_by_chunked_parser(chunk_size: int):
+    raw_city_data = json.dumps(CITY_DATA).encode("utf-8")
+    parser = CityStatsParser(CityColumnsWriter(row_group_size=4))
+    assert parser.columns_writer is not None
+    body = b""
+    for start in range(0, len(raw_city_data), chunk_size):
+        parser.feed(raw_city_data[start : start + chunk_size])
+        body += parser.columns_writer.take_encoded()
+    parser.finish()
+    body += parser.columns_writer.finish()
+    assert body == encode_city_columns(CITY_DATA, row_group_size=4)
+
+
+@pytest.mark.asyncio
+async def test_city_columns_row_group_skipping():
+    """Only row groups whose min/max can match filters are read, only requested columns are read."""
+    city_data = sorted(CITY_DATA, key=lambda bus_details: bus_details["passengers"])
+    body = encode_city_columns(city_data, row_group_size=2)
+    passenger_range = (city_data[2]["passengers"], city_data[3]["passengers"])
+    columns, reads = await read_columns(
+        body, ["bus-type"], {"passengers": passenger_range}
+    )
+
+    assert columns == {
+        "bus-type": [
+            bus_details["bus-type"]
+            for bus_details in city_data
+            if passenger_range[0] <= bus_details["passengers"] <= passenger_range[1]
+        ]
+    }
+    # Footer and two columns of matching row groups.
+    matching_row_groups = {
+        index // 2
+        for index, bus_details in enumerate(city_data)
+        if passenger_range[0] <= bus_details["passengers"] <= passenger_range[1]
+    }
+    assert len(reads) == 1 + 2 * len(matching_row_groups)
+
+
+@pytest.mark.asyncio
+async def test_city_columns_invalid_object():
+    with pytest.raises(ValueError):
+        await read_columns(b"not columns", ["passengers"])
@@ -1,12 +1,19 @@
+import json
 from typing import Any, Iterable
 
+import isodate  # type:ignore[import-untyped] # Stub files not published
 import pytest
 from conftest import EXAMPLE_ID_1, EXAMPLE_ID_2, generate_example_city_data
 
 from city_details_proccesing import (
+    CityStatsAccumulator,
+    CityStatsParser,
     Stats,
     combine_stats,
     create_city_stats_from_city_data,
+    create_city_stats_from_raw_city_data,
+    parse_delay_s,
+    subtract_stats,
 )
 
 
@@ -20,6 +27,8 @@ from city_details_proccesing import (
                 passenger_count=30,
                 exist_accident=True,
                 average_delay_s=150,
+                accident_count=1,
+                total_delay_s=300,
             ),
         ),
         (
@@ -29,6 +38,8 @@ from city_details_proccesing import (
                 passenger_count=70,
                 exist_accident=False,
                 average_delay_s=350,
+                accident_count=0,
+                total_delay_s=700,
             ),
         ),
     ),
@@ -52,6 +63,8 @@ def test_create_city_stats_for_day(
                 passenger_count=210,
                 exist_accident=True,
                 average_delay_s=350,
+                accident_count=1,
+                total_delay_s=2100,
             ),
         ),
         (
@@ -66,6 +79,8 @@ def test_create_city_stats_for_day(
                 passenger_count=60,
                 exist_accident=True,
                 average_delay_s=150,
+                accident_count=2,
+                total_delay_s=600,
             ),
         ),
         (
@@ -80,6 +95,8 @@ def test_create_city_stats_for_day(
                 passenger_count=140,
                 exist_accident=False,
                 average_delay_s=350,
+                accident_count=0,
+                total_delay_s=1400,
             ),
         ),
     ),
@@ -102,5 +119,94 @@ def test_create_stats_from_s3_metadata(
         "average-delay-s": "20",
     }
     assert Stats.create_stats_from_s3_metadata(metadata) == Stats(
-        1, 10, exist_accident_bool_representation, 20
+        1,
+        10,
+        exist_accident_bool_representation,
+        20,
+        int(exist_accident_bool_representation),
+        20,
     )
+
+
+def test_s3_metadata_round_trip():
+    stats = Stats.create_stats_from_sums(
+        bus_count=3, passenger_count=30, accident_count=2, total_delay_s=100.5
+    )
+    assert (
+        Stats.create_stats_from_s3_metadata(stats.create_s3_metadata_from_stats())
+        == stats
+    )
+
+
+def test_combine_stats_without_rounding_drift():
+    """Combined average delay is computed from exact sums, not from rounded averages of parts."""
+    city_stats = [
+        Stats.create_stats_from_sums(
+            bus_count=2, passenger_count=0, accident_count=0, total_delay_s=1
+        )
+    ] * 3
+    assert combine_stats(city_stats).average_delay_s == round(3 / 6)
+    assert combine_stats(city_stats).total_delay_s == 3
+
+
+def test_subtract_stats():
+    stats_1, stats_2, stats_3 = (
+        create_city_stats_from_city_data(city_data)
+        for city_data in generate_example_city_data("irrelevant").values()
+    )
+    assert subtract_stats(combine_stats([stats_1, stats_2, stats_3]), stats_2) == (
+        combine_stats([stats_1, stats_3])
+    )
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 64, 1024 * 1024))
+def test_city_stats_parser_chunked(chunk_size: int):
+    """Stats computed from arbitrarily split raw data are the same as stats from fully parsed data."""
+    city_data = generate_example_city_data("irrelevant")[EXAMPLE_ID_1]
+    raw_city_data = json.dumps(city_data, indent=2).encode("utf-8")
+
+    parser = CityStatsParser()
+    for start in range(0, len(raw_city_data), chunk_size):
+        parser.feed(raw_city_data[start : start + chunk_size])
+
+    assert parser.finish() == create_city_stats_from_city_data(city_data)
+
+
+@pytest.mark.parametrize(
+    "raw_city_data",
+    (
+        b"",
+        b"{}",
+        b'[{"delay": "PT1S"',
+        b"[]]",
+        b'[{"delay": "PT1S", "passengers": 1, "accident": false} {}]',
+    ),
+)
+def test_city_stats_parser_invalid_data(raw_city_data: bytes):
+    with pytest.raises(ValueError):
+        create_city_stats_from_raw_city_data(raw_city_data)
+
+
+@pytest.mark.parametrize(
+    "delay",
+    ("PT300S", "PT5400S", "PT90M", "PT0S", "P0D", "PT1H30M", "PT1.5S", "P1DT1S"),
+)
+def test_parse_delay_s(delay: str):
+    """Fast path and fallback give exactly same results as isodate."""
+    assert parse_delay_s(delay) == isodate.parse_duration(delay).total_seconds()
+
+
+def test_city_stats_bit_identical_with_bus_by_bus_summation():
+    """Fractional delays are summed in the same order as bus by bus summation."""
+    city_data = [
+        {"delay": delay, "passengers": 1, "accident": False}
+        for delay in ("PT0.1S", "PT0.2S", "PT0.3S", "PT1000000.7S", "PT3M") * 7
+    ]
+    total_delay_s = 0.0
+    for bus_details in city_data:
+        total_delay_s += isodate.parse_duration(bus_details["delay"]).total_seconds()
+
+    accumulator = CityStatsAccumulator()
+    accumulator.add(city_data[:10])
+    accumulator.add(city_data[10:])
+    assert accumulator.total_delay_s == total_delay_s
@@ -0,0 +1,39 @@
+from country_registry import CountryRegistry
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_registry_expires_after_ttl():
+    clock = FakeClock()
+    registry = CountryRegistry(ttl_s=10, clock=clock)
+    assert registry.is_expired()
+
+    registry.update({"a": {"2024-02-01"}})
+    clock.now = 9
+    assert not registry.is_expired()
+    clock.now = 10
+    assert registry.is_expired()
+
+
+def test_refresh_keeps_local_additions():
+    """Data stored by this process while refresh was listing S3 is not lost by the refresh."""
+    registry = CountryRegistry(ttl_s=10)
+    registry.add_date("a", "2024-02-02")
+    registry.add_country("b")
+    registry.update({"a": {"2024-02-01"}, "c": set()})
+
+    assert registry.countries() == ["a", "b", "c"]
+    assert registry.dates_with_data(
+        "a", ["2024-02-01", "2024-02-02", "2024-02-03"]
+    ) == [
+        "2024-02-01",
+        "2024-02-02",
+    ]
+    assert registry.dates_with_data("b", ["2024-02-01"]) == []
+    assert registry.counters() == {"countries": 3, "dates": 2, "refreshes": 1}
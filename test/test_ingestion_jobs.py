@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+
+import pytest
+from conftest import EXAMPLE_ID_1, generate_example_cities
+
+from ingestion_jobs import BackfillJob, IngestionJob, IngestionJobManager
+from ingestion_scheduler import CityTransferResult
+
+
+async def iter_chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_duplicate_jobs_are_coalesced():
+    """Unfinished job for the same date is reused, other dates and finished dates get new jobs."""
+    release = asyncio.Event()
+    runs = []
+
+    async def run(job: IngestionJob) -> None:
+        runs.append(job.id)
+        await release.wait()
+
+    ingestion_jobs = IngestionJobManager(max_parallel_jobs=1, max_retained_jobs=10)
+    ingestion_jobs.start()
+    try:
+        some_date = datetime.date(2024, 2, 1)
+        first_job = ingestion_jobs.submit(some_date, run)
+        duplicate_job = ingestion_jobs.submit(some_date, run)
+        other_job = ingestion_jobs.submit(datetime.date(2024, 2, 2), run)
+        await asyncio.sleep(0.01)
+
+        assert duplicate_job is first_job
+        assert (first_job.status, other_job.status) == ("running", "queued")
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert (first_job.status, other_job.status) == ("finished", "finished")
+        assert ingestion_jobs.submit(some_date, run) is not first_job
+    finally:
+        await ingestion_jobs.shutdown()
+    assert runs == [first_job.id, other_job.id]
+
+
+@pytest.mark.asyncio
+async def test_backfill_reuses_unfinished_jobs():
+    """Backfill does not transfer dates with unfinished job again and single date requests join its dates."""
+    release = asyncio.Event()
+
+    async def run(job: IngestionJob) -> None:
+        await release.wait()
+
+    async def run_backfill(backfill: BackfillJob) -> None:
+        for job in backfill.jobs:
+            if backfill.owns(job):
+                job.start()
+                job.finish()
+            else:
+                await job.wait()
+
+    ingestion_jobs = IngestionJobManager(max_parallel_jobs=2, max_retained_jobs=10)
+    ingestion_jobs.start()
+    try:
+        dates = [datetime.date(2024, 2, day) for day in (1, 2, 3)]
+        running_job = ingestion_jobs.submit(dates[1], run)
+        backfill = ingestion_jobs.submit_backfill(dates, run_backfill)
+        assert ingestion_jobs.submit(dates[2], run) is backfill.jobs[2]
+        assert backfill.jobs[1] is running_job
+        assert not backfill.owns(running_job)
+        await asyncio.sleep(0.01)
+
+        assert backfill.status == "running"
+        assert backfill.completed_through == dates[0]
+        release.set()
+        await asyncio.sleep(0.01)
+        assert backfill.status == "finished"
+        assert backfill.completed_through == dates[2]
+        assert ingestion_jobs.get(backfill.id) is backfill
+        assert ingestion_jobs.submit(dates[2], run) is not backfill.jobs[2]
+    finally:
+        await ingestion_jobs.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_job_failure_is_reported():
+    async def run(job: IngestionJob) -> None:
+        raise ConnectionError("Ref server is down.")
+
+    ingestion_jobs = IngestionJobManager(max_parallel_jobs=1, max_retained_jobs=10)
+    ingestion_jobs.start()
+    try:
+        job = ingestion_jobs.submit(datetime.date(2024, 2, 1), run)
+        await asyncio.sleep(0.01)
+    finally:
+        await ingestion_jobs.shutdown()
+
+    assert job.to_status()["status"] == "failed"
+    assert job.to_status()["error"] == "ConnectionError('Ref server is down.')"
+
+
+@pytest.mark.asyncio
+async def test_job_tracks_city_progress():
+    """Bytes of last attempt are counted and final result of each city is recorded."""
+    city = generate_example_cities()[EXAMPLE_ID_1]
+    job = IngestionJob(id="some_id", date=datetime.date(2024, 2, 1))
+    job.start()
+    job.add_cities({city})
+
+    [_ async for _ in job.track_transfer(city, iter_chunks(b"12345"))]
+    [_ async for _ in job.track_transfer(city, iter_chunks(b"123", b"45678"))]
+    job.record_result(city, CityTransferResult(city.name, city.country, 2))
+    job.finish()
+
+    job_status = job.to_status()
+    assert job_status["bytes_transferred"] == 8
+    assert job_status["cities_succeeded"] == 1
+    assert job_status["cities"] == [
+        {
+            "city": city.name,
+            "country": city.country,
+            "status": "succeeded",
+            "attempts": 2,
+            "bytes_transferred": 8,
+            "error": None,
+        }
+    ]
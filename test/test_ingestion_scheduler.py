@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+from typing import AsyncIterator
+
+import aiohttp
+import pytest
+from botocore.exceptions import ClientError
+from conftest import EXAMPLE_ID_1, EXAMPLE_ID_2, EXAMPLE_ID_3, generate_example_cities
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from city_details_proccesing import City
+from ingestion_scheduler import CityTransferResult, IngestionScheduler
+
+
+def create_scheduler(fetch_concurrency: int = 10) -> IngestionScheduler:
+    return IngestionScheduler(
+        fetch_concurrency=fetch_concurrency,
+        upload_concurrency=10,
+        max_attempts=3,
+        backoff_base_s=0.001,
+        backoff_max_s=0.01,
+    )
+
+
+@pytest.mark.asyncio
+async def test_transfer_cities_reports_partial_failures():
+    """Transient errors are retried, permanent errors are reported and other cities still succeed."""
+    cities = generate_example_cities()
+    attempts: dict[int, int] = {city_id: 0 for city_id in cities}
+
+    async def transfer(city: City) -> None:
+        attempts[city.id] += 1
+        if city.id == EXAMPLE_ID_1 and attempts[city.id] < 3:
+            raise aiohttp.ClientConnectionError("Temporary failure")
+        if city.id == EXAMPLE_ID_2:
+            raise ValueError("Invalid input data!")
+
+    results = await create_scheduler().transfer_cities(cities.values(), transfer)
+
+    assert results == [
+        CityTransferResult(cities[EXAMPLE_ID_1].name, cities[EXAMPLE_ID_1].country, 3),
+        CityTransferResult(
+            cities[EXAMPLE_ID_2].name,
+            cities[EXAMPLE_ID_2].country,
+            1,
+            "ValueError('Invalid input data!')",
+        ),
+        CityTransferResult(cities[EXAMPLE_ID_3].name, cities[EXAMPLE_ID_3].country, 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_transfer_cities_gives_up_after_max_attempts():
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async def transfer(city: City) -> None:
+        raise ConnectionError("Down")
+
+    (result,) = await create_scheduler().transfer_cities([city], transfer)
+
+    assert result.attempts == 3
+    assert not result.succeeded
+
+
+@pytest.mark.asyncio
+async def test_transfer_cities_retries_only_transient_client_errors():
+    cities = generate_example_cities()
+    attempts: dict[int, int] = {city_id: 0 for city_id in cities}
+    errors = {
+        EXAMPLE_ID_1: ClientError(
+            {
+                "Error": {"Code": "SlowDown"},
+                "ResponseMetadata": {"HTTPStatusCode": 503},
+            },
+            "PutObject",
+        ),
+        EXAMPLE_ID_2: ClientError(
+            {
+                "Error": {"Code": "AccessDenied"},
+                "ResponseMetadata": {"HTTPStatusCode": 403},
+            },
+            "PutObject",
+        ),
+        EXAMPLE_ID_3: aiohttp.ClientResponseError(
+            aiohttp.RequestInfo(
+                URL("http://ref-server/cities/3/stats"),
+                "GET",
+                CIMultiDictProxy(CIMultiDict()),
+            ),
+            (),
+            status=404,
+        ),
+    }
+
+    async def transfer(city: City) -> None:
+        attempts[city.id] += 1
+        raise errors[city.id]
+
+    results = await create_scheduler().transfer_cities(cities.values(), transfer)
+
+    assert [result.attempts for result in results] == [3, 1, 1]
+    assert attempts == {EXAMPLE_ID_1: 3, EXAMPLE_ID_2: 1, EXAMPLE_ID_3: 1}
+
+
+@pytest.mark.asyncio
+async def test_fetch_limits_concurrency_only_while_receiving():
+    """Fetch slot is released when response is received, so slow uploads don't hold it."""
+    receiving = 0
+    max_receiving = 0
+    uploading = 0
+    max_uploading = 0
+    scheduler = create_scheduler(fetch_concurrency=3)
+
+    async def response_chunks() -> AsyncIterator[bytes]:
+        nonlocal receiving, max_receiving
+        receiving += 1
+        max_receiving = max(max_receiving, receiving)
+        await asyncio.sleep(0.01)
+        yield b"data"
+        receiving -= 1
+
+    async def transfer(city: City) -> None:
+        nonlocal uploading, max_uploading
+        async with contextlib.aclosing(scheduler.fetch(response_chunks())) as chunks:
+            async for _ in chunks:
+                pass
+        uploading += 1
+        max_uploading = max(max_uploading, uploading)
+        await asyncio.sleep(0.05)
+        uploading -= 1
+
+    cities = [City(f"City {index}", "Country", index) for index in range(20)]
+    await scheduler.transfer_cities(cities, transfer)
+
+    assert max_receiving == 3
+    assert max_uploading > 3
@@ -0,0 +1,83 @@
+import os
+import threading
+
+import pytest
+
+import object_disk_cache
+from object_disk_cache import ObjectDiskCache
+
+
+async def store(cache: ObjectDiskCache, key: str, etag: str, content: bytes) -> None:
+    writer = await cache.writer("bucket", key, etag, "identity")
+    await writer.write(content)
+    await writer.commit()
+
+
+async def read(cache: ObjectDiskCache, key: str, etag: str) -> bytes | None:
+    async with cache.read("bucket", key, etag) as cached:
+        return None if cached is None else bytes(cached[0])
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_objects_are_evicted_and_survive_restart(tmp_path):
+    cache = ObjectDiskCache(str(tmp_path), max_bytes=10)
+    await store(cache, "a", "etag-a", b"aaaa")
+    await store(cache, "b", "etag-b", b"bbbb")
+    assert await read(cache, "a", "etag-a") == b"aaaa"
+    await store(cache, "c", "etag-c", b"cccc")
+
+    assert await read(cache, "b", "etag-b") is None
+    assert cache.evictions == 1
+    assert await read(cache, "a", "etag-a") == b"aaaa"
+
+    # Order of last use is kept by restarted cache, so "c" is evicted first.
+    restarted_cache = ObjectDiskCache(str(tmp_path), max_bytes=4)
+    assert restarted_cache.etag("bucket", "c") is None
+    assert await read(restarted_cache, "a", "etag-a") == b"aaaa"
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.asyncio
+async def test_new_etag_replaces_copy_and_too_large_object_is_not_stored(tmp_path):
+    cache = ObjectDiskCache(str(tmp_path), max_bytes=10)
+    await store(cache, "a", "etag-1", b"old")
+    await store(cache, "a", "etag-2", b"new")
+    await store(cache, "b", "etag-1", b"b" * 11)
+
+    assert await read(cache, "a", "etag-1") is None
+    assert await read(cache, "a", "etag-2") == b"new"
+    assert cache.etag("bucket", "b") is None
+    assert cache.stored_bytes == 3
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.asyncio
+async def test_files_are_not_touched_on_event_loop(tmp_path, monkeypatch):
+    """Copies are written in buffered parts, read, replaced and evicted in threads."""
+    event_loop_thread = threading.get_ident()
+    file_calls_on_event_loop = []
+    for name in ("replace", "remove", "utime"):
+
+        def record(*args, _call=getattr(os, name), _name=name, **kwargs):
+            if threading.get_ident() == event_loop_thread:
+                file_calls_on_event_loop.append(_name)
+            return _call(*args, **kwargs)
+
+        monkeypatch.setattr(os, name, record)
+    monkeypatch.setattr(object_disk_cache, "WRITE_BUFFER_SIZE", 4)
+    cache = ObjectDiskCache(str(tmp_path), max_bytes=10)
+
+    writer = await cache.writer("bucket", "a", "etag-1", "identity")
+    for chunk in (b"aa", b"aa", b"aa"):
+        await writer.write(chunk)
+    await writer.commit()
+    await store(cache, "a", "etag-2", b"new")
+    await store(cache, "b", "etag-1", b"b" * 8)
+    aborted_writer = await cache.writer("bucket", "c", "etag-1", "identity")
+    await aborted_writer.write(b"c")
+    await aborted_writer.abort()
+
+    assert await read(cache, "b", "etag-1") == b"b" * 8
+    assert cache.evictions == 1
+    assert file_calls_on_event_loop == []
+    assert len(list(tmp_path.iterdir())) == 2
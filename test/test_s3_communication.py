@@ -1,6 +1,8 @@
 import asyncio
 import datetime
 import json
+import random
+from collections import Counter
 
 import pytest
 from botocore.exceptions import ClientError
@@ -9,28 +11,55 @@ from conftest import (
     EXAMPLE_COUNTRY_2,
     EXAMPLE_ID_1,
     EXAMPLE_ID_2,
+    EXAMPLE_ID_3,
     generate_example_cities,
     generate_example_city_data,
 )
 from slugify import slugify
 
+import s3_communication
 from city_details_proccesing import (
     City,
     Stats,
     combine_stats,
     create_city_stats_from_city_data,
+    parse_delay_s,
 )
-from configuration import AGGREGATED_STATS_FILE_NAME
+from configuration import (
+    AGGREGATED_STATS_FILE_NAME,
+    CITY_STATS_INDEX_PREFIX,
+    MULTIPART_UPLOAD_STAGING_PREFIX,
+)
+from content_encoding import CONTENT_ENCODINGS, check_content_encoding
+from country_registry import CountryRegistry
+from object_disk_cache import ObjectDiskCache
 from s3_communication import (
+    StorageState,
     create_aggregated_stats_for_country_and_date,
     create_bucket,
+    data_change,
+    get_aggregated_stats_for_country_and_date,
+    get_aggregated_stats_for_country_and_dates,
+    get_generation,
     get_s3_client,
+    iter_raw_city_stats_from_s3,
     push_city_stats_to_s3,
+    read_city_columns_from_s3,
+    scan_city_analytics,
+    stream_city_stats_to_s3,
 )
+from stats_cache import StatsCache
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+async def iter_chunks(data: bytes, chunk_size: int = 64 * 1024):
+    for start in range(0, len(data), chunk_size):
+        yield data[start : start + chunk_size]
 
 
 @pytest.mark.asyncio
-async def test_data_pushed_to_s3_with_stats(run_dummy_moto):
+async def test_data_pushed_to_s3_with_stats(run_dummy_moto, storage_state):
     """Tests that data is correctly transferred from ref server to S3."""
     some_date = str(datetime.date(2024, 2, 1))
     example_city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1]
@@ -38,8 +67,10 @@ async def test_data_pushed_to_s3_with_stats(run_dummy_moto):
     city = generate_example_cities()[EXAMPLE_ID_1]
 
     async with get_s3_client() as s3_client:
-        await create_bucket(s3_client, city.country)
-        await push_city_stats_to_s3(city, some_date, raw_city_stats, s3_client)
+        await create_bucket(s3_client, city.country, storage_state)
+        await push_city_stats_to_s3(
+            city, some_date, raw_city_stats, s3_client, storage_state
+        )
 
         metadata = await s3_client.head_object(
             Bucket=city.country, Key=f"{some_date}/{city.name}"
@@ -50,32 +81,268 @@ async def test_data_pushed_to_s3_with_stats(run_dummy_moto):
 
 
 @pytest.mark.asyncio
-async def test_data_pushed_to_s3_with_deletes_existing_aggregated_stats(run_dummy_moto):
-    """Tests that new data will delete related aggregated data as it has to be recalculated."""
-    some_date = str(datetime.date(2024, 2, 1))
-    example_city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1]
-    raw_city_stats = json.dumps(example_city_data).encode("utf-8")
+async def test_data_pushed_to_s3_updates_existing_aggregated_stats(
+    run_dummy_moto, storage_state
+):
+    """Tests that new data of one city updates existing aggregated stats without recomputing them."""
+    some_date = str(datetime.date(2024, 12, 1))
+    example_city_data = generate_example_city_data(some_date)
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_1],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_1]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        await create_aggregated_stats_for_country_and_date(
+            country, some_date, s3_client, storage_state
+        )
+
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_2],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_2]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+
+        metadata = (
+            await s3_client.head_object(
+                Bucket=country, Key=f"{some_date}/{AGGREGATED_STATS_FILE_NAME}"
+            )
+        )["Metadata"]
+        generation, in_flight = await get_generation(country, some_date, s3_client)
+        assert in_flight == 0
+        assert metadata["generation"] == str(generation)
+        assert Stats.create_stats_from_s3_metadata(metadata) == combine_stats(
+            create_city_stats_from_city_data(example_city_data[city_id])
+            for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2)
+        )
+
+
+@pytest.mark.asyncio
+async def test_data_pushed_again_updates_aggregated_stats_with_bus_types(
+    run_dummy_moto, storage_state
+):
+    """Tests that replaced data of one city updates existing aggregated stats including distinct bus types."""
+    some_date = str(datetime.date(2022, 6, 1))
+    example_city_data = generate_example_city_data(some_date)
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+            await push_city_stats_to_s3(
+                cities[city_id],
+                some_date,
+                json.dumps(example_city_data[city_id]).encode("utf-8"),
+                s3_client,
+                storage_state,
+            )
+        await create_aggregated_stats_for_country_and_date(
+            country, some_date, s3_client, storage_state
+        )
+
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_1],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_3]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+
+        metadata = (
+            await s3_client.head_object(
+                Bucket=country, Key=f"{some_date}/{AGGREGATED_STATS_FILE_NAME}"
+            )
+        )["Metadata"]
+        generation, _ = await get_generation(country, some_date, s3_client)
+
+    expected_stats = combine_stats(
+        create_city_stats_from_city_data(example_city_data[city_id])
+        for city_id in (EXAMPLE_ID_2, EXAMPLE_ID_3)
+    )
+    stats = Stats.create_stats_from_s3_metadata(metadata)
+    assert metadata["generation"] == str(generation)
+    assert stats == expected_stats
+    assert (
+        stats.create_response_from_stats()
+        == expected_stats.create_response_from_stats()
+    )
+
+
+@pytest.mark.asyncio
+async def test_data_change_updates_aggregated_stats_once(run_dummy_moto, storage_state):
+    """Tests that pushes of many cities in one data change update existing aggregated stats when it ends."""
+    some_date = datetime.date(2022, 6, 5)
+    example_city_data = generate_example_city_data(str(some_date))
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_1],
+            str(some_date),
+            json.dumps(example_city_data[EXAMPLE_ID_1]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        await create_aggregated_stats_for_country_and_date(
+            country, str(some_date), s3_client, storage_state
+        )
+
+        async with data_change(
+            [country], some_date, s3_client, storage_state
+        ) as change:
+            for city_id, data_id in (
+                (EXAMPLE_ID_1, EXAMPLE_ID_3),
+                (EXAMPLE_ID_2, EXAMPLE_ID_2),
+            ):
+                await stream_city_stats_to_s3(
+                    cities[city_id],
+                    some_date,
+                    iter_chunks(json.dumps(example_city_data[data_id]).encode("utf-8")),
+                    s3_client,
+                    storage_state,
+                    in_data_change=change,
+                )
+
+        metadata = (
+            await s3_client.head_object(
+                Bucket=country, Key=f"{some_date}/{AGGREGATED_STATS_FILE_NAME}"
+            )
+        )["Metadata"]
+        generation, _ = await get_generation(country, some_date, s3_client)
+
+    expected_stats = combine_stats(
+        create_city_stats_from_city_data(example_city_data[data_id])
+        for data_id in (EXAMPLE_ID_3, EXAMPLE_ID_2)
+    )
+    stats = Stats.create_stats_from_s3_metadata(metadata)
+    assert metadata["generation"] == str(generation)
+    assert stats == expected_stats
+    assert (
+        stats.create_response_from_stats()
+        == expected_stats.create_response_from_stats()
+    )
+
+
+@pytest.mark.asyncio
+async def test_data_change_that_never_finished_expires(
+    run_dummy_moto, storage_state, monkeypatch
+):
+    """Tests that push dying between its two generations blocks storing of aggregated stats only until lease ends."""
+    some_date = datetime.date(2022, 6, 2)
+    example_city_data = generate_example_city_data(str(some_date))[EXAMPLE_ID_1]
     city = generate_example_cities()[EXAMPLE_ID_1]
 
-    aggregated_file_key = f"{some_date}/{AGGREGATED_STATS_FILE_NAME}"
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await push_city_stats_to_s3(
+            city,
+            str(some_date),
+            json.dumps(example_city_data).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        # Intent generation of push that never creates its done generation.
+        dead_intent, in_flight = await s3_communication._create_next_generation(
+            city.country, some_date, s3_client
+        )
+        assert in_flight == 1
+        _, generation = await s3_communication._create_aggregated_stats_with_generation(
+            city.country, str(some_date), s3_client, storage_state
+        )
+        assert generation is None
+
+        monkeypatch.setattr(s3_communication, "AGGREGATED_STATS_DATA_CHANGE_LEASE_S", 0)
+        assert await get_generation(city.country, some_date, s3_client) == (
+            dead_intent,
+            0,
+        )
+        (
+            stats,
+            generation,
+        ) = await s3_communication._create_aggregated_stats_with_generation(
+            city.country, str(some_date), s3_client, storage_state
+        )
+        assert generation == dead_intent
+        assert stats == create_city_stats_from_city_data(example_city_data)
+
+
+@pytest.mark.asyncio
+async def test_ended_data_change_prunes_old_generations(
+    run_dummy_moto, storage_state, monkeypatch
+):
+    """Tests that generation objects don't pile up with repeated pushes."""
+    some_date = datetime.date(2022, 6, 4)
+    city = generate_example_cities()[EXAMPLE_ID_1]
+    # Every listed generation is older than retention.
+    monkeypatch.setattr(
+        s3_communication, "AGGREGATED_STATS_GENERATION_RETENTION_S", -60
+    )
 
     async with get_s3_client() as s3_client:
-        await create_bucket(s3_client, city.country)
+        await create_bucket(s3_client, city.country, storage_state)
+        for _ in range(3):
+            await push_city_stats_to_s3(
+                city,
+                some_date,
+                json.dumps(
+                    generate_example_city_data(str(some_date))[EXAMPLE_ID_1]
+                ).encode("utf-8"),
+                s3_client,
+                storage_state,
+            )
+        generations = await s3_client.list_objects_v2(
+            Bucket=city.country, Prefix=f"generations/{some_date}/"
+        )
+        assert [generation["Key"] for generation in generations["Contents"]] == [
+            f"generations/{some_date}/{6:012d}"
+        ]
+        assert await get_generation(city.country, some_date, s3_client) == (6, 0)
+
+
+@pytest.mark.asyncio
+async def test_outdated_aggregated_stats_are_not_used(run_dummy_moto, storage_state):
+    """Tests that aggregated stats created before the latest data change are recreated."""
+    some_date = str(datetime.date(2024, 12, 2))
+    example_city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1]
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await push_city_stats_to_s3(
+            city,
+            some_date,
+            json.dumps(example_city_data).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        # Aggregated stats without generation, as written before generations existed.
         await s3_client.put_object(
             Bucket=city.country,
-            Key=aggregated_file_key,
+            Key=f"{some_date}/{AGGREGATED_STATS_FILE_NAME}",
             Body=b"",
-            ContentType="application/json",
+            Metadata=combine_stats([]).create_s3_metadata_from_stats(),
         )
-        await push_city_stats_to_s3(city, some_date, raw_city_stats, s3_client)
 
-        with pytest.raises(ClientError) as client_error:
-            await s3_client.head_object(Bucket=city.country, Key=aggregated_file_key)
-        assert "Not Found" in str(client_error.value)
+        assert await get_aggregated_stats_for_country_and_date(
+            city.country, some_date, s3_client, storage_state
+        ) == create_city_stats_from_city_data(example_city_data)
 
 
 @pytest.mark.asyncio
-async def test_create_aggregated_stats_for_country_and_date(run_dummy_moto):
+async def test_create_aggregated_stats_for_country_and_date(
+    run_dummy_moto, storage_state
+):
     """Tests that data is correctly aggregated from relevant buckets and files.
 
     Test creates:
@@ -112,16 +379,28 @@ async def test_create_aggregated_stats_for_country_and_date(run_dummy_moto):
     city_in_irrelevant_country = City("Some_name", irrelevant_country, some_city_id)
 
     async with get_s3_client() as s3_client:
-        create_desired_bucket_task = create_bucket(s3_client, desired_country)
-        create_irrelevant_bucket_task = create_bucket(s3_client, irrelevant_country)
+        create_desired_bucket_task = create_bucket(
+            s3_client, desired_country, storage_state
+        )
+        create_irrelevant_bucket_task = create_bucket(
+            s3_client, irrelevant_country, storage_state
+        )
         await asyncio.gather(create_desired_bucket_task, create_irrelevant_bucket_task)
 
         push_data_from_desired_country_desired_date_tasks = [
             push_city_stats_to_s3(
-                relevant_city_1, desired_date, raw_city_stats_on_desired_date, s3_client
+                relevant_city_1,
+                desired_date,
+                raw_city_stats_on_desired_date,
+                s3_client,
+                storage_state,
             ),
             push_city_stats_to_s3(
-                relevant_city_2, desired_date, raw_city_stats_on_desired_date, s3_client
+                relevant_city_2,
+                desired_date,
+                raw_city_stats_on_desired_date,
+                s3_client,
+                storage_state,
             ),
         ]
 
@@ -130,12 +409,14 @@ async def test_create_aggregated_stats_for_country_and_date(run_dummy_moto):
             irrelevant_date,
             raw_city_stats_on_irrelevant_date,
             s3_client,
+            storage_state,
         )
         push_data_from_irrelevant_country_desired_date_task = push_city_stats_to_s3(
             city_in_irrelevant_country,
             desired_date,
             raw_city_stats_on_desired_date,
             s3_client,
+            storage_state,
         )
         await asyncio.gather(
             *push_data_from_desired_country_desired_date_tasks,
@@ -149,7 +430,7 @@ async def test_create_aggregated_stats_for_country_and_date(run_dummy_moto):
 
         # Act
         await create_aggregated_stats_for_country_and_date(
-            desired_country, desired_date, s3_client
+            desired_country, desired_date, s3_client, storage_state
         )
 
         # Assert
@@ -163,3 +444,695 @@ async def test_create_aggregated_stats_for_country_and_date(run_dummy_moto):
             Stats.create_stats_from_s3_metadata(metadata_of_aggregated_stats_file)
             == expected_aggregated_results
         )
+
+
+@pytest.mark.asyncio
+async def test_stream_city_stats_to_s3_multipart(run_dummy_moto, storage_state):
+    """Tests that data larger than part size is uploaded by parts with stats in metadata and staging is cleaned."""
+    some_date = str(datetime.date(2024, 2, 1))
+    # Roughly 2 parts of data.
+    example_city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1] * 40000
+    raw_city_stats = json.dumps(example_city_data).encode("utf-8")
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        stats = await stream_city_stats_to_s3(
+            city,
+            some_date,
+            iter_chunks(raw_city_stats),
+            s3_client,
+            storage_state,
+            MIN_PART_SIZE,
+            content_encoding="identity",
+        )
+
+        response = await s3_client.get_object(
+            Bucket=city.country, Key=f"{some_date}/{city.name}"
+        )
+        assert await response["Body"].read() == raw_city_stats
+        assert stats == create_city_stats_from_city_data(example_city_data)
+        assert Stats.create_stats_from_s3_metadata(response["Metadata"]) == stats
+        staging_files = await s3_client.list_objects_v2(
+            Bucket=city.country, Prefix=MULTIPART_UPLOAD_STAGING_PREFIX
+        )
+        assert "Contents" not in staging_files
+
+
+@pytest.mark.asyncio
+async def test_stream_city_stats_to_s3_aborted(run_dummy_moto, storage_state):
+    """Tests that failure in the middle of multipart upload leaves no objects or unfinished uploads."""
+    some_date = str(datetime.date(2024, 6, 1))
+    raw_city_stats = json.dumps(
+        generate_example_city_data(some_date)[EXAMPLE_ID_1] * 40000
+    ).encode("utf-8")
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async def failing_chunks():
+        async for chunk in iter_chunks(raw_city_stats[: MIN_PART_SIZE + 1]):
+            yield chunk
+        raise ConnectionError("Reference server connection lost.")
+
+    s3_calls = Counter()
+
+    def count_call(event_name, **_kwargs):
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        s3_client.meta.events.register("before-call.s3", count_call)
+        with pytest.raises(ConnectionError):
+            await stream_city_stats_to_s3(
+                city,
+                some_date,
+                failing_chunks(),
+                s3_client,
+                storage_state,
+                MIN_PART_SIZE,
+                content_encoding="identity",
+            )
+
+        assert s3_calls["CreateMultipartUpload"] == 1
+        assert s3_calls["AbortMultipartUpload"] == 1
+        for prefix in (f"{some_date}/{city.name}", MULTIPART_UPLOAD_STAGING_PREFIX):
+            assert "Contents" not in await s3_client.list_objects_v2(
+                Bucket=city.country, Prefix=prefix
+            )
+        assert "Uploads" not in await s3_client.list_multipart_uploads(
+            Bucket=city.country
+        )
+
+
+@pytest.mark.asyncio
+async def test_pushed_data_invalidates_cached_aggregated_stats(
+    run_dummy_moto, storage_state
+):
+    """Aggregated stats are served from cache until new data for the same country and date is pushed."""
+    some_date = str(datetime.date(2024, 7, 1))
+    example_city_data = generate_example_city_data(some_date)
+    cities = generate_example_cities()
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, cities[EXAMPLE_ID_1].country, storage_state)
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_1],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_1]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        await get_aggregated_stats_for_country_and_date(
+            cities[EXAMPLE_ID_1].country, some_date, s3_client, storage_state
+        )
+        hits = storage_state.aggregated_stats_cache.hits
+        await get_aggregated_stats_for_country_and_date(
+            cities[EXAMPLE_ID_1].country, some_date, s3_client, storage_state
+        )
+        assert storage_state.aggregated_stats_cache.hits == hits + 1
+
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_2],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_2]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        assert await get_aggregated_stats_for_country_and_date(
+            cities[EXAMPLE_ID_1].country, some_date, s3_client, storage_state
+        ) == combine_stats(
+            create_city_stats_from_city_data(example_city_data[city_id])
+            for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2)
+        )
+
+
+@pytest.mark.asyncio
+async def test_failed_data_change_invalidates_cached_aggregated_stats(
+    run_dummy_moto, storage_state
+):
+    """Data change that fails after some pushes doesn't leave old aggregated stats in cache."""
+    some_date = datetime.date(2024, 7, 2)
+    example_city_data = generate_example_city_data(str(some_date))
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_1],
+            str(some_date),
+            json.dumps(example_city_data[EXAMPLE_ID_1]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        await get_aggregated_stats_for_country_and_date(
+            country, str(some_date), s3_client, storage_state
+        )
+
+        with pytest.raises(ConnectionError):
+            async with data_change(
+                [country], some_date, s3_client, storage_state
+            ) as change:
+                await stream_city_stats_to_s3(
+                    cities[EXAMPLE_ID_2],
+                    some_date,
+                    iter_chunks(
+                        json.dumps(example_city_data[EXAMPLE_ID_2]).encode("utf-8")
+                    ),
+                    s3_client,
+                    storage_state,
+                    in_data_change=change,
+                )
+                raise ConnectionError("Reference server connection lost.")
+
+        assert storage_state.aggregated_stats_cache.get(country, str(some_date)) is None
+        assert await get_aggregated_stats_for_country_and_date(
+            country, str(some_date), s3_client, storage_state
+        ) == combine_stats(
+            create_city_stats_from_city_data(example_city_data[city_id])
+            for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2)
+        )
+
+
+@pytest.mark.asyncio
+async def test_aggregated_stats_for_dates_from_rollup(run_dummy_moto, storage_state):
+    """Range query creates monthly rollup. Its day is not used after new data for that day is pushed."""
+    some_dates = [str(datetime.date(2024, 8, day)) for day in (1, 2)]
+    cities = generate_example_cities()
+    city = cities[EXAMPLE_ID_1]
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await push_city_stats_to_s3(
+            city,
+            some_dates[0],
+            json.dumps(generate_example_city_data(some_dates[0])[EXAMPLE_ID_1]).encode(
+                "utf-8"
+            ),
+            s3_client,
+            storage_state,
+        )
+        expected_stats = {
+            some_dates[0]: create_city_stats_from_city_data(
+                generate_example_city_data(some_dates[0])[EXAMPLE_ID_1]
+            ),
+            some_dates[1]: combine_stats([]),
+        }
+        assert (
+            await get_aggregated_stats_for_country_and_dates(
+                city.country, some_dates, s3_client, storage_state
+            )
+            == expected_stats
+        )
+        rollup = await s3_client.get_object(Bucket=city.country, Key="rollups/2024-08")
+        # Dates without data are answered from country registry, not from rollup.
+        assert set(json.loads(await rollup["Body"].read())["days"]) == {some_dates[0]}
+
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_2],
+            some_dates[1],
+            json.dumps(generate_example_city_data(some_dates[1])[EXAMPLE_ID_2]).encode(
+                "utf-8"
+            ),
+            s3_client,
+            storage_state,
+        )
+        expected_stats[some_dates[1]] = create_city_stats_from_city_data(
+            generate_example_city_data(some_dates[1])[EXAMPLE_ID_2]
+        )
+        assert (
+            await get_aggregated_stats_for_country_and_dates(
+                city.country, some_dates, s3_client, storage_state
+            )
+            == expected_stats
+        )
+
+
+@pytest.mark.asyncio
+async def test_aggregated_stats_from_city_stats_index(
+    run_dummy_moto, monkeypatch, storage_state
+):
+    """Indexed cities are aggregated from paginated listing and cities without index entry from metadata."""
+    monkeypatch.setattr(s3_communication, "S3_LIST_PAGE_SIZE", 1)
+    some_date = str(datetime.date(2024, 9, 1))
+    example_city_data = generate_example_city_data(some_date)
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+    legacy_stats = Stats.create_stats_from_sums(3, 30, 0, 30)
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+            # Pushing twice must leave single index entry of the newest data.
+            for city_data in (
+                example_city_data[EXAMPLE_ID_3],
+                example_city_data[city_id],
+            ):
+                await push_city_stats_to_s3(
+                    cities[city_id],
+                    some_date,
+                    json.dumps(city_data).encode("utf-8"),
+                    s3_client,
+                    storage_state,
+                )
+        await s3_client.put_object(
+            Bucket=country,
+            Key=f"{some_date}/legacy-city",
+            Body=b"[]",
+            Metadata=legacy_stats.create_s3_metadata_from_stats(),
+        )
+
+        index = await s3_client.list_objects_v2(
+            Bucket=country, Prefix=f"{CITY_STATS_INDEX_PREFIX}/{some_date}/"
+        )
+        assert len(index["Contents"]) == 2
+        assert await create_aggregated_stats_for_country_and_date(
+            country, some_date, s3_client, storage_state
+        ) == combine_stats(
+            [
+                create_city_stats_from_city_data(example_city_data[EXAMPLE_ID_1]),
+                create_city_stats_from_city_data(example_city_data[EXAMPLE_ID_2]),
+                legacy_stats,
+            ]
+        )
+
+
+@pytest.mark.asyncio
+async def test_stream_city_stats_to_s3_with_city_columns(run_dummy_moto, storage_state):
+    """Columnar copy of multipart uploaded data is stored next to it and can be read by ranged GETs."""
+    some_date = str(datetime.date(2024, 10, 1))
+    city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1] * 40000
+    raw_city_stats = json.dumps(city_data).encode("utf-8")
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await stream_city_stats_to_s3(
+            city,
+            some_date,
+            iter_chunks(raw_city_stats),
+            s3_client,
+            storage_state,
+            MIN_PART_SIZE,
+            city_columns_enabled=True,
+            content_encoding="identity",
+        )
+        columns = await read_city_columns_from_s3(
+            city, some_date, ["passengers", "delay-seconds"], s3_client
+        )
+        assert columns["passengers"] == [
+            bus_details["passengers"] for bus_details in city_data
+        ]
+        assert sum(columns["delay-seconds"]) == sum(
+            parse_delay_s(bus_details["delay"]) for bus_details in city_data
+        )
+
+
+@pytest.mark.asyncio
+async def test_city_analytics_read_up_to_date_city_columns(
+    run_dummy_moto, storage_state
+):
+    """Cities with columnar copy are aggregated from it. Raw data is scanned for cities pushed without copy."""
+    some_date = str(datetime.date(2024, 10, 2))
+    cities = generate_example_cities()
+    example_city_data = generate_example_city_data(some_date)
+    country = cities[EXAMPLE_ID_1].country
+    requested_keys = Counter()
+
+    def count_get(params, **_kwargs):
+        requested_keys[params["Key"]] += 1
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+            await stream_city_stats_to_s3(
+                cities[city_id],
+                some_date,
+                iter_chunks(json.dumps(example_city_data[city_id]).encode("utf-8")),
+                s3_client,
+                storage_state,
+                city_columns_enabled=True,
+            )
+        await push_city_stats_to_s3(
+            cities[EXAMPLE_ID_2],
+            some_date,
+            json.dumps(example_city_data[EXAMPLE_ID_2][:1]).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        s3_client.meta.events.register("provide-client-params.s3.GetObject", count_get)
+        for group_by in ("city", "date", "bus-type", "hour"):
+            groups = await scan_city_analytics(
+                [country],
+                [some_date],
+                group_by,
+                s3_client,
+                StorageState(),
+                city_columns_enabled=True,
+            )
+            assert groups == await scan_city_analytics(
+                [country],
+                [some_date],
+                group_by,
+                s3_client,
+                StorageState(),
+                city_columns_enabled=False,
+            )
+
+    assert sum(group.bus_count for group in groups[country].values()) == (
+        len(example_city_data[EXAMPLE_ID_1]) + 1
+    )
+    assert requested_keys[f"{some_date}/{cities[EXAMPLE_ID_1].name}"] == 4
+    assert requested_keys[f"{some_date}/{cities[EXAMPLE_ID_2].name}"] == 8
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content_encoding", CONTENT_ENCODINGS)
+async def test_stream_city_stats_to_s3_encoded(
+    run_dummy_moto, content_encoding, storage_state
+):
+    """Data is uploaded with content encoding and decoded when read. Poorly compressible data needs multipart upload."""
+    some_date = str(datetime.date(2024, 11, 1))
+    rng = random.Random(0)
+    city_data = [
+        {**bus_details, "bus-type": rng.randbytes(32).hex()}
+        for bus_details in generate_example_city_data(some_date)[EXAMPLE_ID_1] * 40000
+    ]
+    raw_city_stats = json.dumps(city_data).encode("utf-8")
+    city = City(f"city-{content_encoding}", EXAMPLE_COUNTRY_1, EXAMPLE_ID_1)
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await stream_city_stats_to_s3(
+            city,
+            some_date,
+            iter_chunks(raw_city_stats),
+            s3_client,
+            storage_state,
+            MIN_PART_SIZE,
+            content_encoding=content_encoding,
+        )
+
+        response = await s3_client.head_object(
+            Bucket=city.country, Key=f"{some_date}/{city.name}"
+        )
+        if content_encoding == "identity":
+            assert "ContentEncoding" not in response
+        else:
+            assert response["ContentEncoding"] == content_encoding
+            assert response["ContentLength"] < len(raw_city_stats)
+        assert (
+            b"".join(
+                [
+                    chunk
+                    async for chunk in iter_raw_city_stats_from_s3(
+                        city, some_date, s3_client, storage_state
+                    )
+                ]
+            )
+            == raw_city_stats
+        )
+
+
+def test_unsupported_content_encoding_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported content encoding zstd"):
+        check_content_encoding("zstd")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_pushes_and_queries(run_dummy_moto):
+    """Many concurrent pushes and queries of the same dates never leave outdated aggregated stats or rollups behind.
+
+    In-process cache expires immediately, so every query goes to S3 as if each came from different app instance.
+    """
+    storage_state = StorageState(aggregated_stats_cache=StatsCache(1000, ttl_s=0))
+    some_dates = [str(datetime.date(2025, 1, day)) for day in (1, 2)]
+    cities = [
+        City(f"Stress city {index}", EXAMPLE_COUNTRY_1, index) for index in range(4)
+    ]
+    country = cities[0].country
+    versions = 3
+
+    def city_data(date: str, city_index: int, version: int) -> list[dict]:
+        return [
+            {**bus_details, "passengers": 100 * city_index + version}
+            for bus_details in generate_example_city_data(date)[EXAMPLE_ID_1]
+        ]
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+
+        async def push_versions(date, city_index):
+            for version in range(versions):
+                await push_city_stats_to_s3(
+                    cities[city_index],
+                    date,
+                    json.dumps(city_data(date, city_index, version)).encode("utf-8"),
+                    s3_client,
+                    storage_state,
+                )
+
+        async def query_until_done(pushes: asyncio.Future) -> None:
+            while not pushes.done():
+                await asyncio.gather(
+                    get_aggregated_stats_for_country_and_dates(
+                        country, some_dates, s3_client, storage_state
+                    ),
+                    *(
+                        get_aggregated_stats_for_country_and_date(
+                            country, date, s3_client, storage_state
+                        )
+                        for date in some_dates
+                    ),
+                )
+
+        pushes = asyncio.gather(
+            *(
+                push_versions(date, city_index)
+                for date in some_dates
+                for city_index in range(len(cities))
+            )
+        )
+        await asyncio.gather(pushes, *(query_until_done(pushes) for _ in range(3)))
+
+        expected_stats = {
+            date: combine_stats(
+                create_city_stats_from_city_data(
+                    city_data(date, city_index, versions - 1)
+                )
+                for city_index in range(len(cities))
+            )
+            for date in some_dates
+        }
+        assert (
+            await get_aggregated_stats_for_country_and_dates(
+                country, some_dates, s3_client, storage_state
+            )
+            == expected_stats
+        )
+        for date in some_dates:
+            assert (
+                await get_aggregated_stats_for_country_and_date(
+                    country, date, s3_client, storage_state
+                )
+                == expected_stats[date]
+            )
+            generation, in_flight = await get_generation(country, date, s3_client)
+            assert (generation, in_flight) == (2 * versions * len(cities), 0)
+            metadata = (
+                await s3_client.head_object(
+                    Bucket=country,
+                    Key=f"{date}/{AGGREGATED_STATS_FILE_NAME}",
+                )
+            )["Metadata"]
+            assert metadata["generation"] == str(generation)
+            assert Stats.create_stats_from_s3_metadata(metadata) == expected_stats[date]
+
+
+@pytest.mark.asyncio
+async def test_stored_aggregated_stats_are_read_by_listing_and_head(
+    run_dummy_moto, storage_state
+):
+    """Cold lookup of stored aggregated stats lists generations once and reads no generation object."""
+    some_date = str(datetime.date(2022, 6, 3))
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+    s3_calls = Counter()
+
+    def count_call(event_name, **_kwargs):
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+            await push_city_stats_to_s3(
+                cities[city_id],
+                some_date,
+                json.dumps(generate_example_city_data(some_date)[city_id]).encode(
+                    "utf-8"
+                ),
+                s3_client,
+                storage_state,
+            )
+        stored_stats = await create_aggregated_stats_for_country_and_date(
+            country, some_date, s3_client, storage_state
+        )
+        s3_client.meta.events.register("before-call.s3", count_call)
+
+        stats = await get_aggregated_stats_for_country_and_date(
+            country, some_date, s3_client, storage_state
+        )
+
+    assert stats == stored_stats
+    assert s3_calls == {"ListObjectsV2": 1, "HeadObject": 1}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_aggregations_share_s3_calls(run_dummy_moto):
+    """Concurrent cold requests for the same country and date make the same S3 calls as single request."""
+    storage_state = StorageState(aggregated_stats_cache=StatsCache(1000, ttl_s=3600))
+    some_dates = [str(datetime.date(2025, 2, day)) for day in (1, 2)]
+    cities = generate_example_cities()
+    country = cities[EXAMPLE_ID_1].country
+    s3_calls = Counter()
+
+    def count_call(event_name, **_kwargs):
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, country, storage_state)
+        for date in some_dates:
+            for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+                await push_city_stats_to_s3(
+                    cities[city_id],
+                    date,
+                    json.dumps(generate_example_city_data(date)[city_id]).encode(
+                        "utf-8"
+                    ),
+                    s3_client,
+                    storage_state,
+                )
+        s3_client.meta.events.register("before-call.s3", count_call)
+
+        await get_aggregated_stats_for_country_and_date(
+            country, some_dates[0], s3_client, storage_state
+        )
+        single_request_calls = s3_calls.copy()
+        s3_calls.clear()
+        results = await asyncio.gather(
+            *(
+                get_aggregated_stats_for_country_and_date(
+                    country, some_dates[1], s3_client, storage_state
+                )
+                for _ in range(10)
+            )
+        )
+
+    assert s3_calls == single_request_calls
+    assert s3_calls["PutObject"] == 1
+    assert (
+        results
+        == [
+            combine_stats(
+                create_city_stats_from_city_data(
+                    generate_example_city_data(some_dates[1])[city_id]
+                )
+                for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2)
+            )
+        ]
+        * 10
+    )
+
+
+@pytest.mark.asyncio
+async def test_range_query_finds_dates_pushed_by_other_instance(run_dummy_moto):
+    """Dates missing in country registry are looked up by one listing of generations of their month."""
+    storage_state = StorageState(country_registry=CountryRegistry(ttl_s=3600))
+    some_date = str(datetime.date(2025, 3, 1))
+    later_date = str(datetime.date(2025, 3, 20))
+    empty_dates = [str(datetime.date(2025, 3, day)) for day in range(2, 20)]
+    city = generate_example_cities()[EXAMPLE_ID_1]
+    example_city_data = generate_example_city_data(some_date)[EXAMPLE_ID_1]
+    s3_calls = Counter()
+
+    def count_call(event_name, **_kwargs):
+        s3_calls[event_name.rsplit(".", 1)[-1]] += 1
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        await push_city_stats_to_s3(
+            city,
+            some_date,
+            json.dumps(example_city_data).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        # Registry of another app instance that didn't push the data.
+        other_storage_state = StorageState(country_registry=CountryRegistry(ttl_s=3600))
+        stats = await get_aggregated_stats_for_country_and_dates(
+            city.country, [some_date, *empty_dates], s3_client, other_storage_state
+        )
+        assert stats[some_date] == create_city_stats_from_city_data(example_city_data)
+        assert all(stats[date] == combine_stats([]) for date in empty_dates)
+        assert other_storage_state.country_registry.knows_country(city.country)
+
+        # Pushed after the other instance refreshed its registry.
+        await push_city_stats_to_s3(
+            city,
+            later_date,
+            json.dumps(example_city_data).encode("utf-8"),
+            s3_client,
+            storage_state,
+        )
+        stats = await get_aggregated_stats_for_country_and_dates(
+            city.country, [later_date], s3_client, other_storage_state
+        )
+        assert stats[later_date] == create_city_stats_from_city_data(example_city_data)
+        assert other_storage_state.country_registry.dates_with_data(
+            city.country, [later_date]
+        ) == [later_date]
+
+        s3_client.meta.events.register("before-call.s3", count_call)
+        await get_aggregated_stats_for_country_and_dates(
+            city.country, empty_dates, s3_client, other_storage_state
+        )
+        assert s3_calls == {"ListObjectsV2": 1}
+
+
+@pytest.mark.asyncio
+async def test_raw_city_stats_read_through_object_disk_cache(run_dummy_moto, tmp_path):
+    """Repeated reads are served from local copy while its ETag is current. New data is downloaded again."""
+    cache = ObjectDiskCache(str(tmp_path), max_bytes=1024 * 1024)
+    storage_state = StorageState(object_disk_cache=cache)
+    some_date = str(datetime.date(2022, 5, 1))
+    city_data = generate_example_city_data(some_date)
+    city = generate_example_cities()[EXAMPLE_ID_1]
+
+    async def read_raw_city_stats() -> bytes:
+        return b"".join(
+            [
+                chunk
+                async for chunk in iter_raw_city_stats_from_s3(
+                    city, some_date, s3_client, storage_state, chunk_size=7
+                )
+            ]
+        )
+
+    async with get_s3_client() as s3_client:
+        await create_bucket(s3_client, city.country, storage_state)
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2):
+            raw_city_stats = json.dumps(city_data[city_id]).encode("utf-8")
+            await push_city_stats_to_s3(
+                city, some_date, raw_city_stats, s3_client, storage_state
+            )
+            assert await read_raw_city_stats() == raw_city_stats
+            assert await read_raw_city_stats() == raw_city_stats
+
+    counters = cache.counters()
+    assert counters.pop("stored_bytes") > 0
+    assert counters == {
+        "hits": 2,
+        "misses": 2,
+        "hit_ratio": 0.5,
+        "evictions": 0,
+        "entries": 1,
+    }
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_run():
+    single_flight: SingleFlight[str, int] = SingleFlight()
+    runs = 0
+
+    async def work() -> int:
+        nonlocal runs
+        runs += 1
+        run = runs
+        await asyncio.sleep(0.01)
+        return run
+
+    results = await asyncio.gather(*(single_flight.run("a", work) for _ in range(10)))
+    assert results == [1] * 10
+    assert await single_flight.run("a", work) == 2
+    assert single_flight.counters() == {"in_flight": 0, "started": 2, "joined": 9}
+
+
+@pytest.mark.asyncio
+async def test_error_is_raised_to_all_callers():
+    single_flight: SingleFlight[str, int] = SingleFlight()
+
+    async def failing_work() -> int:
+        await asyncio.sleep(0.01)
+        raise ValueError("Failed work")
+
+    results = await asyncio.gather(
+        *(single_flight.run("a", failing_work) for _ in range(3)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_waiting_caller_runs_work_when_first_caller_is_cancelled():
+    single_flight: SingleFlight[str, str] = SingleFlight()
+    started = asyncio.Event()
+
+    async def work() -> str:
+        started.set()
+        await asyncio.sleep(0.01)
+        return "done"
+
+    first = asyncio.create_task(single_flight.run("a", work))
+    await started.wait()
+    second = asyncio.create_task(single_flight.run("a", work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert single_flight.counters()["started"] == 2
+
+
+@pytest.mark.asyncio
+async def test_forgotten_call_is_not_joined():
+    single_flight: SingleFlight[str, int] = SingleFlight()
+    runs = 0
+
+    async def work() -> int:
+        nonlocal runs
+        runs += 1
+        run = runs
+        await asyncio.sleep(0.01)
+        return run
+
+    first = asyncio.create_task(single_flight.run("a", work))
+    await asyncio.sleep(0)
+    single_flight.forget("a")
+    assert await single_flight.run("a", work) == 2
+    assert await first == 1
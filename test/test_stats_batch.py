@@ -0,0 +1,68 @@
+from conftest import EXAMPLE_ID_1, generate_example_city_data
+
+from city_details_proccesing import combine_stats, create_city_stats_from_city_data
+from stats_batch import StatsBatch
+
+
+def test_combine_along_axes_matches_combine_stats():
+    """Combining batch along any axes gives the same stats as combine_stats of the same records."""
+    stats_by_labels = {}
+    for country in ("country-a", "country-b"):
+        for date in ("2024-01-01", "2024-01-02"):
+            city_data = generate_example_city_data(date)
+            for city_id, data in city_data.items():
+                stats_by_labels[(country, date, f"city{city_id}")] = (
+                    create_city_stats_from_city_data(data)
+                )
+    batch = StatsBatch()
+    # Records of one group are not all consecutive.
+    for (country, date, city), stats in sorted(
+        stats_by_labels.items(), key=lambda item: item[0][2]
+    ):
+        batch.append(stats, country, date, city)
+
+    by_country_and_date = batch.combine(keep=("country", "date"))
+    assert len(by_country_and_date) == 4
+    for index in range(len(by_country_and_date)):
+        country, date, city = by_country_and_date.labels(index)
+        assert city == ""
+        expected = combine_stats(
+            stats
+            for labels, stats in sorted(
+                stats_by_labels.items(), key=lambda item: item[0][2]
+            )
+            if labels[:2] == (country, date)
+        )
+        combined = by_country_and_date.stats(index)
+        assert combined == expected
+        assert (
+            combined.create_response_from_stats()
+            == expected.create_response_from_stats()
+        )
+
+    everything = batch.combine()
+    assert everything.labels(0) == ("", "", "")
+    assert everything.stats(0) == by_country_and_date.combine().stats(0)
+
+
+def test_s3_metadata_round_trip_keeps_encoded_sketches():
+    stats = create_city_stats_from_city_data(
+        generate_example_city_data("2024-01-01")[EXAMPLE_ID_1]
+    )
+    metadata = stats.create_s3_metadata_from_stats()
+    batch = StatsBatch()
+    batch.append_s3_metadata(metadata, country="country-a")
+    # Metadata written before sketches.
+    batch.append_s3_metadata(
+        {
+            "bus-count": "2",
+            "passenger-count": "3",
+            "exist-accident": "0",
+            "average-delay-s": "5",
+        }
+    )
+
+    assert batch.s3_metadata(0) == metadata
+    assert batch.stats(0) == stats
+    assert batch.stats(1).total_delay_s == 10
+    assert batch.combine().stats(0).delay_sketch is None
@@ -0,0 +1,65 @@
+from city_details_proccesing import Stats
+from stats_cache import StatsCache
+
+SOME_STATS = Stats.create_stats_from_sums(1, 10, 0, 20)
+OTHER_STATS = Stats.create_stats_from_sums(2, 20, 1, 80)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = StatsCache(max_entries=2, ttl_s=10)
+    cache.put("a", "2024-02-01", SOME_STATS, cache.fill_token())
+    cache.put("b", "2024-02-01", SOME_STATS, cache.fill_token())
+    cache.get("a", "2024-02-01")
+    cache.put("c", "2024-02-01", SOME_STATS, cache.fill_token())
+
+    assert cache.get("a", "2024-02-01") == SOME_STATS
+    assert cache.get("b", "2024-02-01") is None
+    assert cache.counters() == {
+        "entries": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+    }
+
+
+def test_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = StatsCache(max_entries=2, ttl_s=10, clock=clock)
+    cache.put("a", "2024-02-01", SOME_STATS, cache.fill_token())
+
+    clock.now = 9.9
+    assert cache.get("a", "2024-02-01") == SOME_STATS
+    clock.now = 10
+    assert cache.get("a", "2024-02-01") is None
+    assert cache.expirations == 1
+
+
+def test_stats_computed_before_invalidation_are_not_cached():
+    """Computation that started before invalidation could read old data, so its result is dropped."""
+    cache = StatsCache(max_entries=10, ttl_s=10)
+    fill_token = cache.fill_token()
+    cache.invalidate("a", "2024-02-01")
+    cache.put("a", "2024-02-01", SOME_STATS, fill_token)
+    assert cache.get("a", "2024-02-01") is None
+
+    cache.put("a", "2024-02-01", OTHER_STATS, cache.fill_token())
+    assert cache.get("a", "2024-02-01") == OTHER_STATS
+
+
+def test_invalidation_of_evicted_key_is_respected():
+    cache = StatsCache(max_entries=1, ttl_s=10)
+    fill_token = cache.fill_token()
+    cache.invalidate("a", "2024-02-01")
+    cache.put("b", "2024-02-01", SOME_STATS, cache.fill_token())
+
+    cache.put("a", "2024-02-01", SOME_STATS, fill_token)
+    assert cache.get("a", "2024-02-01") is None
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from conftest import EXAMPLE_ID_1, generate_example_city_data
+
+from city_details_proccesing import (
+    CityStatsParser,
+    create_city_stats_from_city_data,
+    feed_city_stats_parser,
+)
+from stats_executor import ExecutorKind, StatsExecutor
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ("process", "thread", "inline"))
+async def test_stats_executor_parses_in_order(kind: ExecutorKind):
+    """Parser state is carried between executor jobs, even across processes."""
+    city_data = generate_example_city_data("irrelevant")[EXAMPLE_ID_1]
+    raw_city_data = json.dumps(city_data).encode("utf-8")
+    stats_executor = StatsExecutor(kind, max_workers=2, max_pending=2)
+    stats_executor.start()
+    try:
+        parser = CityStatsParser()
+        for start in range(0, len(raw_city_data), 10):
+            parser = await stats_executor.run(
+                feed_city_stats_parser, parser, raw_city_data[start : start + 10]
+            )
+    finally:
+        stats_executor.shutdown()
+
+    assert parser.finish() == create_city_stats_from_city_data(city_data)
+
+
+@pytest.mark.asyncio
+async def test_stats_executor_bounds_pending_jobs():
+    """Jobs over max_pending wait for free slot instead of queueing in executor."""
+    release = threading.Event()
+    stats_executor = StatsExecutor("thread", max_workers=4, max_pending=2)
+    stats_executor.start()
+    try:
+        jobs = [asyncio.create_task(stats_executor.run(release.wait)) for _ in range(5)]
+        await asyncio.sleep(0.1)
+        assert stats_executor.pending == 2
+        release.set()
+        await asyncio.gather(*jobs)
+        assert stats_executor.pending == 0
+    finally:
+        stats_executor.shutdown()
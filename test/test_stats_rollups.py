@@ -0,0 +1,75 @@
+import datetime
+import json
+
+import pytest
+
+from city_details_proccesing import Stats
+from stats_rollups import (
+    ROLLUP_FORMAT_VERSION,
+    RollupDays,
+    decode_rollup,
+    encode_rollup,
+    rollup_keys_for_dates,
+)
+
+
+def test_rollup_keys_for_dates_monthly():
+    dates = [
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 1, 2),
+        datetime.date(2024, 3, 1),
+    ]
+    assert rollup_keys_for_dates(dates, None) == {
+        "rollups/2024-01": dates[:2],
+        "rollups/2024-03": dates[2:],
+    }
+
+
+def test_rollup_keys_for_dates_yearly():
+    """Years covered by enough months are read from yearly rollup, others from monthly rollups."""
+    dates = [datetime.date(2023, month, 1) for month in (1, 2, 3)] + [
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 2, 1),
+    ]
+    assert rollup_keys_for_dates(dates, 3) == {
+        "rollups/2023": dates[:3],
+        "rollups/2024-01": dates[3:4],
+        "rollups/2024-02": dates[4:],
+    }
+
+
+def test_rollup_encode_decode():
+    days = {
+        "2024-01-01": (Stats.create_stats_from_sums(1, 2, 1, 3.5), 4),
+        "2024-01-02": (Stats.create_stats_from_sums(0, 0, 0, 0), 0),
+    }
+    rollup_days = RollupDays()
+    for date, day in days.items():
+        rollup_days[date] = day
+    # Replaced day is encoded only once.
+    rollup_days["2024-01-02"] = days["2024-01-02"]
+    assert decode_rollup(encode_rollup(rollup_days)) == (days, False)
+
+
+def test_rollup_of_newer_version_is_rejected():
+    with pytest.raises(ValueError):
+        decode_rollup(
+            json.dumps({"version": ROLLUP_FORMAT_VERSION + 1, "days": {}}).encode()
+        )
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_rollup_without_generations_is_migrated(version):
+    """Days of rollups without generations can't be validated, so they are dropped to be recomputed."""
+    rollup = {
+        "version": version,
+        "days": {
+            "2024-01-01": {
+                "bus-count": "2",
+                "passenger-count": "20",
+                "exist-accident": "1",
+                "average-delay-s": "30",
+            }
+        },
+    }
+    assert decode_rollup(json.dumps(rollup).encode()) == ({}, True)
@@ -0,0 +1,95 @@
+import math
+import random
+
+from conftest import EXAMPLE_ID_1, EXAMPLE_ID_2, generate_example_city_data
+
+from city_details_proccesing import (
+    Stats,
+    combine_stats,
+    create_city_stats_from_city_data,
+)
+from s3_communication import _parse_city_stats_index_key, city_stats_index_key
+from stats_sketches import (
+    DELAY_SKETCH_MAX_BUCKETS,
+    DELAY_SKETCH_RELATIVE_ACCURACY,
+    DelaySketch,
+    DistinctSketch,
+)
+
+
+def test_delay_sketch_quantiles_within_relative_accuracy():
+    """Merged sketches give nearest-rank quantiles within relative accuracy of exact ones."""
+    delays_s = [random.Random(seed).expovariate(1 / 600) for seed in range(10_000)]
+    sketches = [DelaySketch(), DelaySketch()]
+    sketches[0].add(delays_s[:3000])
+    sketches[1].add(delays_s[3000:])
+    sketches[0].merge(sketches[1])
+
+    sorted_delays_s = sorted(delays_s)
+    for quantile in (0.5, 0.95, 0.99):
+        exact_s = sorted_delays_s[math.ceil(quantile * len(delays_s)) - 1]
+        assert math.isclose(
+            sketches[0].quantile(quantile),
+            exact_s,
+            rel_tol=DELAY_SKETCH_RELATIVE_ACCURACY,
+        )
+
+
+def test_delay_sketch_subtract_and_encode():
+    sketch = DelaySketch()
+    sketch.add([0, 0, 1.5, 300, 300, 5400])
+    removed = DelaySketch()
+    removed.add([0, 300])
+    sketch.subtract(removed)
+
+    expected = DelaySketch()
+    expected.add([0, 1.5, 300, 5400])
+    assert sketch == expected
+    assert DelaySketch.decode(sketch.encode()) == sketch
+
+
+def test_delay_sketch_collapses_lowest_buckets():
+    sketch = DelaySketch()
+    sketch.add(2.0**exponent for exponent in range(-100, 100))
+
+    assert len(sketch.buckets) == DELAY_SKETCH_MAX_BUCKETS
+    assert math.isclose(
+        sketch.quantile(0.99), 2.0**97, rel_tol=DELAY_SKETCH_RELATIVE_ACCURACY
+    )
+    assert DelaySketch.decode(sketch.encode()) == sketch
+
+
+def test_distinct_sketch_estimate_merge_and_encode():
+    sketches = [DistinctSketch(), DistinctSketch()]
+    sketches[0].add(f"bus-type-{index}" for index in range(10))
+    sketches[1].add(f"bus-type-{index}" for index in range(5, 14))
+    sketches[0].merge(sketches[1])
+
+    assert DistinctSketch().estimate() == 0
+    assert sketches[0].estimate() == 14
+    assert DistinctSketch.decode(sketches[0].encode()) == sketches[0]
+
+    many = DistinctSketch()
+    many.add(str(index) for index in range(100_000))
+    assert math.isclose(many.estimate(), 100_000, rel_tol=0.2)
+    assert DistinctSketch.decode(many.encode()) == many
+
+
+def test_sketches_survive_metadata_and_index_key():
+    city_data = generate_example_city_data("irrelevant")
+    stats = combine_stats(
+        create_city_stats_from_city_data(city_data[city_id])
+        for city_id in (EXAMPLE_ID_1, EXAMPLE_ID_2)
+    )
+    expected_response = stats.create_response_from_stats()
+    assert expected_response["distinct_bus_types"] == 4
+
+    from_metadata = Stats.create_stats_from_s3_metadata(
+        stats.create_s3_metadata_from_stats()
+    )
+    _, index_metadata = _parse_city_stats_index_key(
+        city_stats_index_key("2024-01-01", "city", stats)
+    )
+    from_index_key = Stats.create_stats_from_s3_metadata(index_metadata)
+    assert from_metadata.create_response_from_stats() == expected_response
+    assert from_index_key.create_response_from_stats() == expected_response